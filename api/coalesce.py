@@ -0,0 +1,45 @@
+import hashlib
+import json
+import logging
+
+import redis
+
+from worker.redis_client import get_async_redis
+
+# Identical lookups received while a matching task is still running share
+# that task instead of enqueuing a new one (single-flight).
+INFLIGHT_PREFIX = "dnstester:inflight:"
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def lookup_key(domain: str, qtype: str | list, dns_servers: list | str, tls_insecure_skip_verify: bool, options: dict) -> str:
+    """
+    Hash a lookup so that requests differing only by server order share the
+    same key. dns_servers may also be an inventory version.
+    """
+    if isinstance(dns_servers, str):
+        servers = dns_servers
+    else:
+        servers = sorted((server["target"], sorted(server.get("tags") or [])) for server in dns_servers)
+    payload = json.dumps([domain.lower().rstrip("."), qtype, servers, tls_insecure_skip_verify, sorted(options.items())])
+    return f"{INFLIGHT_PREFIX}{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+async def claim(key: str, task_id: str, ttl: int, in_flight) -> str | None:
+    """
+    Register task_id as the in-flight task of key. Returns the id of a
+    matching task that is still in flight (in_flight(task_id) is true), or
+    None when the caller must enqueue task_id itself.
+    """
+    try:
+        client = get_async_redis()
+        if await client.set(key, task_id, nx=True, ex=ttl):
+            return None
+        existing = await client.get(key)
+        if existing is not None and in_flight(existing.decode()):
+            return existing.decode()
+        await client.set(key, task_id, ex=ttl)
+    except redis.RedisError as e:
+        dnstester_logger.warning(f"lookup coalescing unavailable: {e}")
+    return None
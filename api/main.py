@@ -1,30 +1,160 @@
+import asyncio
+import ipaddress
 import os
+import signal
+import json
 import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from celery import chain, group
+from celery.result import GroupResult
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import generate_latest, multiprocess
 
 from cli.version import API_VERSION
 
+from worker.lookup import wrk as celery_app
 from worker.lookup import lookup_dns as celery_lookup_dns
+from worker.lookup import lookup_dns_batch as celery_lookup_dns_batch
 from worker.lookup import get_metrics as celery_get_metrics
+from worker.lookup import load_test as celery_load_test
+from worker.lookup import reverse_sweep as celery_reverse_sweep
+from worker.lookup import fail_sweep_chunks as celery_fail_sweep_chunks
+from worker import celeryconfig, history, latency, queues, streams, sweep
+from worker.inventory import Inventory, filter_servers
+from worker.metrics import generate_multiprocess_latest, process_identifier
+from worker.q import server_results
 
+from api import coalesce, metrics
 from api.config import load_yaml_config, get_dns_servers_from_yaml
-from api.models_api import DNSLookup, ReverseDNSLookup, DNSLookupStatus
+from api.reload import ConfigReloader
+from api.models_api import DNSLookup, ReverseDNSLookup, DNSLookupStatus, DNSBatchLookup, DNSBatchStatus, ReverseSweep, ReverseSweepStatus, LoadTest, LoadTestStatus, LatencyReport, HistoryResults, HistoryAggregate
 
 dnstester_logger = logging.getLogger('dnstester')
 
+# Load the configuration file
+DEFAULT_CONFIG_PATH = os.getenv("CONFIG_PATH", "conf/config.yaml")
+app_config = load_yaml_config(DEFAULT_CONFIG_PATH)
+
+# Reload the configuration when the file changes (0 disables polling, SIGHUP still reloads)
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", 5))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    reloader = ConfigReloader(app, DEFAULT_CONFIG_PATH, CONFIG_RELOAD_INTERVAL)
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reloader.reload()))
+    except (NotImplementedError, RuntimeError, AttributeError):
+        dnstester_logger.debug("SIGHUP reload not available")
+    watcher = asyncio.create_task(reloader.watch()) if CONFIG_RELOAD_INTERVAL > 0 else None
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    if celeryconfig.PROMETHEUS_MULTIPROC_DIR:
+        # the live gauges of this process (dns_config_reload_failed) leave the aggregate
+        multiprocess.mark_process_dead(process_identifier())
+
 app = FastAPI(
     title="DNS Tester API",
     version=API_VERSION,
+    lifespan=lifespan,
 )
 
-# Load the configuration file
-DEFAULT_CONFIG_PATH = os.getenv("CONFIG_PATH", "conf/config.yaml")
-app_config = load_yaml_config(DEFAULT_CONFIG_PATH)
+# Number of queries per Celery task for batch lookups
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 50))
+
+# Number of addresses per Celery task for reverse sweeps, and the largest prefixes accepted
+SWEEP_CHUNK_SIZE = int(os.getenv("SWEEP_CHUNK_SIZE", 256))
+SWEEP_MAX_ADDRESSES = int(os.getenv("SWEEP_MAX_ADDRESSES", 65536))
+SWEEP_MAX_IPV6_ADDRESSES = int(os.getenv("SWEEP_MAX_IPV6_ADDRESSES", 4096))
+# Largest number of chunks of a rate-limited sweep, sent as one Celery chain message
+SWEEP_MAX_CHAINED_CHUNKS = int(os.getenv("SWEEP_MAX_CHAINED_CHUNKS", 1024))
+# Seconds between two checks of the chunks of a streamed sweep
+SWEEP_POLL_INTERVAL = 0.5
 
-# Set the app configuration into the app state
+# Share the task of an identical lookup still in flight instead of enqueuing a new one
+LOOKUP_COALESCING = os.getenv("LOOKUP_COALESCING", "false").lower() == "true"
+LOOKUP_COALESCING_TTL = int(os.getenv("LOOKUP_COALESCING_TTL", 60))
+
+# Close result streams that received no event for this many seconds
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", 30))
+
+# Set the app configuration into the app state, with its server list expanded once
 app.state.app_config = app_config
+app.state.inventory = Inventory(get_dns_servers_from_yaml(app_config))
+
+async def resolve_dns_servers(request) -> list | str:
+    """
+    Return the DNS servers of the request, narrowed by its tag and protocol
+    filters. Without servers in the request, they are selected from the
+    YAML inventory, or, without filters, the version of the inventory is
+    returned for the workers to resolve themselves (the full list when the
+    inventory could not be published to Redis).
+    """
+    filters = {"include_tags": request.include_tags, "exclude_tags": request.exclude_tags, "protocols": request.protocols}
+    filtered = any(value is not None for value in filters.values())
+
+    if request.dns_servers:
+        dns_servers = [server.model_dump() for server in request.dns_servers]
+        if filtered:
+            dns_servers = filter_servers(dns_servers, **filters)
+    else:
+        inventory = app.state.inventory
+        dnstester_logger.debug(f"No DNS servers provided in request, use inventory {inventory.version}")
+        if not filtered and inventory.servers:
+            if await inventory.publish():
+                return inventory.version
+            return inventory.servers
+        dns_servers = inventory.select(**filters)
+
+    # Check if the selection is empty
+    if not dns_servers:
+        detail = "No DNS servers match the filters" if filtered else "No DNS servers provided"
+        raise HTTPException(status_code=400, detail=detail)
+
+    return dns_servers
+
+def task_options(request) -> dict:
+    """
+    Return the answer cache, early-return and consistency options of the
+    request passed to the worker tasks. Defaults are omitted so that tasks keep their plain
+    positional signature.
+    """
+    return request.model_dump(
+        include={"bypass_cache", "max_staleness", "first_answers", "deadline", "hedge", "consistency"}, exclude_defaults=True,
+    )
+
+def task_in_flight(task_id: str) -> bool:
+    return not celery_lookup_dns.AsyncResult(task_id).ready()
+
+async def enqueue_lookup(endpoint: str, domain: str, qtype: str | list, dns_servers: list, request) -> tuple[str, bool]:
+    """
+    Enqueue a lookup task on the queue of its priority and return (task_id, coalesced).
+    With LOOKUP_COALESCING, the id of an identical task still in flight is returned instead.
+    """
+    options = task_options(request)
+    args = (domain, qtype, dns_servers, request.tls_insecure_skip_verify)
+    queue = queues.BULK if request.priority == queues.BULK else queues.INTERACTIVE
+    if not LOOKUP_COALESCING:
+        if queue == queues.BULK:
+            return celery_lookup_dns.apply_async(args=args, kwargs=options, queue=queue).id, False
+        return celery_lookup_dns.delay(*args, **options).id, False
+
+    task_id = str(uuid.uuid4())
+    key = coalesce.lookup_key(*args, options)
+    existing = await coalesce.claim(key, task_id, LOOKUP_COALESCING_TTL, task_in_flight)
+    if existing is not None:
+        dnstester_logger.debug(f"Lookup coalesced with in-flight task {existing}")
+        metrics.dns_coalesced_requests.labels(endpoint=endpoint).inc()
+        return existing, True
+
+    celery_lookup_dns.apply_async(args=args, kwargs=options, task_id=task_id, queue=queue)
+    return task_id, False
 
 @app.post("/dns-lookup")
 async def enqueue_dns_lookup(request: DNSLookup):
@@ -33,21 +163,11 @@ async def enqueue_dns_lookup(request: DNSLookup):
     """
     dnstester_logger.debug(f"Received DNS lookup request: {request}")
 
-    # Get the request
-    dns_servers = [server.model_dump() for server in request.dns_servers] if request.dns_servers else []
+    dns_servers = await resolve_dns_servers(request)
 
-    # Checck if DNS inventory is empty
-    if not dns_servers:
-        dnstester_logger.debug(f"No DNS servers provided in request, get from YAML config")
-        dns_servers = get_dns_servers_from_yaml(app.state.app_config)
-        dnstester_logger.debug(f"{len(dns_servers)} DNS servers detected")
-
-    # Check if DNS inventory is still empty
-    if not dns_servers:
-        raise HTTPException(status_code=400, detail="No DNS servers provided")
-    
-    task = celery_lookup_dns.delay(request.domain, request.qtype, dns_servers, request.tls_insecure_skip_verify)
-    return {"task_id": task.id, "message": "DNS lookup enqueued"}
+    task_id, coalesced = await enqueue_lookup("dns-lookup", request.domain, request.qtype, dns_servers, request)
+    message = "DNS lookup coalesced with an in-flight task" if coalesced else "DNS lookup enqueued"
+    return {"task_id": task_id, "message": message}
 
 @app.post("/reverse-lookup")
 async def enqueue_reverse_lookup(request: ReverseDNSLookup):
@@ -58,20 +178,230 @@ async def enqueue_reverse_lookup(request: ReverseDNSLookup):
 
     # Get from request
     reverse_ip = str(request.reverse_ip)
-    dns_servers = [server.model_dump() for server in request.dns_servers] if request.dns_servers else []
+    dns_servers = await resolve_dns_servers(request)
 
-    # Checck if DNS inventory is empty
-    if not dns_servers:
-        dnstester_logger.debug(f"No DNS servers provided in request, get from YAML config")
-        dns_servers = get_dns_servers_from_yaml(app.state.app_config)
-        dnstester_logger.debug(f"{len(dns_servers)} DNS servers detected")
+    task_id, coalesced = await enqueue_lookup("reverse-lookup", reverse_ip, "PTR", dns_servers, request)
+    message = "Reverse DNS lookup coalesced with an in-flight task" if coalesced else "Reverse DNS lookup enqueued"
+    return {"task_id": task_id, "message": message}
 
-    # Check if DNS inventory is still empty
-    if not dns_servers:
-        raise HTTPException(status_code=400, detail="No DNS servers provided")
-    
-    task = celery_lookup_dns.delay(reverse_ip, "PTR", dns_servers, request.tls_insecure_skip_verify)
-    return {"task_id": task.id, "message": "Reverse DNS lookup enqueued"}
+@app.post("/dns-lookup/batch")
+async def enqueue_dns_lookup_batch(request: DNSBatchLookup):
+    """
+    Enqueue a batch of DNS lookups, split in chunks dispatched as one Celery group.
+    """
+    dnstester_logger.debug(f"Received DNS batch lookup request with {len(request.queries)} queries")
+
+    dns_servers = await resolve_dns_servers(request)
+
+    chunk_size = request.chunk_size or BATCH_CHUNK_SIZE
+    queries = [(query.domain, query.qtype) for query in request.queries]
+    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+
+    options = task_options(request)
+    batch = group(
+        celery_lookup_dns_batch.s(chunk, dns_servers, request.tls_insecure_skip_verify, **options) for chunk in chunks
+    ).apply_async()
+    # Keep the group in the result backend so that progress can be fetched by id
+    batch.save()
+
+    return {
+        "batch_id": batch.id,
+        "total_chunks": len(chunks),
+        "total_queries": len(queries),
+        "message": "DNS batch lookup enqueued",
+    }
+
+def group_progress(batch, include_results: bool) -> dict:
+    """
+    Aggregate progress of the chunks of a saved group, and optionally the
+    concatenated results of its finished chunks.
+    """
+    completed, failed, completed_items = 0, 0, 0
+    results = [] if include_results else None
+    for child in batch.results:
+        if child.state == "SUCCESS":
+            completed += 1
+            completed_items += len(child.result)
+            if include_results:
+                results.extend(child.result)
+        elif child.state == "FAILURE":
+            failed += 1
+
+    total = len(batch.results)
+    if completed + failed == total:
+        status = "FAILURE" if failed else "SUCCESS"
+    elif completed + failed == 0 and all(child.state == "PENDING" for child in batch.results):
+        status = "PENDING"
+    else:
+        status = "PROGRESS"
+
+    return {
+        "status": status,
+        "total_chunks": total,
+        "completed_chunks": completed,
+        "failed_chunks": failed,
+        "completed_items": completed_items,
+        "progress": round(100 * (completed + failed) / total, 2) if total else 100.0,
+        "results": results,
+    }
+
+@app.get("/dns-lookup/batch/{batch_id}", response_model=DNSBatchStatus)
+async def get_batch_status(batch_id: str, include_results: bool = False):
+    """
+    Get the aggregate progress of a batch, and optionally the results of its finished chunks.
+    """
+    batch = GroupResult.restore(batch_id, app=celery_app)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    progress = group_progress(batch, include_results)
+    return {
+        "batch_id": batch_id,
+        "batch_status": progress.pop("status"),
+        "completed_queries": progress.pop("completed_items"),
+        **progress,
+    }
+
+@app.post("/reverse-lookup/sweep")
+async def enqueue_reverse_sweep(request: ReverseSweep):
+    """
+    Enqueue PTR lookups of every address of a prefix, split in chunks dispatched as one Celery group.
+    """
+    dnstester_logger.debug(f"Received reverse sweep request for {request.cidr}")
+
+    network = ipaddress.ip_network(request.cidr)
+    max_addresses = SWEEP_MAX_IPV6_ADDRESSES if network.version == 6 else SWEEP_MAX_ADDRESSES
+    if network.num_addresses > max_addresses:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Prefix {network} has {network.num_addresses} addresses, at most {max_addresses} can be swept",
+        )
+
+    chunk_size = request.chunk_size or SWEEP_CHUNK_SIZE
+    nb_chunks = -(-network.num_addresses // chunk_size)
+    if request.qps and nb_chunks > SWEEP_MAX_CHAINED_CHUNKS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A rate-limited sweep has at most {SWEEP_MAX_CHAINED_CHUNKS} chunks, {network} needs {nb_chunks}: raise chunk_size",
+        )
+
+    dns_servers = await resolve_dns_servers(request)
+
+    options = request.model_dump(include={"qps", "bypass_cache", "max_staleness"}, exclude_defaults=True)
+    chunks = [
+        celery_reverse_sweep.s(first, count, dns_servers, request.tls_insecure_skip_verify, **options)
+        for first, count in sweep.chunk_bounds(network, chunk_size)
+    ]
+    if request.qps:
+        # chunks run one after the other so that each server receives qps in total: a chain,
+        # not countdowns, as ETAs past the broker visibility timeout are delivered again
+        batch = GroupResult(str(uuid.uuid4()), [], app=celery_app)
+        for chunk in chunks:
+            chunk.set(task_id=str(uuid.uuid4()), immutable=True)
+            chunk.on_error(celery_fail_sweep_chunks.s(batch.id))
+            batch.results.append(celery_app.AsyncResult(chunk.id))
+        # saved first: the error callback finds the chunks to fail from it
+        batch.save()
+        chain(*chunks).apply_async()
+    else:
+        batch = group(chunks).apply_async()
+        batch.save()
+
+    return {
+        "sweep_id": batch.id,
+        "cidr": str(network),
+        "total_chunks": len(chunks),
+        "total_addresses": network.num_addresses,
+        "message": "Reverse sweep enqueued",
+    }
+
+@app.get("/reverse-lookup/sweep/{sweep_id}", response_model=ReverseSweepStatus)
+async def get_sweep_status(sweep_id: str, include_results: bool = False):
+    """
+    Get the aggregate progress of a reverse sweep, and optionally the rows of its finished chunks.
+    """
+    batch = GroupResult.restore(sweep_id, app=celery_app)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+
+    progress = group_progress(batch, include_results)
+    return {
+        "sweep_id": sweep_id,
+        "sweep_status": progress.pop("status"),
+        "completed_addresses": progress.pop("completed_items"),
+        "rows": progress.pop("results"),
+        **progress,
+    }
+
+def finished_chunks(pending: dict) -> dict:
+    """
+    Return the state and result of the chunks which succeeded or failed, by index.
+    """
+    finished = {}
+    for index, child in pending.items():
+        state = child.state
+        if state in ("SUCCESS", "FAILURE"):
+            finished[index] = (state, child.result)
+    return finished
+
+async def stream_sweep_events(batch):
+    """
+    Yield the rows of each chunk of a sweep as Server-Sent Events when the chunk completes, then a summary.
+    """
+    pending = dict(enumerate(batch.results))
+    nb_rows, failed = 0, 0
+    while pending:
+        # reading the state of a chunk queries the result backend: keep it off the event loop
+        finished = await asyncio.to_thread(finished_chunks, pending)
+        for index, (state, result) in finished.items():
+            if state == "SUCCESS":
+                for row in result:
+                    nb_rows += 1
+                    yield sse_event("row", row)
+            else:
+                failed += 1
+                yield sse_event("error", {"chunk": index, "error": str(result)})
+            del pending[index]
+        if pending:
+            await asyncio.sleep(SWEEP_POLL_INTERVAL)
+    yield sse_event("summary", {"nb_rows": nb_rows, "failed_chunks": failed, "total_chunks": len(batch.results)})
+
+@app.get("/reverse-lookup/sweep/{sweep_id}/stream")
+async def stream_sweep(sweep_id: str):
+    """
+    Stream the rows of a reverse sweep with Server-Sent Events, chunk by chunk as they complete.
+    """
+    batch = GroupResult.restore(sweep_id, app=celery_app)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    return StreamingResponse(
+        stream_sweep_events(batch),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/load-test")
+async def enqueue_load_test(request: LoadTest):
+    """
+    Enqueue a load test sending a sustained, rate-controlled stream of queries to each server.
+    """
+    dnstester_logger.debug(f"Received load test request: {request.qps} qps for {request.duration}s")
+
+    dns_servers = await resolve_dns_servers(request)
+    queries = [(query.domain, query.qtype) for query in request.queries]
+
+    task = celery_load_test.delay(dns_servers, queries, request.qps, request.duration, request.tls_insecure_skip_verify)
+    return {"task_id": task.id, "message": "Load test enqueued"}
+
+@app.get("/load-test/{task_id}", response_model=LoadTestStatus)
+async def get_load_test_status(task_id: str):
+    """
+    Get the status and statistics of a load test.
+    """
+    task_result = celery_load_test.AsyncResult(task_id)
+    if task_result.failed():
+        return {"task_id": task_id, "task_status": task_result.state, "error": str(task_result.result)}
+    return {"task_id": task_id, "task_status": task_result.state, "task_result": task_result.result}
 
 @app.get("/tasks/{task_id}", response_model=DNSLookupStatus)
 async def get_task_status(task_id: str):
@@ -81,6 +411,132 @@ async def get_task_status(task_id: str):
     task_result = celery_lookup_dns.AsyncResult(task_id)
     return {"task_id": task_id, "task_status": task_result.state, "task_result": task_result.result}
     
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_task_events(task_id: str):
+    """
+    Yield the per-server results of a task as Server-Sent Events, then a summary.
+    """
+    last_id, last_event = "0", time.monotonic()
+    while True:
+        events = await streams.read(task_id, last_id)
+        for last_id, event, data in events:
+            yield sse_event(event, data)
+            if event == "summary":
+                return
+        if events:
+            last_event = time.monotonic()
+            continue
+
+        # Nothing published: the task may have finished before the stream
+        # was created, or the stream already expired. Replay from the backend.
+        task_result = celery_lookup_dns.AsyncResult(task_id)
+        if task_result.ready() and not await streams.exists(task_id):
+            if task_result.successful():
+                details = task_result.result["details"]
+                nb_ok = 0
+                for server, result in server_results(details):
+                    nb_ok += result.get("command_status") == "ok"
+                    yield sse_event("result", {"server": server, "result": result})
+                yield sse_event("summary", {
+                    "duration": task_result.result["duration"],
+                    "nb_servers": len(details),
+                    "nb_ok": nb_ok,
+                })
+            else:
+                yield sse_event("error", {"task_status": task_result.state})
+            return
+
+        if time.monotonic() - last_event > STREAM_IDLE_TIMEOUT:
+            yield sse_event("error", {"task_status": task_result.state, "error": "stream idle timeout"})
+            return
+
+@app.get("/tasks/{task_id}/stream")
+async def stream_task_status(task_id: str):
+    """
+    Stream the results of a lookup task with Server-Sent Events, one event per server as it answers.
+    """
+    if not celeryconfig.RESULT_STREAMING:
+        raise HTTPException(status_code=404, detail="Result streaming is disabled")
+    return StreamingResponse(
+        stream_task_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/latency", response_model=LatencyReport)
+async def get_latency(
+    window: int = Query(300, ge=1, description="Sliding window in seconds"),
+    server: str | None = None,
+    dns_protocol: str | None = None,
+    qtype: str | None = None,
+):
+    """
+    Latency percentiles per server, protocol and qtype over the last window seconds, merged across all workers.
+    """
+    if not celeryconfig.LATENCY_SKETCHES:
+        raise HTTPException(status_code=404, detail="Latency sketches are disabled")
+    if window > celeryconfig.LATENCY_RETENTION:
+        raise HTTPException(status_code=400, detail=f"window must not exceed {celeryconfig.LATENCY_RETENTION} seconds")
+
+    series = []
+    for (series_server, series_protocol, series_qtype), sketch in sorted((await latency.read_window(window)).items()):
+        if server not in (None, series_server) or dns_protocol not in (None, series_protocol) or qtype not in (None, series_qtype):
+            continue
+        series.append({
+            "server": series_server,
+            "dns_protocol": series_protocol,
+            "qtype": series_qtype,
+            "count": sketch.count,
+            **{name: round(sketch.quantile(q), 3) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))},
+        })
+    return {"window": window, "series": series}
+
+def history_range(start: datetime | None, end: datetime | None) -> tuple[float, float]:
+    """
+    Return the (start, end) timestamps of a history query, the last 24 hours by default.
+    """
+    if not celeryconfig.HISTORY_DIR:
+        raise HTTPException(status_code=404, detail="Result history is disabled")
+    end_ts = end.timestamp() if end else time.time()
+    start_ts = start.timestamp() if start else end_ts - 86400
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return start_ts, end_ts
+
+@app.get("/history/results", response_model=HistoryResults)
+def get_history_results(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    target: str | None = None,
+    protocol: str | None = None,
+    qtype: str | None = None,
+    limit: int = Query(1000, ge=1, le=100000),
+):
+    """
+    Persisted per-server results between start and end, oldest first.
+    """
+    start_ts, end_ts = history_range(start, end)
+    results = history.query_results(start_ts, end_ts, target=target, protocol=protocol, qtype=qtype, limit=limit)
+    return {"start": start_ts, "end": end_ts, "results": results}
+
+@app.get("/history/aggregate", response_model=HistoryAggregate)
+def get_history_aggregate(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    interval: int = Query(3600, ge=60, description="Aggregation interval in seconds"),
+    target: str | None = None,
+    protocol: str | None = None,
+    qtype: str | None = None,
+):
+    """
+    Count, errors, average and percentiles of the latency per interval and per server.
+    """
+    start_ts, end_ts = history_range(start, end)
+    series = history.aggregate(start_ts, end_ts, interval, target=target, protocol=protocol, qtype=qtype)
+    return {"start": start_ts, "end": end_ts, "interval": interval, "series": series}
+
 @app.get("/status")
 async def health_check():
     """
@@ -93,5 +549,17 @@ async def prom():
     """
     Expose Prometheus metrics.
     """
+    try:
+        for queue, depth in (await asyncio.to_thread(queues.queue_depths, celery_app)).items():
+            metrics.dns_queue_depth.labels(queue=queue).set(depth)
+    except Exception as e:
+        dnstester_logger.warning(f"unable to get the depth of the task queues: {e}")
+
+    if celeryconfig.PROMETHEUS_MULTIPROC_DIR:
+        # Aggregated from the files of every API, worker and beat process
+        return Response(generate_multiprocess_latest(), media_type="text/plain")
+
+    # Without a shared directory, only the registry of the worker that picked up the task is returned
     metrics_data = celery_get_metrics.delay().get(timeout=5)
+    metrics_data += generate_latest(metrics.registry).decode('utf-8')
     return Response(metrics_data, media_type="text/plain")
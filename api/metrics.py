@@ -0,0 +1,38 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+# Imported first so that multiprocess mode also applies to the API metrics
+import worker.metrics  # noqa: F401
+
+# Metrics of the API process itself. In multiprocess mode they are written
+# to the shared directory like the worker metrics, otherwise they are
+# appended to the metrics fetched from a worker on /metrics.
+registry = CollectorRegistry()
+
+dns_coalesced_requests = Counter(
+    "dns_coalesced_requests",
+    "Number of lookup requests served by an identical in-flight task",
+    ["endpoint"],
+    registry=registry
+)
+
+dns_queue_depth = Gauge(
+    "dns_queue_depth",
+    "Number of tasks waiting in each Celery queue, sampled on scrape",
+    ["queue"],
+    registry=registry,
+    multiprocess_mode="mostrecent"
+)
+
+dns_config_reloads = Counter(
+    "dns_config_reloads",
+    "Number of configuration reloads, per result (success or failure)",
+    ["result"],
+    registry=registry
+)
+
+dns_config_reload_failed = Gauge(
+    "dns_config_reload_failed",
+    "1 when the last configuration reload failed and the previous configuration is still in use",
+    registry=registry,
+    multiprocess_mode="livemax"
+)
@@ -1,8 +1,13 @@
-from pydantic import BaseModel, Field, field_validator, IPvAnyAddress
+import ipaddress
+
+from pydantic import BaseModel, Field, field_validator, model_validator, IPvAnyAddress
 from typing import List, Dict, Literal, Optional
 
+from worker.config import QUERY_TYPES, QueryType  # noqa: F401
+
 # List of allowed protocols
 ALLOWED_PROTOCOLS = ("udp://", "tcp://", "https://", "quic://", "tls://")
+
 class DNSServer(BaseModel):
     target: str = Field(..., description="DNS server target with protocol")
     tags: Optional[List[str]] = Field(default=[], description="Optional list of tags for the DNS server")
@@ -17,13 +22,63 @@ class DNSServer(BaseModel):
 class ReverseDNSLookup(BaseModel):
     reverse_ip: IPvAnyAddress = Field(..., description="IP address to resolve via PTR")
     dns_servers: Optional[List[DNSServer]] = Field(None, description="List of DNS servers to use")
+    include_tags: Optional[List[str]] = Field(None, description="Only use the servers having at least one of these tags")
+    exclude_tags: Optional[List[str]] = Field(None, description="Leave out the servers having any of these tags")
+    protocols: Optional[List[Literal["do53", "dot", "doh", "doq"]]] = Field(None, description="Only use the servers of these protocols")
     tls_insecure_skip_verify: bool = Field(False, description="Skip TLS cert verification (for TLS-based queries)")
+    bypass_cache: bool = Field(False, description="Always query the servers, ignoring the answer cache")
+    max_staleness: int = Field(0, ge=0, description="Accept cached answers expired for up to this many seconds")
+    first_answers: Optional[int] = Field(None, ge=1, description="Complete the lookup once this many servers answered NOERROR, cancelling the other queries")
+    deadline: Optional[float] = Field(None, gt=0, le=300, description="Complete the lookup after this many seconds, cancelling the outstanding queries")
+    hedge: bool = Field(False, description="Query the servers in order, moving to the next one when a server fails or is slower than its usual 95th percentile (implies first_answers=1 when not set)")
+    priority: Literal["interactive", "bulk"] = Field("interactive", description="Queue of the lookup task: interactive lookups never wait behind bulk ones")
+    consistency: bool = Field(False, description="Compare the answers of the servers and report consensus clusters and outliers")
 
 class DNSLookup(BaseModel):
     domain: str = Field(..., description="Domain name to query")
     dns_servers: Optional[List[DNSServer]] = Field(None, description="List of DNS servers to use")
-    qtype: Literal["A", "CNAME", "PTR", "TXT", "AAAA"] = Field(..., description="DNS query type")
+    include_tags: Optional[List[str]] = Field(None, description="Only use the servers having at least one of these tags")
+    exclude_tags: Optional[List[str]] = Field(None, description="Leave out the servers having any of these tags")
+    protocols: Optional[List[Literal["do53", "dot", "doh", "doq"]]] = Field(None, description="Only use the servers of these protocols")
+    qtype: QueryType | List[QueryType] = Field(..., description="DNS query type, or a list of query types resolved in the same task (results grouped by server, then by qtype)")
     tls_insecure_skip_verify: bool = Field(False, title="TLS Insecure Skip Verify", description="Skip TLS certificate verification (for TLS-based queries)")
+    bypass_cache: bool = Field(False, description="Always query the servers, ignoring the answer cache")
+    max_staleness: int = Field(0, ge=0, description="Accept cached answers expired for up to this many seconds")
+    first_answers: Optional[int] = Field(None, ge=1, description="Complete the lookup once this many servers answered NOERROR, cancelling the other queries")
+    deadline: Optional[float] = Field(None, gt=0, le=300, description="Complete the lookup after this many seconds, cancelling the outstanding queries")
+    hedge: bool = Field(False, description="Query the servers in order, moving to the next one when a server fails or is slower than its usual 95th percentile (implies first_answers=1 when not set)")
+    priority: Literal["interactive", "bulk"] = Field("interactive", description="Queue of the lookup task: interactive lookups never wait behind bulk ones")
+    consistency: bool = Field(False, description="Compare the answers of the servers and report consensus clusters and outliers")
+
+    @field_validator('qtype')
+    @classmethod
+    def check_qtypes(cls, v):
+        if isinstance(v, list):
+            if not v:
+                raise ValueError("qtype must list at least one query type")
+            return list(dict.fromkeys(v))
+        return v
+
+    @model_validator(mode="after")
+    def check_multi_qtype_options(self):
+        if isinstance(self.qtype, list) and (self.first_answers or self.hedge):
+            raise ValueError("first_answers and hedge only apply to single-qtype lookups")
+        return self
+
+class BatchQuery(BaseModel):
+    domain: str = Field(..., description="Domain name to query")
+    qtype: QueryType = Field(..., description="DNS query type")
+
+class DNSBatchLookup(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=100000, description="List of (domain, qtype) to query")
+    dns_servers: Optional[List[DNSServer]] = Field(None, description="List of DNS servers to use for every query")
+    include_tags: Optional[List[str]] = Field(None, description="Only use the servers having at least one of these tags")
+    exclude_tags: Optional[List[str]] = Field(None, description="Leave out the servers having any of these tags")
+    protocols: Optional[List[Literal["do53", "dot", "doh", "doq"]]] = Field(None, description="Only use the servers of these protocols")
+    tls_insecure_skip_verify: bool = Field(False, title="TLS Insecure Skip Verify", description="Skip TLS certificate verification (for TLS-based queries)")
+    chunk_size: Optional[int] = Field(None, ge=1, le=1000, description="Number of queries per Celery task (default from BATCH_CHUNK_SIZE)")
+    bypass_cache: bool = Field(False, description="Always query the servers, ignoring the answer cache")
+    max_staleness: int = Field(0, ge=0, description="Accept cached answers expired for up to this many seconds")
 
 class DNSAnswer(BaseModel):
     """Represents a single DNS answer record."""
@@ -34,7 +89,7 @@ class DNSAnswer(BaseModel):
     
 class DNSLookupResult(BaseModel):
     """Represents the result of a DNS lookup request."""
-    command_status: str = Field(..., description="Status of the DNS command execution (ok/error).")
+    command_status: str = Field(..., description="Status of the DNS command execution (ok/error/skipped/unanswered).")
     time_ms: Optional[float] = Field(None, description="Time taken for the DNS query in milliseconds.")
     tags: Optional[List[str]] = Field(default=None, description="List of tags for classification")
     rcode: Optional[str] = Field(None, description="Response code (e.g., NoError, NXDomain, etc.).")
@@ -43,16 +98,184 @@ class DNSLookupResult(BaseModel):
     answers: Optional[List[DNSAnswer]] = Field(None, description="List of DNS answer records.")
     error: Optional[str] = Field(None, description="Error message if the query failed.")
     dns_protocol: Optional[str] = Field(None, description="DNS protocol (e.g., Do53, DoT, DoH and DoQ).")
+    connection_reused: Optional[bool] = Field(None, description="Whether a pooled DoT/DoH/DoQ connection was reused.")
+    handshake_ms: Optional[float] = Field(None, description="Connection setup (TCP+TLS or QUIC handshake) time in milliseconds, included in time_ms.")
+    session_resumed: Optional[bool] = Field(None, description="Whether a new TLS/QUIC connection resumed a previous session.")
+    cached: Optional[bool] = Field(None, description="Whether the result was served from the answer cache.")
+    cache_age: Optional[float] = Field(None, description="Seconds since a cached result was fetched from the server.")
+
+class ConsistencyCluster(BaseModel):
+    """Servers that returned the same response code and answer set."""
+    rcode: Optional[str] = Field(None, description="Response code of the servers.")
+    answers_hash: str = Field(..., description="Hash of the normalized answer set, TTLs excluded.")
+    answers: List[str] = Field(..., description="Normalized answer values.")
+    servers: List[str] = Field(..., description="Servers of the cluster.")
+    ttl_min: Optional[int] = Field(None, description="Lowest answer TTL in the cluster.")
+    ttl_max: Optional[int] = Field(None, description="Highest answer TTL in the cluster.")
+
+class ConsistencyReport(BaseModel):
+    """Comparison of the answers of the servers of a lookup."""
+    clusters: List[ConsistencyCluster] = Field(..., description="Clusters of identical answers, largest (the consensus) first.")
+    agreement: Optional[float] = Field(None, description="Share of the answering servers in the consensus cluster.")
+    outliers: Dict[str, List[str]] = Field(..., description="Reasons (rcode, answers, ttl_skew, protocol_divergence) per outlier server.")
 
 class DNSLookupResults(BaseModel):
     """Encapsulates the details and duration of the DNS lookup results."""
-    details: Dict[str, DNSLookupResult] = Field(
-        ..., description="Results of the DNS query for each server."
+    details: Dict[str, DNSLookupResult | Dict[str, DNSLookupResult]] = Field(
+        ..., description="Results of the DNS query for each server (for each server and qtype for multi-qtype lookups)."
     )
     duration: Optional[float] = Field(None, description="Duration of the DNS lookup task in seconds.")
+    consistency: Optional[ConsistencyReport | Dict[str, ConsistencyReport]] = Field(None, description="Answer comparison, when requested (per qtype for multi-qtype lookups).")
 
 class DNSLookupStatus(BaseModel):
     """Represents the response of a DNS task lookup request."""
     task_id: str = Field(..., description="Unique identifier for the DNS lookup task.")
     task_status: str = Field(..., description="Current status of the task (e.g., PENDING, SUCCESS).")
-    task_result: Optional[DNSLookupResults] = Field(None, description="Results of the DNS lookup.")
\ No newline at end of file
+    task_result: Optional[DNSLookupResults] = Field(None, description="Results of the DNS lookup.")
+
+class DNSBatchResult(DNSLookupResults):
+    """Results of one query of a batch."""
+    domain: str = Field(..., description="The queried domain name.")
+    qtype: str = Field(..., description="Query type.")
+
+class DNSBatchStatus(BaseModel):
+    """Represents the aggregate progress of a batch lookup."""
+    batch_id: str = Field(..., description="Unique identifier for the batch.")
+    batch_status: str = Field(..., description="PENDING, PROGRESS, SUCCESS or FAILURE.")
+    total_chunks: int = Field(..., description="Number of Celery tasks of the batch.")
+    completed_chunks: int = Field(..., description="Number of tasks that completed successfully.")
+    failed_chunks: int = Field(..., description="Number of tasks that failed.")
+    completed_queries: int = Field(..., description="Number of queries of the completed tasks.")
+    progress: float = Field(..., description="Percentage of finished tasks.")
+    results: Optional[List[DNSBatchResult]] = Field(None, description="Results of the completed tasks, when requested.")
+
+class ReverseSweep(BaseModel):
+    cidr: str = Field(..., description="IPv4 or IPv6 prefix whose addresses are resolved via PTR")
+    dns_servers: Optional[List[DNSServer]] = Field(None, description="List of DNS servers to use")
+    include_tags: Optional[List[str]] = Field(None, description="Only use the servers having at least one of these tags")
+    exclude_tags: Optional[List[str]] = Field(None, description="Leave out the servers having any of these tags")
+    protocols: Optional[List[Literal["do53", "dot", "doh", "doq"]]] = Field(None, description="Only use the servers of these protocols")
+    tls_insecure_skip_verify: bool = Field(False, title="TLS Insecure Skip Verify", description="Skip TLS certificate verification (for TLS-based queries)")
+    chunk_size: Optional[int] = Field(None, ge=1, le=4096, description="Number of addresses per Celery task (default from SWEEP_CHUNK_SIZE)")
+    qps: Optional[float] = Field(None, gt=0, le=10000, description="Queries per second sent to each server (unlimited when not set)")
+    bypass_cache: bool = Field(False, description="Always query the servers, ignoring the answer cache")
+    max_staleness: int = Field(0, ge=0, description="Accept cached answers expired for up to this many seconds")
+
+    @field_validator('cidr')
+    @classmethod
+    def check_cidr(cls, v):
+        # host bits are ignored: 192.0.2.10/24 sweeps 192.0.2.0/24
+        return str(ipaddress.ip_network(v.strip(), strict=False))
+
+class ReverseSweepRow(BaseModel):
+    """PTR names and response codes of one address, per server."""
+    ip: str = Field(..., description="The resolved address.")
+    ptr: Dict[str, List[str]] = Field(..., description="PTR names per server, for the servers that returned some.")
+    rcode: Dict[str, Optional[str]] = Field(..., description="Response code per server, or the command status when the query failed.")
+
+class ReverseSweepStatus(BaseModel):
+    """Represents the aggregate progress of a reverse sweep."""
+    sweep_id: str = Field(..., description="Unique identifier for the sweep.")
+    sweep_status: str = Field(..., description="PENDING, PROGRESS, SUCCESS or FAILURE.")
+    total_chunks: int = Field(..., description="Number of Celery tasks of the sweep.")
+    completed_chunks: int = Field(..., description="Number of tasks that completed successfully.")
+    failed_chunks: int = Field(..., description="Number of tasks that failed.")
+    completed_addresses: int = Field(..., description="Number of addresses of the completed tasks.")
+    progress: float = Field(..., description="Percentage of finished tasks.")
+    rows: Optional[List[ReverseSweepRow]] = Field(None, description="Rows of the completed tasks, when requested.")
+
+class LoadTest(BaseModel):
+    dns_servers: Optional[List[DNSServer]] = Field(None, description="List of DNS servers to load, each at the full rate")
+    include_tags: Optional[List[str]] = Field(None, description="Only use the servers having at least one of these tags")
+    exclude_tags: Optional[List[str]] = Field(None, description="Leave out the servers having any of these tags")
+    protocols: Optional[List[Literal["do53", "dot", "doh", "doq"]]] = Field(None, description="Only use the servers of these protocols")
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=100000, description="Query mix, sent in a round-robin")
+    qps: float = Field(..., gt=0, le=100000, description="Target queries per second per server")
+    duration: float = Field(..., gt=0, le=3600, description="Duration of the test in seconds")
+    tls_insecure_skip_verify: bool = Field(False, title="TLS Insecure Skip Verify", description="Skip TLS certificate verification (for TLS-based queries)")
+
+class LoadTestLatency(BaseModel):
+    """Latency percentiles in milliseconds, measured from the scheduled send time."""
+    p50: Optional[float] = None
+    p90: Optional[float] = None
+    p99: Optional[float] = None
+    p999: Optional[float] = None
+    max: Optional[float] = None
+
+class LoadTestServerResult(BaseModel):
+    """Load test statistics of one server."""
+    sent: int = Field(..., description="Number of queries sent.")
+    completed: int = Field(..., description="Number of queries answered.")
+    timeouts: int = Field(..., description="Number of queries not answered within DNS_QUERY_TIMEOUT.")
+    errors: int = Field(..., description="Number of queries failed for another reason.")
+    local_errors: int = Field(0, description="Number of queries not sent for lack of local resources (file descriptors, buffers, ports).")
+    achieved_qps: float = Field(..., description="Answered queries per second.")
+    timeout_rate: float = Field(..., description="Ratio of timed out queries.")
+    error_rate: float = Field(..., description="Ratio of failed queries.")
+    rcodes: Dict[str, int] = Field(..., description="Number of answers per response code.")
+    latency_ms: LoadTestLatency
+    dns_protocol: Optional[str] = Field(None, description="DNS protocol (e.g., Do53, DoT, DoH and DoQ).")
+
+class LoadTestResults(BaseModel):
+    details: Dict[str, LoadTestServerResult] = Field(..., description="Statistics for each server.")
+    qps: float = Field(..., description="Target queries per second per server.")
+    duration: float = Field(..., description="Duration of the load test task in seconds.")
+
+class LoadTestStatus(BaseModel):
+    """Represents the status of a load test task."""
+    task_id: str = Field(..., description="Unique identifier for the load test task.")
+    task_status: str = Field(..., description="Current status of the task (e.g., PENDING, SUCCESS).")
+    task_result: Optional[LoadTestResults] = Field(None, description="Results of the load test.")
+    error: Optional[str] = Field(None, description="Error message if the task failed.")
+
+class LatencySeries(BaseModel):
+    """Latency percentiles of one (server, protocol, qtype) over the window, in milliseconds."""
+    server: str = Field(..., description="DNS server target.")
+    dns_protocol: str = Field(..., description="DNS protocol (e.g., Do53, DoT, DoH and DoQ).")
+    qtype: str = Field(..., description="Query type.")
+    count: int = Field(..., description="Number of answers in the window.")
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+    p999: Optional[float] = None
+
+class LatencyReport(BaseModel):
+    """Latency percentiles merged across all workers over a sliding window."""
+    window: int = Field(..., description="Window in seconds.")
+    series: List[LatencySeries]
+
+class HistoryResult(BaseModel):
+    """One persisted result of a server for a query."""
+    ts: float = Field(..., description="Unix timestamp of the lookup.")
+    target: str = Field(..., description="DNS server target.")
+    protocol: Optional[str] = Field(None, description="DNS protocol (e.g., Do53, DoT, DoH and DoQ).")
+    domain: Optional[str] = Field(None, description="The queried domain name.")
+    qtype: Optional[str] = Field(None, description="Query type.")
+    status: str = Field(..., description="Status of the DNS command execution (ok/error).")
+    rcode: Optional[str] = Field(None, description="Response code.")
+    time_ms: Optional[float] = Field(None, description="Time taken for the DNS query in milliseconds.")
+    answer_hash: Optional[str] = Field(None, description="Hash of the answer section, independent of the record order.")
+
+class HistoryResults(BaseModel):
+    start: float
+    end: float
+    results: List[HistoryResult]
+
+class HistoryBucket(BaseModel):
+    """Aggregated results of a (target, protocol, qtype) over one interval."""
+    ts: int = Field(..., description="Unix timestamp of the start of the interval.")
+    target: str
+    protocol: Optional[str] = None
+    qtype: Optional[str] = None
+    count: int = Field(..., description="Number of results.")
+    errors: int = Field(..., description="Number of failed lookups.")
+    avg_ms: Optional[float] = None
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+class HistoryAggregate(BaseModel):
+    start: float
+    end: float
+    interval: int
+    series: List[HistoryBucket]
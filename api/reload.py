@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import os
+
+from api import metrics
+from api.config import get_dns_servers_from_yaml, load_yaml_config
+from worker.inventory import Inventory
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+class ConfigReloader:
+    """
+    Reload the YAML configuration of an app when its file changes (polled
+    every interval seconds) or on demand (SIGHUP). An invalid file leaves
+    the current configuration in place.
+    """
+
+    def __init__(self, app, path: str, interval: float):
+        self.app = app
+        self.path = path
+        self.interval = interval
+        self.mtime = self.file_mtime()
+        self.lock = asyncio.Lock()
+
+    def file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def reload(self) -> bool:
+        async with self.lock:
+            self.mtime = self.file_mtime()
+            try:
+                config = await asyncio.to_thread(load_yaml_config, self.path)
+                inventory = Inventory(get_dns_servers_from_yaml(config))
+            except Exception as e:
+                dnstester_logger.error(f"configuration {self.path} not reloaded, keeping the current one: {e}")
+                metrics.dns_config_reloads.labels(result="failure").inc()
+                metrics.dns_config_reload_failed.set(1)
+                return False
+
+            if inventory.version == self.app.state.inventory.version:
+                inventory = self.app.state.inventory
+            else:
+                # workers must be able to resolve the version before any task refers to it
+                await inventory.publish()
+
+            # no await between the two: requests see either the old or the new pair
+            self.app.state.app_config, self.app.state.inventory = config, inventory
+            dnstester_logger.info(f"configuration {self.path} reloaded, inventory {inventory.version} with {len(inventory.servers)} servers")
+            metrics.dns_config_reloads.labels(result="success").inc()
+            metrics.dns_config_reload_failed.set(0)
+            return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.file_mtime() != self.mtime:
+                await self.reload()
@@ -1,8 +1,12 @@
 import argparse
 import ipaddress
+import itertools
+import json
 import re
 import sys
 import time
+from collections import deque
+from collections.abc import Iterator
 from typing import Any
 
 import requests
@@ -12,36 +16,136 @@ from cli.domains_from_file import input_file
 
 API_BASE_URL = "http://localhost:5000"
 
+# Queries sent per /dns-lookup/batch request when --batch reads an input file
+BATCH_SUBMIT_SIZE = 10000
+# Largest query mix accepted by /load-test: only that many lines of --input-file are read
+LOAD_TEST_MAX_QUERIES = 100000
 
-def post_dns_lookup(api_url: str, domain: str, dns_servers=None, qtype: str = "A", tls_insecure_skip_verify: bool = False):
+QTYPE_CHOICES = ["A", "AAAA", "CAA", "CNAME", "DNSKEY", "DS", "HTTPS", "MX", "NAPTR", "NS", "PTR", "SOA", "SRV", "SVCB", "TLSA", "TXT"]
+
+
+def post_dns_lookup(api_url: str, domain: str, dns_servers=None, qtype: str = "A", tls_insecure_skip_verify: bool = False, priority: str = "interactive", consistency: bool = False):
     payload = {
         "domain": domain,
         "dns_servers": [{"target": dns} for dns in dns_servers] if dns_servers else None,
         "qtype": qtype,
         "tls_insecure_skip_verify": tls_insecure_skip_verify,
+        "priority": priority,
+        "consistency": consistency,
     }
     response = requests.post(f"{api_url}/dns-lookup", json=payload, timeout=30)
     response.raise_for_status()
     return response.json()["task_id"]
 
 
-def post_reverse_lookup(api_url: str, ip: str, dns_servers=None, tls_insecure_skip_verify: bool = False):
+def post_reverse_lookup(api_url: str, ip: str, dns_servers=None, tls_insecure_skip_verify: bool = False, priority: str = "interactive", consistency: bool = False):
     payload = {
         "reverse_ip": ip,
         "dns_servers": [{"target": dns} for dns in dns_servers] if dns_servers else None,
         "tls_insecure_skip_verify": tls_insecure_skip_verify,
+        "priority": priority,
+        "consistency": consistency,
     }
     response = requests.post(f"{api_url}/reverse-lookup", json=payload, timeout=30)
     response.raise_for_status()
     return response.json()["task_id"]
 
 
+def post_dns_lookup_batch(api_url: str, queries: list[tuple[str, str]], dns_servers=None, tls_insecure_skip_verify: bool = False):
+    payload = {
+        "queries": [{"domain": domain, "qtype": qtype} for domain, qtype in queries],
+        "dns_servers": [{"target": dns} for dns in dns_servers] if dns_servers else None,
+        "tls_insecure_skip_verify": tls_insecure_skip_verify,
+    }
+    response = requests.post(f"{api_url}/dns-lookup/batch", json=payload, timeout=30)
+    response.raise_for_status()
+    return response.json()["batch_id"]
+
+
+def get_batch_status(api_url: str, batch_id: str, include_results: bool = False):
+    response = requests.get(
+        f"{api_url}/dns-lookup/batch/{batch_id}",
+        params={"include_results": str(include_results).lower()},
+        timeout=30,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def post_load_test(api_url: str, queries: list[tuple[str, str]], dns_servers=None, qps: float = 100, duration: float = 10, tls_insecure_skip_verify: bool = False):
+    payload = {
+        "queries": [{"domain": domain, "qtype": qtype} for domain, qtype in queries],
+        "dns_servers": [{"target": dns} for dns in dns_servers] if dns_servers else None,
+        "qps": qps,
+        "duration": duration,
+        "tls_insecure_skip_verify": tls_insecure_skip_verify,
+    }
+    response = requests.post(f"{api_url}/load-test", json=payload, timeout=30)
+    response.raise_for_status()
+    return response.json()["task_id"]
+
+
+def post_reverse_sweep(api_url: str, cidr: str, dns_servers=None, tls_insecure_skip_verify: bool = False, qps: float | None = None):
+    payload = {
+        "cidr": cidr,
+        "dns_servers": [{"target": dns} for dns in dns_servers] if dns_servers else None,
+        "tls_insecure_skip_verify": tls_insecure_skip_verify,
+        "qps": qps,
+    }
+    response = requests.post(f"{api_url}/reverse-lookup/sweep", json=payload, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def open_sweep_stream(api_url: str, sweep_id: str):
+    # rate-limited sweeps may not send anything for a while
+    response = requests.get(f"{api_url}/reverse-lookup/sweep/{sweep_id}/stream", stream=True, timeout=(5, None))
+    response.raise_for_status()
+    return iter_sse_events(response)
+
+
+def get_load_test_status(api_url: str, task_id: str):
+    response = requests.get(f"{api_url}/load-test/{task_id}", timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
 def get_task_status(api_url: str, task_id: str):
     response = requests.get(f"{api_url}/tasks/{task_id}", timeout=30)
     response.raise_for_status()
     return response.json()
 
 
+def iter_sse_events(response):
+    event, data = "message", []
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                if data:
+                    yield event, json.loads("\n".join(data))
+                event, data = "message", []
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+
+
+def open_task_stream(api_url: str, task_id: str):
+    """
+    Return an iterator of (event, data) for the task results, or None when
+    the API does not stream results.
+    """
+    try:
+        response = requests.get(f"{api_url}/tasks/{task_id}/stream", stream=True, timeout=(5, 60))
+    except requests.RequestException:
+        return None
+    if response.status_code == 404:
+        response.close()
+        return None
+    response.raise_for_status()
+    return iter_sse_events(response)
+
+
 def validate_ip(ip_string: str) -> bool:
     try:
         ipaddress.ip_address(ip_string)
@@ -69,6 +173,7 @@ def log_result(level: str, message: str, use_emoji: bool = False):
         "ok": "✅ " if use_emoji else "[OK] ",
         "warn": "⚠️ " if use_emoji else "[WARN] ",
         "error": "❌ " if use_emoji else "[FAILED] ",
+        "skipped": "⏭️ " if use_emoji else "[SKIPPED] ",
     }
     print(f"{symbols.get(level, '[???] ')}{message}")
 
@@ -83,20 +188,105 @@ def normalize_qtype(domain_type: Any, fallback: str) -> str:
     return "AAAA" if qtype == "AAA" else qtype
 
 
-def collect_targets(args) -> list[tuple[str, Any]]:
-    targets: list[tuple[str, Any]] = []
-
+def collect_targets(args) -> Iterator[tuple[str, Any]]:
+    """
+    Return an iterator of (target, type) over the input file then the query.
+    The file is read as the targets are consumed; only its first line is
+    read here, to report an empty or unreadable file right away.
+    """
+    records = iter(())
+    first = None
     if args.input_file:
-        for record in input_file(args.input_file):
-            targets.append((record.domain, getattr(record, "domain_type", None)))
+        try:
+            records = iter(input_file(args.input_file))
+            first = next(records, None)
+        except OSError as e:
+            raise ValueError(f"unable to read {args.input_file}: {e}") from e
 
-    if args.query:
-        targets.append((args.query, None))
-
-    if not targets:
+    if first is None and not args.query:
         raise ValueError("Provide a query or --input-file.")
 
-    return targets
+    def targets():
+        if first is not None:
+            for record in itertools.chain((first,), records):
+                yield record.domain, getattr(record, "domain_type", None)
+        if args.query:
+            yield args.query, None
+
+    return targets()
+
+
+def print_server_result(server: str, result: dict[str, Any], qtype: str, is_reverse: bool, args):
+    if result["command_status"] == "skipped":
+        if args.debug:
+            log_result("skipped", f"{server} - not queried: {result['error']}", args.pretty)
+        else:
+            log_result("skipped", f"{server} - not queried, server marked down", args.pretty)
+        return
+
+    if result["command_status"] == "unanswered":
+        log_result("skipped", f"{server} - no answer before the lookup completed", args.pretty)
+        return
+
+    if result["command_status"] != "ok":
+        if args.debug:
+            log_result("error", f"{server} - connection issue or error: {result['error']}", args.pretty)
+        else:
+            log_result("error", f"{server} - connection issue or error", args.pretty)
+        return
+
+    dns_protocol = result.get("dns_protocol", "unknown")
+    rcode = result.get("rcode", "Unknown")
+
+    if rcode != "NOERROR":
+        if rcode == "NXDOMAIN":
+            log_result(
+                "warn",
+                f"{server} - Domain does not exist (rcode: NXDOMAIN) - {result['time_ms']:.2f} ms",
+                args.pretty,
+            )
+        else:
+            log_result(
+                "warn",
+                f"{server} - No valid answer (rcode: {rcode}) - {result['time_ms']:.2f} ms",
+                args.pretty,
+            )
+        return
+
+    record_type = "PTR" if is_reverse else qtype
+    answers = [
+        (ans["value"], ans["ttl"])
+        for ans in result.get("answers", [])
+        if ans.get("type") == record_type
+    ]
+
+    if not answers:
+        log_result(
+            "warn",
+            f"{server} - {dns_protocol} - No {record_type} records found - {result['time_ms']} ms",
+            args.pretty,
+        )
+        return
+
+    values = [value for value, _ in answers]
+    ttl_list = [ttl for _, ttl in answers]
+    time_ms = float(result["time_ms"])
+    time_sec = time_ms / 1000.0
+    level = "warn" if time_sec > args.warn_threshold else "ok"
+
+    if len(set(ttl_list)) == 1:
+        log_result(
+            level,
+            f"{server} - {dns_protocol} - {time_ms:.5f}ms - TTL: {ttl_list[0]}s - {', '.join(values)}",
+            args.pretty,
+        )
+    else:
+        value_with_ttl = [f"{value} (TTL: {ttl})" for value, ttl in answers]
+        log_result(
+            level,
+            f"{server} - {dns_protocol} - {time_ms:.5f}ms - {', '.join(value_with_ttl)}",
+            args.pretty,
+        )
 
 
 def print_lookup_result(task_status: dict[str, Any], qtype: str, is_reverse: bool, args):
@@ -105,73 +295,68 @@ def print_lookup_result(task_status: dict[str, Any], qtype: str, is_reverse: boo
         if result["command_status"] == "ok"
     )
     nb_commands = len(task_status["task_result"]["details"])
+    nb_skipped = sum(
+        1 for result in task_status["task_result"]["details"].values()
+        if result["command_status"] == "skipped"
+    )
+    nb_unanswered = sum(
+        1 for result in task_status["task_result"]["details"].values()
+        if result["command_status"] == "unanswered"
+    )
     total_duration = task_status["task_result"]["duration"]
 
     print(
         "\nDNS lookup succeeded for %d out of %d servers (%.4f seconds total)"
         % (nb_commands_ok, nb_commands, total_duration)
     )
+    if nb_skipped:
+        print(f"{nb_skipped} servers skipped, their circuit breaker is open")
+    if nb_unanswered:
+        print(f"{nb_unanswered} servers did not answer before the lookup completed")
 
     for server, result in sort_result_by_dns_server(task_status["task_result"]["details"]):
-        if result["command_status"] != "ok":
-            if args.debug:
-                log_result("error", f"{server} - connection issue or error: {result['error']}", args.pretty)
-            else:
-                log_result("error", f"{server} - connection issue or error", args.pretty)
-            continue
+        print_server_result(server, result, qtype, is_reverse, args)
 
-        dns_protocol = result.get("dns_protocol", "unknown")
-        rcode = result.get("rcode", "Unknown")
-
-        if rcode != "NOERROR":
-            if rcode == "NXDOMAIN":
-                log_result(
-                    "warn",
-                    f"{server} - Domain does not exist (rcode: NXDOMAIN) - {result['time_ms']:.2f} ms",
-                    args.pretty,
-                )
-            else:
-                log_result(
-                    "warn",
-                    f"{server} - No valid answer (rcode: {rcode}) - {result['time_ms']:.2f} ms",
-                    args.pretty,
-                )
-            continue
-
-        record_type = "PTR" if is_reverse else qtype
-        answers = [
-            (ans["value"], ans["ttl"])
-            for ans in result.get("answers", [])
-            if ans.get("type") == record_type
-        ]
-
-        if not answers:
-            log_result(
-                "warn",
-                f"{server} - {dns_protocol} - No {record_type} records found - {result['time_ms']} ms",
-                args.pretty,
-            )
-            continue
+    if task_status["task_result"].get("consistency"):
+        print_consistency(task_status["task_result"]["consistency"], args)
 
-        values = [value for value, _ in answers]
-        ttl_list = [ttl for _, ttl in answers]
-        time_ms = float(result["time_ms"])
-        time_sec = time_ms / 1000.0
-        level = "warn" if time_sec > args.warn_threshold else "ok"
 
-        if len(set(ttl_list)) == 1:
-            log_result(
-                level,
-                f"{server} - {dns_protocol} - {time_ms:.5f}ms - TTL: {ttl_list[0]}s - {', '.join(values)}",
-                args.pretty,
-            )
-        else:
-            value_with_ttl = [f"{value} (TTL: {ttl})" for value, ttl in answers]
-            log_result(
-                level,
-                f"{server} - {dns_protocol} - {time_ms:.5f}ms - {', '.join(value_with_ttl)}",
-                args.pretty,
+def print_consistency(report: dict[str, Any], args):
+    clusters = report["clusters"]
+    if not clusters:
+        return
+    consensus = clusters[0]
+    answered = sum(len(cluster["servers"]) for cluster in clusters)
+    print(
+        f"\nConsensus: {len(consensus['servers'])} of {answered} servers agree on "
+        f"{consensus['rcode']} {', '.join(consensus['answers']) or '(no answer)'}"
+    )
+    for cluster in clusters[1:]:
+        print(f"\t{len(cluster['servers'])} servers answered {cluster['rcode']} {', '.join(cluster['answers']) or '(no answer)'}")
+    for server, reasons in sorted(report["outliers"].items()):
+        log_result("warn", f"{server} - outlier: {', '.join(reasons)}", args.pretty)
+
+
+def print_streamed_result(stream, qtype: str, is_reverse: bool, args) -> bool:
+    """
+    Print each server result as soon as it is received. Returns False if the
+    stream ended without a summary.
+    """
+    print()
+    for event, data in stream:
+        if event == "result":
+            print_server_result(data["server"], data["result"], qtype, is_reverse, args)
+        elif event == "summary":
+            print(
+                "DNS lookup succeeded for %d out of %d servers (%.4f seconds total)"
+                % (data["nb_ok"], data["nb_servers"], data["duration"])
             )
+            return True
+        elif event == "error":
+            if args.debug:
+                print(f"\tStream error: {data}")
+            return False
+    return False
 
 
 def run_single_lookup(
@@ -183,6 +368,7 @@ def run_single_lookup(
     post_dns_lookup_func=post_dns_lookup,
     post_reverse_lookup_func=post_reverse_lookup,
     get_task_status_func=get_task_status,
+    open_task_stream_func=open_task_stream,
 ):
     is_reverse = args.reverse or validate_ip(target)
     qtype = "PTR" if is_reverse else normalize_qtype(target_type, args.qtype)
@@ -198,15 +384,26 @@ def run_single_lookup(
         print(f"\tAPI Base URL: {api_url}")
         print(f"\tTLS Skip Verify: {args.insecure}")
 
+    # lookups of an input file go to the bulk queue unless asked otherwise
+    priority = args.priority or ("bulk" if args.input_file else "interactive")
+    options = {"priority": priority} if priority != "interactive" else {}
+    if args.compare:
+        options["consistency"] = True
+
     try:
         if is_reverse:
-            task_id = post_reverse_lookup_func(api_url, target, dns_servers, args.insecure)
+            task_id = post_reverse_lookup_func(api_url, target, dns_servers, args.insecure, **options)
         else:
-            task_id = post_dns_lookup_func(api_url, target, dns_servers, qtype, args.insecure)
+            task_id = post_dns_lookup_func(api_url, target, dns_servers, qtype, args.insecure, **options)
 
         if args.debug:
             print(f"\tTask ID: {task_id}")
 
+        # the comparison is only part of the final task result
+        stream = None if args.no_stream or args.compare else open_task_stream_func(api_url, task_id)
+        if stream is not None and print_streamed_result(stream, qtype, is_reverse, args):
+            return
+
         while True:
             task_status = get_task_status_func(api_url, task_id)
 
@@ -225,7 +422,283 @@ def run_single_lookup(
         print(f"Error: {e}")
 
 
-def launcher(post_dns_lookup_func=post_dns_lookup, post_reverse_lookup_func=post_reverse_lookup, get_task_status_func=get_task_status):
+def run_windowed_lookups(
+    api_url: str,
+    targets: Iterator[tuple[str, Any]],
+    dns_servers: list[str],
+    args,
+    post_dns_lookup_func=post_dns_lookup,
+    post_reverse_lookup_func=post_reverse_lookup,
+    get_task_status_func=get_task_status,
+):
+    """
+    Look up the targets of an input file with at most args.window tasks in
+    flight: the next lookups are submitted while the oldest one runs, and
+    the results are printed in the order of the file.
+    """
+    priority = args.priority or "bulk"
+    options = {"priority": priority} if priority != "interactive" else {}
+    if args.compare:
+        options["consistency"] = True
+
+    pending = enumerate(targets, start=1)
+    in_flight = deque()
+    while True:
+        while len(in_flight) < args.window:
+            item = next(pending, None)
+            if item is None:
+                break
+            index, (target, target_type) = item
+            is_reverse = args.reverse or validate_ip(target)
+            qtype = "PTR" if is_reverse else normalize_qtype(target_type, args.qtype)
+            try:
+                if is_reverse:
+                    task_id = post_reverse_lookup_func(api_url, target, dns_servers, args.insecure, **options)
+                else:
+                    task_id = post_dns_lookup_func(api_url, target, dns_servers, qtype, args.insecure, **options)
+            except requests.RequestException as e:
+                print(f"\n[{index}] {target} ({qtype})\nError: {e}")
+                continue
+            in_flight.append((index, target, qtype, is_reverse, task_id))
+
+        if not in_flight:
+            return
+
+        index, target, qtype, is_reverse, task_id = in_flight[0]
+        try:
+            task_status = get_task_status_func(api_url, task_id)
+        except requests.RequestException as e:
+            task_status = {"task_status": "ERROR", "error": str(e)}
+
+        if task_status["task_status"] in ("PENDING", "STARTED", "RETRY"):
+            time.sleep(0.5)
+            continue
+
+        in_flight.popleft()
+        print(f"\n[{index}] {target} ({qtype})", end="")
+        if args.debug:
+            print(f"\n\tTask ID: {task_id}", end="")
+        if task_status["task_status"] == "SUCCESS":
+            print_lookup_result(task_status, qtype, is_reverse, args)
+        elif task_status["task_status"] == "FAILURE":
+            print("\n\tTask failed.")
+        else:
+            print(f"\nError: {task_status['error']}")
+
+
+def run_batch_lookup(
+    api_url: str,
+    targets: Iterator[tuple[str, Any]],
+    dns_servers: list[str],
+    args,
+    post_dns_lookup_batch_func=post_dns_lookup_batch,
+    get_batch_status_func=get_batch_status,
+):
+    """
+    Send the targets as batches of at most BATCH_SUBMIT_SIZE queries, one after the other.
+    """
+    queries_iter = (
+        (target, "PTR" if args.reverse or validate_ip(target) else normalize_qtype(target_type, args.qtype))
+        for target, target_type in targets
+    )
+    offset = 0
+    while queries := list(itertools.islice(queries_iter, BATCH_SUBMIT_SIZE)):
+        run_batch(api_url, queries, offset, dns_servers, args, post_dns_lookup_batch_func, get_batch_status_func)
+        offset += len(queries)
+
+
+def run_batch(api_url, queries, offset, dns_servers, args, post_dns_lookup_batch_func, get_batch_status_func):
+    total = offset + len(queries)
+    print(f"Starting batch DNS lookup for {len(queries)} queries", end="", flush=True)
+
+    try:
+        batch_id = post_dns_lookup_batch_func(api_url, queries, dns_servers, args.insecure)
+
+        if args.debug:
+            print(f"\n\tBatch ID: {batch_id}")
+
+        while True:
+            batch_status = get_batch_status_func(api_url, batch_id)
+            if batch_status["batch_status"] in ("SUCCESS", "FAILURE"):
+                break
+            print(f"\rStarting batch DNS lookup for {len(queries)} queries - {batch_status['progress']:.1f}%", end="", flush=True)
+            time.sleep(0.5)
+
+        batch_status = get_batch_status_func(api_url, batch_id, include_results=True)
+        if batch_status["failed_chunks"]:
+            print(f"\n{batch_status['failed_chunks']} of {batch_status['total_chunks']} batch tasks failed.")
+
+        for index, item in enumerate(batch_status["results"] or [], start=offset + 1):
+            print(f"\n[{index}/{total}] {item['domain']} ({item['qtype']})", end="")
+            task_status = {"task_result": {"details": item["details"], "duration": item["duration"]}}
+            print_lookup_result(task_status, item["qtype"], item["qtype"] == "PTR", args)
+
+    except requests.RequestException as e:
+        print(f"Error: {e}")
+
+
+def is_sweep(args) -> bool:
+    return args.sweep or "/" in args.query
+
+
+def sweep_cell(row: dict[str, Any], server: str) -> str:
+    names = row["ptr"].get(server)
+    if names:
+        return ",".join(names)
+    rcode = row["rcode"].get(server)
+    return "-" if rcode == "NOERROR" else str(rcode)
+
+
+def run_reverse_sweep(
+    api_url: str,
+    cidr: str,
+    dns_servers: list[str],
+    args,
+    post_reverse_sweep_func=post_reverse_sweep,
+    open_sweep_stream_func=open_sweep_stream,
+):
+    """
+    Sweep a prefix and print one line per address, with the PTR names (or the rcode) of each server.
+    """
+    print(f"Starting reverse sweep of {cidr}", end="", flush=True)
+
+    try:
+        sweep = post_reverse_sweep_func(api_url, cidr, dns_servers, args.insecure, args.rate)
+        print(f" - {sweep['total_addresses']} addresses in {sweep['total_chunks']} tasks")
+        if args.debug:
+            print(f"\tSweep ID: {sweep['sweep_id']}")
+
+        servers = None
+        for event, data in open_sweep_stream_func(api_url, sweep["sweep_id"]):
+            if event == "row":
+                if servers is None:
+                    servers = list(data["rcode"])
+                    width = max([len(server) for server in servers] + [24])
+                    print(f"\n{'ip':<40} " + " ".join(f"{server:<{width}}" for server in servers))
+                print(f"{data['ip']:<40} " + " ".join(f"{sweep_cell(data, server):<{width}}" for server in servers))
+            elif event == "error":
+                print(f"\tChunk {data['chunk']} failed: {data['error']}")
+            elif event == "summary":
+                print(f"\n{data['nb_rows']} addresses resolved, {data['failed_chunks']} of {data['total_chunks']} tasks failed")
+                return
+
+    except requests.RequestException as e:
+        print(f"Error: {e}")
+
+
+def format_ms(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_load_test_result(task_result: dict[str, Any]):
+    print(f"\n{'server':<32} {'sent':>8} {'qps':>9} {'timeouts':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'p999':>8}")
+    for server, stats in sorted(task_result["details"].items()):
+        latency = stats["latency_ms"]
+        print(
+            f"{server:<32} {stats['sent']:>8} {stats['achieved_qps']:>9.1f} {stats['timeout_rate']:>8.2%} "
+            f"{format_ms(latency['p50']):>8} {format_ms(latency['p90']):>8} {format_ms(latency['p99']):>8} {format_ms(latency['p999']):>8}"
+        )
+        if stats["errors"]:
+            print(f"\t{stats['errors']} queries failed ({stats['error_rate']:.2%})")
+        if stats.get("local_errors"):
+            print(f"\t{stats['local_errors']} queries not sent: the worker ran out of sockets or buffers")
+    print("Latencies in ms, measured from the scheduled send time.")
+
+
+def run_load_test(
+    api_url: str,
+    queries: list[tuple[str, str]],
+    dns_servers: list[str],
+    args,
+    post_load_test_func=post_load_test,
+    get_load_test_status_func=get_load_test_status,
+):
+    print(f"Starting load test at {args.qps:g} qps for {args.duration:g}s with {len(queries)} queries", end="", flush=True)
+
+    try:
+        task_id = post_load_test_func(api_url, queries, dns_servers, args.qps, args.duration, args.insecure)
+
+        if args.debug:
+            print(f"\n\tTask ID: {task_id}")
+
+        while True:
+            status = get_load_test_status_func(api_url, task_id)
+            if status["task_status"] == "SUCCESS":
+                print_load_test_result(status["task_result"])
+                return
+            if status["task_status"] == "FAILURE":
+                print(f"\nLoad test failed: {status.get('error')}")
+                return
+
+            print(".", end="", flush=True)
+            time.sleep(1)
+
+    except requests.RequestException as e:
+        print(f"Error: {e}")
+
+
+def loadgen_launcher(
+    argv: list[str],
+    post_load_test_func=post_load_test,
+    get_load_test_status_func=get_load_test_status,
+):
+    parser = argparse.ArgumentParser(prog="dnstester-cli loadgen", description="Benchmark DNS servers at a target rate.")
+    parser.add_argument(
+        "dns_servers",
+        nargs="*",
+        help="List of DNS servers to load, each at the full rate. If not provided, servers will be fetched from inventory.",
+    )
+    parser.add_argument("--qps", type=float, required=True, help="Target queries per second per server.")
+    parser.add_argument("--duration", type=float, default=10, help="Duration of the test in seconds (default: 10).")
+    parser.add_argument("--input-file", type=str, default="", help=f"File with the query mix, sent in a round-robin (first {LOAD_TEST_MAX_QUERIES} queries).")
+    parser.add_argument("--domain", dest="query", default="", help="Domain name to query (in addition to --input-file).")
+    parser.add_argument("--qtype", default="A", choices=QTYPE_CHOICES, help="DNS query type of --domain (default: A).")
+    parser.add_argument("--api-url", default=API_BASE_URL, help="Base URL of the API (default: http://localhost:5000).")
+    parser.add_argument("--insecure", action="store_true", help="Skip TLS certificate verification.")
+    parser.add_argument("--debug", "-d", action="store_true", help="Show the task ID.")
+    args = parser.parse_args(argv)
+
+    try:
+        for dns_server in args.dns_servers:
+            validate_address(dns_server)
+        targets = collect_targets(args)
+    except ValueError as e:
+        print(f"Error > {e}")
+        return
+
+    queries = list(itertools.islice(
+        ((target, normalize_qtype(target_type, args.qtype)) for target, target_type in targets), LOAD_TEST_MAX_QUERIES
+    ))
+    run_load_test(
+        args.api_url,
+        queries,
+        args.dns_servers,
+        args,
+        post_load_test_func=post_load_test_func,
+        get_load_test_status_func=get_load_test_status_func,
+    )
+
+
+def launcher(
+    post_dns_lookup_func=post_dns_lookup,
+    post_reverse_lookup_func=post_reverse_lookup,
+    get_task_status_func=get_task_status,
+    post_dns_lookup_batch_func=post_dns_lookup_batch,
+    get_batch_status_func=get_batch_status,
+    open_task_stream_func=open_task_stream,
+    post_load_test_func=post_load_test,
+    get_load_test_status_func=get_load_test_status,
+    post_reverse_sweep_func=post_reverse_sweep,
+    open_sweep_stream_func=open_sweep_stream,
+):
+    if sys.argv[1:2] == ["loadgen"]:
+        loadgen_launcher(
+            sys.argv[2:],
+            post_load_test_func=post_load_test_func,
+            get_load_test_status_func=get_load_test_status_func,
+        )
+        return
+
     parser = argparse.ArgumentParser(description="CLI for testing DNS lookup.")
     parser.add_argument("query", nargs="?", default="", help="Domain name or IP address to query.")
     parser.add_argument(
@@ -233,8 +706,10 @@ def launcher(post_dns_lookup_func=post_dns_lookup, post_reverse_lookup_func=post
         nargs="*",
         help="List of DNS servers (e.g. udp://8.8.8.8 or tcp://..., tls://...). If not provided, servers will be fetched from inventory.",
     )
-    parser.add_argument("--qtype", default="A", choices=["A", "AAAA", "MX", "CNAME"], help="DNS query type (default: A).")
+    parser.add_argument("--qtype", default="A", choices=QTYPE_CHOICES, help="DNS query type (default: A).")
     parser.add_argument("--reverse", "-r", action="store_true", help="Perform a reverse DNS lookup (PTR record).")
+    parser.add_argument("--sweep", action="store_true", help="Resolve the PTR records of every address of the query prefix (implied by a query like 192.0.2.0/24).")
+    parser.add_argument("--rate", type=float, default=None, help="Queries per second sent to each server during a sweep (default: unlimited).")
     parser.add_argument("--api-url", default=API_BASE_URL, help="Base URL of the API (default: http://localhost:5000).")
     parser.add_argument("--insecure", action="store_true", help="Skip TLS certificate verification.")
     parser.add_argument("--version", "-v", action="store_true", help="Show package version and exit.")
@@ -247,6 +722,16 @@ def launcher(post_dns_lookup_func=post_dns_lookup, post_reverse_lookup_func=post
         help="Response time threshold in seconds for warnings (default: 1.0s).",
     )
     parser.add_argument("--input-file", type=str, default="", help="File with domains to query.")
+    parser.add_argument("--batch", action="store_true", help=f"Send the queries of --input-file as batch requests of up to {BATCH_SUBMIT_SIZE} queries each, one after the other.")
+    parser.add_argument("--window", type=int, default=8, help="Lookups of an --input-file in flight at the same time (default: 8).")
+    parser.add_argument("--no-stream", action="store_true", help="Poll for results instead of streaming them from the API.")
+    parser.add_argument("--compare", action="store_true", help="Compare the answers of the servers and show the outliers.")
+    parser.add_argument(
+        "--priority",
+        choices=["interactive", "bulk"],
+        default=None,
+        help="Queue of the lookups (default: bulk with --input-file, interactive otherwise).",
+    )
     args = parser.parse_args()
 
     if args.version:
@@ -260,22 +745,64 @@ def launcher(post_dns_lookup_func=post_dns_lookup, post_reverse_lookup_func=post
         print(f"Error > {e}")
         return
 
+    if is_sweep(args):
+        try:
+            cidr = str(ipaddress.ip_network(args.query, strict=False))
+        except ValueError as e:
+            print(f"Error > {e}")
+            return
+        run_reverse_sweep(
+            args.api_url,
+            cidr,
+            args.dns_servers,
+            args,
+            post_reverse_sweep_func=post_reverse_sweep_func,
+            open_sweep_stream_func=open_sweep_stream_func,
+        )
+        return
+
+    if args.window < 1:
+        print("Error > --window must be at least 1")
+        return
+
     try:
         targets = collect_targets(args)
     except ValueError as e:
         print(f"Error > {e}")
         return
 
-    for index, (target, target_type) in enumerate(targets, start=1):
-        if len(targets) > 1:
-            print(f"\n[{index}/{len(targets)}] {target}")
-        run_single_lookup(
+    if args.batch:
+        run_batch_lookup(
+            args.api_url,
+            targets,
+            args.dns_servers,
+            args,
+            post_dns_lookup_batch_func=post_dns_lookup_batch_func,
+            get_batch_status_func=get_batch_status_func,
+        )
+        return
+
+    if args.input_file:
+        run_windowed_lookups(
             args.api_url,
-            target,
-            target_type,
+            targets,
             args.dns_servers,
             args,
             post_dns_lookup_func=post_dns_lookup_func,
             post_reverse_lookup_func=post_reverse_lookup_func,
             get_task_status_func=get_task_status_func,
         )
+        return
+
+    target, target_type = next(targets)
+    run_single_lookup(
+        args.api_url,
+        target,
+        target_type,
+        args.dns_servers,
+        args,
+        post_dns_lookup_func=post_dns_lookup_func,
+        post_reverse_lookup_func=post_reverse_lookup_func,
+        get_task_status_func=get_task_status_func,
+        open_task_stream_func=open_task_stream_func,
+    )
@@ -1,22 +1,46 @@
+import gzip
+import io
+from collections.abc import Iterator
 from enum import Enum
 from dataclasses import dataclass
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
 
 class DomainType(Enum):
     A = "A"
     AAAA = "AAAA"
     MX = "MX"
     CNAME = "CNAME"
+    CAA = "CAA"
+    DNSKEY = "DNSKEY"
+    DS = "DS"
+    HTTPS = "HTTPS"
+    NAPTR = "NAPTR"
+    NS = "NS"
+    PTR = "PTR"
+    SOA = "SOA"
+    SRV = "SRV"
+    SVCB = "SVCB"
+    TLSA = "TLSA"
+    TXT = "TXT"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Domain:
     domain: str
     domain_type: DomainType
 
 
 def parse_line(line: str) -> Domain | None:
-    line = line.strip()
+    # domain names never contain '#': everything after it is a comment
+    line = line.split("#", 1)[0].strip()
     if not line:
         return None
 
@@ -34,13 +58,33 @@ def parse_line(line: str) -> Domain | None:
     return Domain(domain=domain_name, domain_type=record_type)
 
 
-def input_file(file_path: str) -> list[Domain]:
-    domains: list[Domain] = []
+def open_text(file_path: str):
+    """
+    Open a domain list as text, decompressing gzip and zstd files (detected
+    from their first bytes) on the fly.
+    """
+    raw = open(file_path, "rb")
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        # GzipFile does not close a fileobj it was given: let it open the file itself
+        raw.close()
+        return gzip.open(file_path, "rt", encoding="utf-8")
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raw.close()
+            raise ValueError(f"{file_path} is zstd-compressed, reading it needs the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding="utf-8")
+    return io.TextIOWrapper(raw, encoding="utf-8")
 
-    with open(file_path, "r", encoding="utf-8") as f:
+
+def input_file(file_path: str) -> Iterator[Domain]:
+    """
+    Yield the domains of a file one line at a time: the file is never held
+    in memory, and the first domain is available as soon as it is read.
+    """
+    with open_text(file_path) as f:
         for line in f:
             domain = parse_line(line)
             if domain is not None:
-                domains.append(domain)
-
-    return domains
\ No newline at end of file
+                yield domain
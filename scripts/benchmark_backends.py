@@ -0,0 +1,61 @@
+"""
+Compare the native and q resolver backends against a local stub DNS server.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_backends --queries 500
+"""
+import argparse
+import resource
+import shutil
+import time
+
+from tests.dns_stub import StubDNSServer
+from worker import engine
+from worker.q import _query_server
+
+
+def cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(backend: str, server: dict, queries: int) -> dict:
+    errors = 0
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    for _ in range(queries):
+        _, result = engine.run(_query_server("example.com", "A", server, False, backend=backend))
+        if result.get("command_status") != "ok":
+            errors += 1
+    wall = time.perf_counter() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    return {
+        "backend": backend,
+        "qps": queries / wall,
+        "cpu_ms_per_query": cpu * 1000 / queries,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DNS resolver backends.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sequential queries per backend.")
+    parser.add_argument("--protocol", default="udp", choices=["udp", "tcp"], help="Do53 transport to benchmark.")
+    args = parser.parse_args()
+
+    backends = ["native"]
+    if shutil.which("q"):
+        backends.append("q")
+    else:
+        print("q binary not found in PATH, only the native backend is benchmarked")
+
+    with StubDNSServer() as stub:
+        server = {"target": f"{args.protocol}://127.0.0.1:{stub.port}", "tags": []}
+        print(f"{'backend':<8} {'queries/s':>12} {'cpu ms/query':>14} {'errors':>8}")
+        for backend in backends:
+            stats = run(backend, server, args.queries)
+            print(f"{stats['backend']:<8} {stats['qps']:>12.1f} {stats['cpu_ms_per_query']:>14.3f} {stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
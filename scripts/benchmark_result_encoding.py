@@ -0,0 +1,53 @@
+"""
+Compare the size of a lookup result stored in the result backend with the
+json and compact encodings.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_result_encoding --servers 500
+"""
+import argparse
+import json
+
+from worker import serialization
+
+
+def make_result(nb_servers: int) -> dict:
+    details = {}
+    for i in range(nb_servers):
+        target = f"{('udp', 'tcp', 'tls', 'https')[i % 4]}://192.0.{i // 250}.{i % 250 + 1}"
+        details[target] = {
+            "command_status": "ok",
+            "time_ms": 12.345 + i % 50,
+            "dns_protocol": ("Do53", "Do53", "DoT", "DoH")[i % 4],
+            "tags": ["DNS_RESOLVERS", f"SITE_{i % 8}"],
+            "rcode": "NOERROR",
+            "name": "example.com.",
+            "qtype": "A",
+            "answers": [{"name": "example.com.", "type": "A", "ttl": 300, "value": "93.184.216.34"}],
+        }
+    # Same layout as the meta stored by the Redis result backend
+    return {
+        "status": "SUCCESS",
+        "result": {"details": details, "duration": 0.52},
+        "traceback": None,
+        "children": [],
+        "date_done": "2026-01-01T00:00:00.000000+00:00",
+        "task_id": "a19e8aed-68b5-4639-ab21-f65caf8482ac",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark result backend encodings.")
+    parser.add_argument("--servers", type=int, default=500, help="Number of servers in the lookup result.")
+    args = parser.parse_args()
+
+    meta = make_result(args.servers)
+    json_size = len(json.dumps(meta).encode())
+    compact_size = len(serialization.dumps(meta))
+    print(f"{'encoding':<10} {'bytes/task':>12}")
+    print(f"{'json':<10} {json_size:>12}")
+    print(f"{'compact':<10} {compact_size:>12}  ({compact_size / json_size:.1%} of json)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import socket
+import socketserver
+import struct
+import threading
+
+from worker.dnswire import QTYPE_CODES, decode_name
+
+
+def build_answer(query: bytes, records: dict, rcode: int = 0, truncate: bool = False) -> bytes:
+    """
+    Answer a query from a {(name, qtype): [(ttl, rdata bytes), ...]} table.
+    Answer owner names are compressed against the question.
+    """
+    msg_id, flags = struct.unpack_from("!HH", query)
+    name, offset = decode_name(query, 12)
+    qtype, _ = struct.unpack_from("!HH", query, offset)
+    question = query[12:offset + 4]
+
+    answers = [] if truncate else records.get((name, qtype), [])
+    if not answers and not truncate and rcode == 0 and not any(n == name for n, _ in records):
+        rcode = 3
+
+    flags = 0x8000 | (flags & 0x0100) | 0x0080 | rcode
+    if truncate:
+        flags |= 0x0200
+
+    out = bytearray(struct.pack("!HHHHHH", msg_id, flags, 1, len(answers), 0, 0))
+    out += question
+    for ttl, rdata in answers:
+        out += struct.pack("!HHHIH", 0xC00C, qtype, 1, ttl, len(rdata))
+        out += rdata
+    return bytes(out)
+
+
+class StubDNSServer:
+    """
+    Minimal Do53 server (UDP and TCP on the same port) running in background threads.
+    """
+
+    def __init__(self, records=None, truncate_udp=False):
+        self.records = records if records is not None else {
+            ("example.com.", QTYPE_CODES["A"]): [(300, socket.inet_aton("93.184.216.34"))],
+        }
+        self.truncate_udp = truncate_udp
+        self.queries = 0
+        stub = self
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                stub.queries += 1
+                sock.sendto(build_answer(data, stub.records, truncate=stub.truncate_udp), self.client_address)
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    header = self.request.recv(2)
+                    if len(header) < 2:
+                        return
+                    (length,) = struct.unpack("!H", header)
+                    data = b""
+                    while len(data) < length:
+                        data += self.request.recv(length - len(data))
+                    stub.queries += 1
+                    reply = build_answer(data, stub.records)
+                    self.request.sendall(struct.pack("!H", len(reply)) + reply)
+
+        self.udp = socketserver.UDPServer(("127.0.0.1", 0), UDPHandler)
+        self.port = self.udp.server_address[1]
+        self.tcp = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), TCPHandler)
+        self.tcp.daemon_threads = True
+
+    def __enter__(self):
+        for server in (self.udp, self.tcp):
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        for server in (self.udp, self.tcp):
+            server.shutdown()
+            server.server_close()
+
+
+def make_self_signed_cert(directory) -> tuple[str, str]:
+    """
+    Write a self-signed certificate for 127.0.0.1 and return (certfile, keyfile).
+    """
+    import datetime
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "dnstester-stub")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    certfile, keyfile = f"{directory}/stub.crt", f"{directory}/stub.key"
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+class StubTLSServer:
+    """
+    DoT (protocol="dot") or HTTP/1.1 DoH (protocol="doh") stub server on 127.0.0.1.
+    Counts accepted TCP connections to check connection reuse.
+    """
+
+    def __init__(self, certfile, keyfile, protocol="dot", records=None):
+        import ssl
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.records = records if records is not None else {
+            ("example.com.", QTYPE_CODES["A"]): [(300, socket.inet_aton("93.184.216.34"))],
+        }
+        self.connections = 0
+        stub = self
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+
+        class DoTHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    header = self.request.recv(2)
+                    if len(header) < 2:
+                        return
+                    (length,) = struct.unpack("!H", header)
+                    data = b""
+                    while len(data) < length:
+                        data += self.request.recv(length - len(data))
+                    reply = build_answer(data, stub.records)
+                    self.request.sendall(struct.pack("!H", len(reply)) + reply)
+
+        class DoHHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                reply = build_answer(data, stub.records)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/dns-message")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        if protocol == "dot":
+            server_class, handler = socketserver.ThreadingTCPServer, DoTHandler
+        else:
+            server_class, handler = ThreadingHTTPServer, DoHHandler
+
+        class TLSServer(server_class):
+            daemon_threads = True
+
+            def get_request(self):
+                sock, addr = super().get_request()
+                stub.connections += 1
+                return context.wrap_socket(sock, server_side=True), addr
+
+        self.server = TLSServer(("127.0.0.1", 0), handler)
+        self.port = self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def serve_doq_stub(certfile, keyfile, records=None):
+    """
+    Start a DoQ stub server on the running loop and return (server, port).
+    """
+    from aioquic.asyncio import QuicConnectionProtocol, serve
+    from aioquic.quic.configuration import QuicConfiguration
+    from aioquic.quic.events import StreamDataReceived
+
+    records = records if records is not None else {
+        ("example.com.", QTYPE_CODES["A"]): [(300, socket.inet_aton("93.184.216.34"))],
+    }
+    tickets = {}
+
+    class DoQProtocol(QuicConnectionProtocol):
+        def quic_event_received(self, event):
+            if isinstance(event, StreamDataReceived):
+                reply = build_answer(event.data[2:], records)
+                self._quic.send_stream_data(event.stream_id, struct.pack("!H", len(reply)) + reply, end_stream=True)
+                self.transmit()
+
+    configuration = QuicConfiguration(is_client=False, alpn_protocols=["doq"])
+    configuration.load_cert_chain(certfile, keyfile)
+    server = await serve(
+        "127.0.0.1", 0,
+        configuration=configuration,
+        create_protocol=DoQProtocol,
+        session_ticket_fetcher=tickets.pop,
+        session_ticket_handler=lambda ticket: tickets.__setitem__(ticket.ticket, ticket),
+    )
+    return server, server._transport.get_extra_info("sockname")[1]
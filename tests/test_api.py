@@ -1,6 +1,8 @@
+import json
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from api.main import app
+from worker.metrics import process_identifier
 
 import pytest
 
@@ -41,7 +43,37 @@ def test_post_reverselookup_return_taskid(mock_celery):
     mock_celery.assert_called_once_with("1.1.1.1", "PTR", [
         {"target": "udp://8.8.8.8:53", "tags": []}], False)
 
-@pytest.mark.parametrize("valid_qtype", ["A", "AAAA", "CNAME", "PTR", "TXT"])
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_cache_options(mock_celery):
+    data = {
+        "domain": "example.com",
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}],
+        "qtype": "A",
+        "max_staleness": 60,
+    }
+    response = client.post("/dns-lookup", json=data)
+
+    assert response.status_code == 200
+    mock_celery.assert_called_once_with("example.com", "A", [{"target": "udp://8.8.8.8:53", "tags": []}],
+                                        False, max_staleness=60)
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_early_return_options(mock_celery):
+    data = {
+        "domain": "example.com",
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}],
+        "qtype": "A",
+        "first_answers": 1,
+        "deadline": 0.5,
+        "hedge": True,
+    }
+    response = client.post("/dns-lookup", json=data)
+
+    assert response.status_code == 200
+    mock_celery.assert_called_once_with("example.com", "A", [{"target": "udp://8.8.8.8:53", "tags": []}],
+                                        False, first_answers=1, deadline=0.5, hedge=True)
+
+@pytest.mark.parametrize("valid_qtype", ["A", "AAAA", "CNAME", "PTR", "TXT", "MX", "SRV", "SOA", "CAA", "HTTPS", "DS"])
 @patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
 def test_post_dnslookup_valid_qtype(mock_celery, valid_qtype):
     response = client.post(
@@ -54,7 +86,7 @@ def test_post_dnslookup_valid_qtype(mock_celery, valid_qtype):
     mock_celery.assert_called_once_with("example.com", valid_qtype, [
         {"target": "udp://8.8.8.8:53", "tags": []}], False)
 
-@pytest.mark.parametrize("invalid_qtype", ["MX", "SRV", "WRONG_TYPE", "123"])
+@pytest.mark.parametrize("invalid_qtype", ["AXFR", "OPT", "WRONG_TYPE", "123"])
 @patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
 def test_post_dnslookup_invalid_qtype(mock_celery, invalid_qtype):
     response = client.post(
@@ -127,12 +159,18 @@ def test_get_tasks_status(mock_async_result):
         "task_status": "SUCCESS",
         "task_result": {
             "duration": 0.1,
+            "consistency": None,
             "details": {
                 "udp://8.8.8.8:53": {
                     "command_status": "ok",
                     "error": None,
                     "tags": [],
                     "dns_protocol": "Do53",
+                    "connection_reused": None,
+                    "handshake_ms": None,
+                    "session_resumed": None,
+                    "cached": None,
+                    "cache_age": None,
                     "time_ms": 13.9,
                     "rcode": "NoError",
                     "name": "example.com.",
@@ -151,3 +189,459 @@ def test_get_tasks_status(mock_async_result):
     }
 
     mock_async_result.assert_called_once_with("fake-task-id")
+
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_multiple_qtypes(mock_celery):
+    data = {"domain": "example.com", "dns_servers": [{"target": "udp://8.8.8.8:53"}], "qtype": ["A", "AAAA", "A", "HTTPS"]}
+    response = client.post("/dns-lookup", json=data)
+
+    assert response.status_code == 200
+    mock_celery.assert_called_once_with("example.com", ["A", "AAAA", "HTTPS"], [{"target": "udp://8.8.8.8:53", "tags": []}], False)
+
+    response = client.post("/dns-lookup", json={**data, "hedge": True})
+    assert response.status_code == 422
+    response = client.post("/dns-lookup", json={**data, "qtype": []})
+    assert response.status_code == 422
+
+
+@patch("worker.lookup.lookup_dns.AsyncResult")
+def test_get_tasks_status_multiple_qtypes(mock_async_result):
+    mock_async_result.return_value.state = "SUCCESS"
+    mock_async_result.return_value.result = {
+        "duration": 0.1,
+        "details": {
+            "udp://8.8.8.8:53": {
+                "A": {"command_status": "ok", "rcode": "NOERROR", "qtype": "A", "answers": []},
+                "AAAA": {"command_status": "unanswered", "qtype": "AAAA"},
+            }
+        },
+    }
+
+    response = client.get("/tasks/fake-task-id")
+
+    assert response.status_code == 200
+    details = response.json()["task_result"]["details"]["udp://8.8.8.8:53"]
+    assert details["A"]["command_status"] == "ok"
+    assert details["AAAA"]["command_status"] == "unanswered"
+
+
+@patch("api.main.group")
+def test_post_reverse_sweep_dispatches_chunks(mock_group):
+    mock_group.return_value.apply_async.return_value = MagicMock(id="fake-sweep-id")
+    data = {"cidr": "192.0.2.77/22", "dns_servers": [{"target": "udp://8.8.8.8:53"}], "chunk_size": 256, "bypass_cache": True}
+
+    response = client.post("/reverse-lookup/sweep", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["cidr"] == "192.0.0.0/22"
+    assert response.json()["total_addresses"] == 1024
+    chunks = list(mock_group.call_args.args[0])
+    assert [chunk.args[:2] for chunk in chunks] == [("192.0.0.0", 256), ("192.0.1.0", 256), ("192.0.2.0", 256), ("192.0.3.0", 256)]
+    assert chunks[0].kwargs == {"bypass_cache": True}
+
+
+@patch("api.main.GroupResult")
+@patch("api.main.chain")
+def test_post_reverse_sweep_chains_rate_limited_chunks(mock_chain, mock_group_result):
+    mock_group_result.return_value = MagicMock(id="fake-sweep-id", results=[])
+    data = {"cidr": "192.0.2.0/24", "dns_servers": [{"target": "udp://8.8.8.8:53"}], "chunk_size": 4, "qps": 128}
+
+    response = client.post("/reverse-lookup/sweep", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["sweep_id"] == "fake-sweep-id"
+    chunks = mock_chain.call_args.args
+    assert len(chunks) == 64
+    assert all(chunk.immutable and "countdown" not in chunk.options for chunk in chunks)
+    # one sweep-level error callback: the chain grows linearly with the number of chunks
+    assert all(chunk.options["link_error"][0].args == ("fake-sweep-id",) for chunk in chunks)
+    sizes = [len(json.dumps(chunk)) for chunk in chunks]
+    assert max(sizes) - min(sizes) <= len("192.0.2.252") - len("192.0.2.0")
+    assert [child.id for child in mock_group_result.return_value.results] == [chunk.id for chunk in chunks]
+    mock_group_result.return_value.save.assert_called_once()
+
+
+@patch("api.main.chain")
+def test_post_reverse_sweep_limits_rate_limited_chunks(mock_chain):
+    data = {"cidr": "10.0.0.0/16", "dns_servers": [{"target": "udp://8.8.8.8:53"}], "chunk_size": 1, "qps": 128}
+
+    response = client.post("/reverse-lookup/sweep", json=data)
+
+    assert response.status_code == 400
+    assert "chunk_size" in response.json()["detail"]
+    mock_chain.assert_not_called()
+
+
+@pytest.mark.parametrize("cidr,status", [("2001:db8::/64", 400), ("10.0.0.0/8", 400), ("not-a-prefix", 422)])
+def test_post_reverse_sweep_rejects_prefixes(cidr, status):
+    response = client.post("/reverse-lookup/sweep", json={"cidr": cidr, "dns_servers": [{"target": "udp://8.8.8.8:53"}]})
+    assert response.status_code == status
+
+
+def test_stream_reverse_sweep():
+    row = {"ip": "192.0.2.1", "ptr": {"udp://8.8.8.8:53": ["host.example."]}, "rcode": {"udp://8.8.8.8:53": "NOERROR"}}
+    batch = MagicMock(results=[MagicMock(state="SUCCESS", result=[row]), MagicMock(state="FAILURE", result=Exception("boom"))])
+
+    with patch("api.main.GroupResult.restore", return_value=batch):
+        response = client.get("/reverse-lookup/sweep/fake-sweep-id/stream")
+
+    assert response.status_code == 200
+    assert "event: row" in response.text
+    assert "host.example." in response.text
+    assert '"chunk": 1' in response.text
+    assert '"nb_rows": 1, "failed_chunks": 1' in response.text
+
+
+@patch("api.main.group")
+def test_post_dnslookup_batch_dispatches_chunks(mock_group):
+    mock_group.return_value.apply_async.return_value = MagicMock(id="fake-batch-id")
+    data = {
+        "queries": [{"domain": f"example{i}.com", "qtype": "A"} for i in range(5)],
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}],
+        "chunk_size": 2,
+    }
+    response = client.post("/dns-lookup/batch", json=data)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "batch_id": "fake-batch-id",
+        "total_chunks": 3,
+        "total_queries": 5,
+        "message": "DNS batch lookup enqueued",
+    }
+    signatures = list(mock_group.call_args.args[0])
+    assert [sig.args[0] for sig in signatures] == [
+        [("example0.com", "A"), ("example1.com", "A")],
+        [("example2.com", "A"), ("example3.com", "A")],
+        [("example4.com", "A")],
+    ]
+    assert signatures[0].args[1:] == ([{"target": "udp://8.8.8.8:53", "tags": []}], False)
+    mock_group.return_value.apply_async.return_value.save.assert_called_once()
+
+def test_post_dnslookup_batch_empty_queries():
+    response = client.post("/dns-lookup/batch", json={"queries": []})
+    assert response.status_code == 422
+
+@patch("api.main.GroupResult.restore")
+def test_get_batch_status_progress(mock_restore):
+    item = {
+        "domain": "example.com", "qtype": "A", "duration": 0.1,
+        "details": {"udp://8.8.8.8:53": {"command_status": "ok", "rcode": "NOERROR", "time_ms": 1.0}},
+    }
+    mock_restore.return_value.results = [
+        MagicMock(state="SUCCESS", result=[item, item]),
+        MagicMock(state="STARTED"),
+        MagicMock(state="FAILURE"),
+        MagicMock(state="PENDING"),
+    ]
+
+    response = client.get("/dns-lookup/batch/fake-batch-id?include_results=true")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["batch_status"] == "PROGRESS"
+    assert body["total_chunks"] == 4
+    assert body["completed_chunks"] == 1
+    assert body["failed_chunks"] == 1
+    assert body["completed_queries"] == 2
+    assert body["progress"] == 50.0
+    assert [r["domain"] for r in body["results"]] == ["example.com", "example.com"]
+
+@patch("api.main.GroupResult.restore", return_value=None)
+def test_get_batch_status_not_found(mock_restore):
+    response = client.get("/dns-lookup/batch/unknown")
+    assert response.status_code == 404
+
+
+def test_stream_task_disabled():
+    with patch("worker.celeryconfig.RESULT_STREAMING", False):
+        response = client.get("/tasks/fake-task-id/stream")
+    assert response.status_code == 404
+
+@patch("worker.streams.read", new_callable=AsyncMock)
+def test_stream_task_results(mock_read):
+    mock_read.side_effect = [
+        [("1-0", "result", {"server": "udp://8.8.8.8:53", "result": {"command_status": "ok"}})],
+        [("2-0", "summary", {"duration": 0.1, "nb_servers": 1, "nb_ok": 1})],
+    ]
+    with patch("worker.celeryconfig.RESULT_STREAMING", True):
+        response = client.get("/tasks/fake-task-id/stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        'event: result\ndata: {"server": "udp://8.8.8.8:53", "result": {"command_status": "ok"}}\n\n'
+        'event: summary\ndata: {"duration": 0.1, "nb_servers": 1, "nb_ok": 1}\n\n'
+    )
+    assert mock_read.await_args_list[1].args == ("fake-task-id", "1-0")
+
+@patch("worker.streams.exists", new_callable=AsyncMock, return_value=False)
+@patch("worker.streams.read", new_callable=AsyncMock, return_value=[])
+@patch("worker.lookup.lookup_dns.AsyncResult")
+def test_stream_task_replays_finished_task(mock_async_result, mock_read, mock_exists):
+    mock_async_result.return_value.ready.return_value = True
+    mock_async_result.return_value.successful.return_value = True
+    mock_async_result.return_value.result = {
+        "duration": 0.2,
+        "details": {"udp://8.8.8.8:53": {"command_status": "ok"}},
+    }
+    with patch("worker.celeryconfig.RESULT_STREAMING", True):
+        response = client.get("/tasks/fake-task-id/stream")
+
+    assert response.status_code == 200
+    assert "event: result" in response.text
+    assert 'event: summary\ndata: {"duration": 0.2, "nb_servers": 1, "nb_ok": 1}' in response.text
+
+@patch("api.main.task_in_flight", return_value=True)
+@patch("worker.lookup.lookup_dns.apply_async")
+def test_post_dnslookup_coalesced(mock_apply_async, mock_in_flight):
+    from api import metrics
+
+    redis_client = AsyncMock()
+    redis_client.set.side_effect = [True, None]
+    data = {
+        "domain": "example.com",
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}, {"target": "tls://1.1.1.1:853", "tags": []}],
+        "qtype": "A",
+    }
+    before = metrics.registry.get_sample_value("dns_coalesced_requests_total", {"endpoint": "dns-lookup"}) or 0
+    with patch("api.main.LOOKUP_COALESCING", True), \
+            patch("api.coalesce.get_async_redis", return_value=redis_client):
+        first = client.post("/dns-lookup", json=data).json()
+        redis_client.get.return_value = first["task_id"].encode()
+        data["dns_servers"].reverse()
+        second = client.post("/dns-lookup", json=data).json()
+
+    assert second == {"task_id": first["task_id"], "message": "DNS lookup coalesced with an in-flight task"}
+    mock_apply_async.assert_called_once()
+    assert mock_apply_async.call_args.kwargs["task_id"] == first["task_id"]
+    mock_in_flight.assert_called_once_with(first["task_id"])
+    assert metrics.registry.get_sample_value("dns_coalesced_requests_total", {"endpoint": "dns-lookup"}) == before + 1
+    assert redis_client.set.call_args_list[0].args[0] == redis_client.set.call_args_list[1].args[0]
+
+@patch("worker.lookup.get_metrics.delay")
+def test_metrics_multiprocess_aggregated(mock_get_metrics, tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    increment = "import worker.metrics as m; m.dns_total_queries.labels(server='udp://192.0.2.1').inc()"
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", increment], env=env, check=True)
+
+    with patch("worker.celeryconfig.PROMETHEUS_MULTIPROC_DIR", str(tmp_path)), \
+            patch("worker.queues.queue_depths", return_value={}):
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'dns_total_queries_total{server="udp://192.0.2.1"} 2.0' in response.text
+    mock_get_metrics.assert_not_called()
+
+@patch("worker.lookup.get_metrics.delay")
+def test_metrics_queue_depth(mock_get_metrics):
+    mock_get_metrics.return_value.get.return_value = ""
+    with patch("worker.queues.queue_depths", return_value={"interactive": 2, "bulk": 1500}):
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'dns_queue_depth{queue="interactive"} 2.0' in response.text
+    assert 'dns_queue_depth{queue="bulk"} 1500.0' in response.text
+
+@patch("worker.lookup.lookup_dns.apply_async", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_bulk_priority(mock_apply_async):
+    data = {
+        "domain": "example.com",
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}],
+        "qtype": "A",
+        "priority": "bulk",
+    }
+    response = client.post("/dns-lookup", json=data)
+
+    assert response.status_code == 200
+    mock_apply_async.assert_called_once_with(
+        args=("example.com", "A", [{"target": "udp://8.8.8.8:53", "tags": []}], False), kwargs={}, queue="bulk",
+    )
+
+@patch("worker.lookup.load_test.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_load_test(mock_celery):
+    data = {
+        "dns_servers": [{"target": "udp://8.8.8.8:53", "tags": []}],
+        "queries": [{"domain": "example.com", "qtype": "A"}],
+        "qps": 500,
+        "duration": 30,
+    }
+    response = client.post("/load-test", json=data)
+
+    assert response.status_code == 200
+    assert response.json() == {"task_id": "fake-task-id", "message": "Load test enqueued"}
+    mock_celery.assert_called_once_with([{"target": "udp://8.8.8.8:53", "tags": []}], [("example.com", "A")], 500, 30, False)
+
+    assert client.post("/load-test", json={**data, "qps": 0}).status_code == 422
+
+@patch("worker.lookup.load_test.AsyncResult")
+def test_get_load_test_status_failed(mock_async_result):
+    mock_async_result.return_value = MagicMock(state="FAILURE", result=ValueError("unsupported targets"))
+    mock_async_result.return_value.failed.return_value = True
+
+    response = client.get("/load-test/fake-task-id")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "task_id": "fake-task-id", "task_status": "FAILURE", "task_result": None, "error": "unsupported targets",
+    }
+
+def test_get_latency():
+    from worker.sketch import LatencySketch
+
+    sketch = LatencySketch()
+    for ms in range(1, 101):
+        sketch.add(ms)
+    window = {("udp://8.8.8.8:53", "Do53", "A"): sketch, ("tls://1.1.1.1:853", "DoT", "A"): LatencySketch({1: 1})}
+    with patch("worker.celeryconfig.LATENCY_SKETCHES", True), \
+            patch("worker.latency.read_window", new_callable=AsyncMock, return_value=window) as mock_read:
+        response = client.get("/latency", params={"window": 120, "dns_protocol": "Do53"})
+
+    assert response.status_code == 200
+    mock_read.assert_awaited_once_with(120)
+    report = response.json()
+    assert report["window"] == 120
+    assert len(report["series"]) == 1
+    series = report["series"][0]
+    assert series["server"] == "udp://8.8.8.8:53" and series["count"] == 100
+    assert abs(series["p50"] - 50) <= 1 and abs(series["p99"] - 99) <= 1
+
+def test_get_latency_disabled():
+    assert client.get("/latency").status_code == 404
+
+@patch("worker.history.aggregate", return_value=[{"ts": 3600, "target": "udp://8.8.8.8:53", "protocol": "Do53", "qtype": "A", "count": 2, "errors": 0, "avg_ms": 12.5, "p50": 12.0, "p95": 13.0, "p99": 13.0}])
+def test_get_history_aggregate(mock_aggregate):
+    with patch("worker.celeryconfig.HISTORY_DIR", "/tmp/history"):
+        response = client.get("/history/aggregate", params={
+            "start": "2026-01-01T00:00:00Z", "end": "2026-01-02T00:00:00Z", "target": "udp://8.8.8.8:53",
+        })
+        bad_range = client.get("/history/aggregate", params={"start": "2026-01-02T00:00:00Z", "end": "2026-01-01T00:00:00Z"})
+
+    assert response.status_code == 200
+    assert response.json()["series"][0]["avg_ms"] == 12.5
+    mock_aggregate.assert_called_once_with(1767225600.0, 1767312000.0, 3600, target="udp://8.8.8.8:53", protocol=None, qtype=None)
+    assert bad_range.status_code == 400
+    assert client.get("/history/results").status_code == 404
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_inventory_version(mock_celery):
+    from worker.inventory import Inventory
+
+    inventory = Inventory([{"target": "udp://8.8.8.8:53", "tags": []}])
+    redis_client = AsyncMock()
+    with patch.object(app.state, "inventory", inventory), \
+            patch("worker.inventory.get_async_redis", return_value=redis_client):
+        for _ in range(2):
+            response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A"})
+            assert response.status_code == 200
+
+    redis_client.set.assert_called_once_with(f"dnstester:inventory:{inventory.version}", inventory.payload)
+    mock_celery.assert_called_with("example.com", "A", inventory.version, False)
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_inventory_published_again(mock_celery):
+    from worker.inventory import Inventory
+
+    inventory = Inventory([{"target": "udp://8.8.8.8:53", "tags": []}])
+    redis_client = AsyncMock()
+    redis_client.exists.return_value = 0
+    with patch.object(app.state, "inventory", inventory), \
+            patch("worker.inventory.get_async_redis", return_value=redis_client):
+        client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A"})
+        # the key was flushed since the last check
+        inventory.checked_at -= 60
+        response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A"})
+
+    assert response.status_code == 200
+    assert redis_client.set.call_count == 2
+    mock_celery.assert_called_with("example.com", "A", inventory.version, False)
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_inventory_unpublished(mock_celery):
+    import redis
+    from worker.inventory import Inventory
+
+    servers = [{"target": "udp://8.8.8.8:53", "tags": []}]
+    redis_client = AsyncMock()
+    redis_client.set.side_effect = redis.ConnectionError("down")
+    with patch.object(app.state, "inventory", Inventory(servers)), \
+            patch("worker.inventory.get_async_redis", return_value=redis_client):
+        response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A"})
+
+    assert response.status_code == 200
+    mock_celery.assert_called_once_with("example.com", "A", servers, False)
+
+def test_config_reload(tmp_path):
+    import asyncio
+    import os
+    from types import SimpleNamespace
+    from api import metrics
+    from api.config import get_dns_servers_from_yaml, load_yaml_config
+    from api.reload import ConfigReloader
+    from worker.inventory import Inventory
+
+    path = tmp_path / "config.yaml"
+    path.write_text('servers:\n  - ip: "8.8.8.8"\n    services: ["do53/udp"]\n')
+    config = load_yaml_config(str(path))
+    state = SimpleNamespace(app_config=config, inventory=Inventory(get_dns_servers_from_yaml(config)))
+    reloader = ConfigReloader(SimpleNamespace(state=state), str(path), 5)
+
+    async def reload():
+        return await reloader.reload()
+
+    path.write_text('servers:\n  - ip: "not-an-ip"\n    services: ["do53/udp"]\n')
+    assert not asyncio.run(reload())
+    assert state.app_config is config
+    assert metrics.registry.get_sample_value("dns_config_reload_failed") == 1
+
+    path.write_text('servers:\n  - ip: "1.1.1.1"\n    services: ["do53/udp", "do53/tcp"]\n')
+    os.utime(path, ns=(0, reloader.mtime + 1))
+    assert reloader.file_mtime() != reloader.mtime
+    with patch("worker.inventory.get_async_redis", return_value=AsyncMock()) as mock_redis:
+        assert asyncio.run(reload())
+
+    assert [server["target"] for server in state.inventory.servers] == ["udp://1.1.1.1", "tcp://1.1.1.1"]
+    assert state.inventory.published
+    mock_redis.return_value.set.assert_called_once()
+    assert metrics.registry.get_sample_value("dns_config_reload_failed") == 0
+
+
+@patch("api.main.CONFIG_RELOAD_INTERVAL", 0)
+@patch("api.main.multiprocess.mark_process_dead")
+def test_api_shutdown_marks_metrics_process_dead(mock_mark_process_dead):
+    with patch("worker.celeryconfig.PROMETHEUS_MULTIPROC_DIR", "/tmp/metrics"), TestClient(app):
+        mock_mark_process_dead.assert_not_called()
+
+    mock_mark_process_dead.assert_called_once_with(process_identifier())
+
+@patch("worker.lookup.lookup_dns.delay", return_value=MagicMock(id="fake-task-id"))
+def test_post_dnslookup_inventory_filters(mock_celery):
+    from worker.inventory import Inventory
+
+    servers = [
+        {"target": "udp://8.8.8.8:53", "tags": ["DNS_GOOGLE"]},
+        {"target": "udp://9.9.9.9:53", "tags": ["DNS_QUAD9"]},
+        {"target": "tls://9.9.9.9:853", "tags": ["DNS_QUAD9"]},
+    ]
+    with patch.object(app.state, "inventory", Inventory(servers)):
+        response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A", "include_tags": ["DNS_QUAD9"], "protocols": ["dot"]})
+        assert response.status_code == 200
+        mock_celery.assert_called_once_with("example.com", "A", [servers[2]], False)
+
+        response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A", "include_tags": ["UNKNOWN"]})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "No DNS servers match the filters"
+
+    data = {"domain": "example.com", "qtype": "A", "dns_servers": servers, "exclude_tags": ["DNS_QUAD9"]}
+    client.post("/dns-lookup", json=data)
+    mock_celery.assert_called_with("example.com", "A", [servers[0]], False)
+
+def test_post_dnslookup_invalid_protocol_filter():
+    response = client.post("/dns-lookup", json={"domain": "example.com", "qtype": "A", "protocols": ["dnscrypt"]})
+    assert response.status_code == 422
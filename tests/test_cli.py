@@ -1,3 +1,4 @@
+import os
 import pytest
 from types import SimpleNamespace
 from unittest.mock import patch, call
@@ -9,6 +10,7 @@ from cli.commands import (
     sort_result_by_dns_server,
     validate_address,
 )
+from cli.domains_from_file import Domain, DomainType, input_file, open_text
 from cli.version import PACKAGE_VERSION
 
 
@@ -149,6 +151,9 @@ def test_collect_targets_from_file_and_query():
         ]
 
         targets = collect_targets(args)
+        # the file is only read as the targets are consumed
+        mock_input_file.assert_called_once_with("domains.txt")
+        targets = list(targets)
 
     assert targets == [
         ("openai.com", SimpleNamespace(value="AAAA")),
@@ -157,6 +162,53 @@ def test_collect_targets_from_file_and_query():
     ]
 
 
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_input_file_streams_compressed_files(tmp_path, compression):
+    content = "# audited domains\nA;example.com\n\nMX;gmail.com  # mail\nBAD LINE\n"
+    path = tmp_path / "domains.txt"
+    if compression == "gzip":
+        import gzip
+        path.write_bytes(gzip.compress(content.encode()))
+    elif compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        path.write_bytes(zstandard.ZstdCompressor().compress(content.encode()))
+    else:
+        path.write_text(content, encoding="utf-8")
+
+    records = input_file(str(path))
+
+    assert next(records) == Domain("example.com", DomainType.A)
+    assert list(records) == [Domain("gmail.com", DomainType.MX)]
+    assert not hasattr(Domain("example.com", DomainType.A), "__dict__")
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc/self/fd")
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_open_text_closes_the_file(tmp_path, compression):
+    path = tmp_path / "domains.txt"
+    if compression == "gzip":
+        import gzip
+        path.write_bytes(gzip.compress(b"A;example.com\n"))
+    elif compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        path.write_bytes(zstandard.ZstdCompressor().compress(b"A;example.com\n"))
+    else:
+        path.write_text("A;example.com\n", encoding="utf-8")
+    open_fds = len(os.listdir("/proc/self/fd"))
+
+    with open_text(str(path)) as f:
+        assert f.read() == "A;example.com\n"
+
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+
+
+def test_collect_targets_reports_unreadable_file(tmp_path):
+    args = SimpleNamespace(input_file=str(tmp_path / "missing.txt"), query="")
+
+    with pytest.raises(ValueError, match="unable to read"):
+        collect_targets(args)
+
+
 def test_collect_targets_without_any_input():
     args = SimpleNamespace(input_file="", query="")
 
@@ -273,8 +325,8 @@ def test_main_input_file_multiple_domains(tmp_path, capsys):
     assert "alt1.gmail-smtp-in.l.google.com" in captured.out
 
     assert post_mock.call_args_list == [
-        call("http://localhost:5000", "cloudflare.com", ["udp://8.8.8.8"], "AAAA", False),
-        call("http://localhost:5000", "gmail.com", ["udp://8.8.8.8"], "MX", False),
+        call("http://localhost:5000", "cloudflare.com", ["udp://8.8.8.8"], "AAAA", False, priority="bulk"),
+        call("http://localhost:5000", "gmail.com", ["udp://8.8.8.8"], "MX", False, priority="bulk"),
     ]
 
 
@@ -292,4 +344,203 @@ def test_main_with_no_targets(capsys):
             launcher()
 
     captured = capsys.readouterr()
-    assert "Provide a query or --input-file" in captured.out
\ No newline at end of file
+    assert "Provide a query or --input-file" in captured.out
+
+def test_main_input_file_batch_mode(capsys):
+    batch_post = patch("cli.commands.post_dns_lookup_batch", return_value="batch-id").start()
+    batch_get = patch("cli.commands.get_batch_status").start()
+    input_mock = patch("cli.commands.input_file").start()
+
+    input_mock.return_value = [
+        SimpleNamespace(domain="cloudflare.com", domain_type=SimpleNamespace(value="AAAA")),
+        SimpleNamespace(domain="github.com", domain_type=SimpleNamespace(value="A")),
+    ]
+    aaaa = make_success_status(record_type="AAAA", value="2606:4700:4700::1111")["task_result"]
+    a = make_success_status(value="140.82.121.4")["task_result"]
+    batch_get.side_effect = [
+        {"batch_status": "PROGRESS", "progress": 50.0},
+        {"batch_status": "SUCCESS", "progress": 100.0},
+        {
+            "batch_status": "SUCCESS", "progress": 100.0, "failed_chunks": 0, "total_chunks": 1,
+            "results": [
+                {"domain": "cloudflare.com", "qtype": "AAAA", **aaaa},
+                {"domain": "github.com", "qtype": "A", **a},
+            ],
+        },
+    ]
+
+    try:
+        with patch("time.sleep"), patch("sys.argv", ["prog", "--input-file", "domains.txt", "", "udp://8.8.8.8", "--batch"]):
+            launcher(post_dns_lookup_batch_func=batch_post, get_batch_status_func=batch_get)
+    finally:
+        patch.stopall()
+
+    captured = capsys.readouterr()
+    assert "Starting batch DNS lookup for 2 queries" in captured.out
+    assert "[1/2] cloudflare.com (AAAA)" in captured.out
+    assert "2606:4700:4700::1111" in captured.out
+    assert "140.82.121.4" in captured.out
+    batch_post.assert_called_once_with(
+        "http://localhost:5000",
+        [("cloudflare.com", "AAAA"), ("github.com", "A")],
+        ["udp://8.8.8.8"],
+        False,
+    )
+
+
+def test_main_direct_lookup_streamed(mock_post_dns_lookup, capsys):
+    status = make_success_status()
+    server, result = next(iter(status["task_result"]["details"].items()))
+    stream = iter([
+        ("result", {"server": server, "result": result}),
+        ("summary", {"duration": 0.03, "nb_servers": 1, "nb_ok": 1}),
+    ])
+
+    with patch("cli.commands.get_task_status") as mock_get:
+        with patch("sys.argv", ["prog", "example.com", "udp://8.8.8.8"]):
+            launcher(
+                post_dns_lookup_func=mock_post_dns_lookup,
+                get_task_status_func=mock_get,
+                open_task_stream_func=lambda api_url, task_id: stream,
+            )
+
+    captured = capsys.readouterr()
+    assert "udp://8.8.8.8 - Do53 - 30.50000ms - TTL: 300s - 93.184.216.34" in captured.out
+    assert "DNS lookup succeeded for 1 out of 1 servers" in captured.out
+    mock_get.assert_not_called()
+
+
+def test_main_direct_lookup_stream_unavailable_falls_back_to_polling(mock_post_dns_lookup, capsys):
+    with patch("cli.commands.get_task_status", side_effect=[make_success_status()]) as mock_get:
+        with patch("sys.argv", ["prog", "example.com", "udp://8.8.8.8"]):
+            launcher(
+                post_dns_lookup_func=mock_post_dns_lookup,
+                get_task_status_func=mock_get,
+                open_task_stream_func=lambda api_url, task_id: None,
+            )
+
+    captured = capsys.readouterr()
+    assert "93.184.216.34" in captured.out
+    mock_get.assert_called_once()
+
+
+def test_main_loadgen(capsys):
+    post_load_test = patch("cli.commands.post_load_test", return_value="load-task-id").start()
+    get_status = patch("cli.commands.get_load_test_status").start()
+    get_status.side_effect = [
+        {"task_status": "PENDING"},
+        {
+            "task_status": "SUCCESS",
+            "task_result": {
+                "qps": 500,
+                "duration": 10.2,
+                "details": {
+                    "udp://8.8.8.8": {
+                        "sent": 5000, "completed": 4990, "timeouts": 10, "errors": 0,
+                        "achieved_qps": 499.0, "timeout_rate": 0.002, "error_rate": 0.0,
+                        "rcodes": {"NOERROR": 4990},
+                        "latency_ms": {"p50": 12.3, "p90": 20.1, "p99": 45.6, "p999": 80.2, "max": 95.0},
+                        "dns_protocol": "Do53",
+                    },
+                },
+            },
+        },
+    ]
+
+    try:
+        with patch("time.sleep"), patch("sys.argv", ["prog", "loadgen", "udp://8.8.8.8", "--qps", "500", "--domain", "example.com"]):
+            launcher(post_load_test_func=post_load_test, get_load_test_status_func=get_status)
+    finally:
+        patch.stopall()
+
+    captured = capsys.readouterr()
+    assert "Starting load test at 500 qps for 10s with 1 queries" in captured.out
+    assert "udp://8.8.8.8" in captured.out
+    assert "0.20%" in captured.out
+    assert "45.6" in captured.out
+    post_load_test.assert_called_once_with("http://localhost:5000", [("example.com", "A")], ["udp://8.8.8.8"], 500.0, 10, False)
+
+
+def test_loadgen_reads_at_most_the_accepted_query_mix(tmp_path):
+    path = tmp_path / "domains.txt"
+    path.write_text("".join(f"A;example{i}.com\n" for i in range(20)), encoding="utf-8")
+    post_load_test = patch("cli.commands.post_load_test", return_value="load-task-id").start()
+    get_status = patch("cli.commands.get_load_test_status", return_value={"task_status": "FAILURE", "error": "boom"}).start()
+
+    try:
+        with patch("cli.commands.LOAD_TEST_MAX_QUERIES", 5), \
+                patch("sys.argv", ["prog", "loadgen", "udp://8.8.8.8", "--qps", "500", "--input-file", str(path)]):
+            launcher(post_load_test_func=post_load_test, get_load_test_status_func=get_status)
+    finally:
+        patch.stopall()
+
+    assert post_load_test.call_args.args[1] == [(f"example{i}.com", "A") for i in range(5)]
+
+
+def test_main_compare_prints_consistency(mock_post_dns_lookup, capsys):
+    status = make_success_status()
+    status["task_result"]["consistency"] = {
+        "clusters": [
+            {"rcode": "NOERROR", "answers_hash": "a", "answers": ["93.184.216.34"], "servers": ["udp://8.8.8.8", "udp://1.1.1.1"]},
+            {"rcode": "NOERROR", "answers_hash": "b", "answers": ["192.0.2.1"], "servers": ["udp://192.0.2.53"]},
+        ],
+        "agreement": 0.6667,
+        "outliers": {"udp://192.0.2.53": ["answers"]},
+    }
+
+    with patch("cli.commands.get_task_status", return_value=status) as mock_get:
+        with patch("sys.argv", ["prog", "example.com", "udp://8.8.8.8", "--compare", "--no-stream"]):
+            launcher(post_dns_lookup_func=mock_post_dns_lookup, get_task_status_func=mock_get)
+
+    captured = capsys.readouterr()
+    assert "Consensus: 2 of 3 servers agree on NOERROR 93.184.216.34" in captured.out
+    assert "[WARN] udp://192.0.2.53 - outlier: answers" in captured.out
+    assert mock_post_dns_lookup.call_args.kwargs == {"consistency": True}
+
+
+def test_main_reverse_sweep(capsys):
+    post_sweep = patch("cli.commands.post_reverse_sweep", return_value={
+        "sweep_id": "sweep-id", "cidr": "192.0.2.0/31", "total_chunks": 1, "total_addresses": 2,
+    }).start()
+    stream = iter([
+        ("row", {"ip": "192.0.2.0", "ptr": {"udp://8.8.8.8": ["gw.example.net."]}, "rcode": {"udp://8.8.8.8": "NOERROR"}}),
+        ("row", {"ip": "192.0.2.1", "ptr": {}, "rcode": {"udp://8.8.8.8": "NXDOMAIN"}}),
+        ("summary", {"nb_rows": 2, "failed_chunks": 0, "total_chunks": 1}),
+    ])
+    open_stream = patch("cli.commands.open_sweep_stream", return_value=stream).start()
+
+    try:
+        with patch("sys.argv", ["prog", "192.0.2.1/31", "udp://8.8.8.8", "--rate", "50"]):
+            launcher(post_reverse_sweep_func=post_sweep, open_sweep_stream_func=open_stream)
+    finally:
+        patch.stopall()
+
+    captured = capsys.readouterr()
+    post_sweep.assert_called_once_with("http://localhost:5000", "192.0.2.0/31", ["udp://8.8.8.8"], False, 50.0)
+    lines = captured.out.splitlines()
+    assert any(line.startswith("192.0.2.0") and "gw.example.net." in line for line in lines)
+    assert any(line.startswith("192.0.2.1") and "NXDOMAIN" in line for line in lines)
+    assert "2 addresses resolved, 0 of 1 tasks failed" in captured.out
+
+
+def test_main_input_file_bounded_window(capsys):
+    from unittest.mock import MagicMock
+
+    calls = MagicMock()
+    calls.post.side_effect = ["task-1", "task-2", "task-3"]
+    calls.get.side_effect = [
+        make_success_status(value="192.0.2.1"),
+        make_success_status(value="192.0.2.2"),
+        make_success_status(value="192.0.2.3"),
+    ]
+    records = iter([SimpleNamespace(domain=f"host{i}.example.com", domain_type=None) for i in range(1, 4)])
+
+    with patch("cli.commands.input_file", return_value=records), \
+            patch("sys.argv", ["prog", "--input-file", "domains.txt", "", "udp://8.8.8.8", "--window", "2"]):
+        launcher(post_dns_lookup_func=calls.post, get_task_status_func=calls.get)
+
+    # at most two lookups in flight, the third one is submitted once the first completed
+    assert [name for name, _, _ in calls.mock_calls] == ["post", "post", "get", "post", "get", "get"]
+    captured = capsys.readouterr()
+    assert captured.out.index("[1] host1.example.com (A)") < captured.out.index("[3] host3.example.com (A)")
+    assert "192.0.2.3" in captured.out
@@ -82,17 +82,49 @@ def test_get_dns_servers_from_yaml():
     dns_info = get_dns_servers_from_yaml(config)
 
     expected = [
-        {'target': 'udp://8.8.8.8:53', 'tags': ['DNS_GOOGLE']},
-        {'target': 'tcp://8.8.8.8:53', 'tags': ['DNS_GOOGLE']},
-        {'target': 'udp://8.8.4.4:53', 'tags': []},
-        {'target': 'tcp://8.8.4.4:53', 'tags': []},
-        {'target': 'udp://9.9.9.9', 'tags': ['DNS_QUAD9']},
-        {'target': 'tcp://9.9.9.9', 'tags': ['DNS_QUAD9']},
-        {'target': 'tls://dns9.quad9.net', 'tags': ['DNS_QUAD9']},
-        {'target': 'tls://9.9.9.9', 'tags': ['DNS_QUAD9']},
-        {'target': 'https://dns9.quad9.net', 'tags': ['DNS_QUAD9']},
-        {'target': 'https://9.9.9.9', 'tags': ['DNS_QUAD9']},
-        {'target': 'udp://1.1.1.1', 'tags': ['DNS_CLOUDFLARE']},
+        {'target': 'udp://8.8.8.8:53', 'tags': ['DNS_GOOGLE'], 'provider': '8.8.8.8'},
+        {'target': 'tcp://8.8.8.8:53', 'tags': ['DNS_GOOGLE'], 'provider': '8.8.8.8'},
+        {'target': 'udp://8.8.4.4:53', 'tags': [], 'provider': '8.8.4.4'},
+        {'target': 'tcp://8.8.4.4:53', 'tags': [], 'provider': '8.8.4.4'},
+        {'target': 'udp://9.9.9.9', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'tcp://9.9.9.9', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'tls://dns9.quad9.net', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'tls://9.9.9.9', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'https://dns9.quad9.net', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'https://9.9.9.9', 'tags': ['DNS_QUAD9'], 'provider': 'dns9.quad9.net'},
+        {'target': 'udp://1.1.1.1', 'tags': ['DNS_CLOUDFLARE'], 'provider': '1.1.1.1'},
     ]
 
-    assert dns_info == expected
\ No newline at end of file
+    assert dns_info == expected
+
+def test_protocol_divergence_of_a_configured_server():
+    from worker.consistency import analyze, server_providers
+
+    dns_servers = get_dns_servers_from_yaml(APIConfig(**yaml.safe_load(example_yaml)))
+
+    def ok(value):
+        return {"command_status": "ok", "rcode": "NOERROR", "answers": [{"type": "A", "ttl": 300, "value": value}]}
+
+    results = {server["target"]: ok("192.0.2.1") for server in dns_servers}
+    # the DoH endpoint of the Quad9 entry, by hostname, disagrees with its Do53 targets, by IP
+    results["https://dns9.quad9.net"] = ok("192.0.2.2")
+
+    providers = server_providers(dns_servers)
+    assert providers["udp://9.9.9.9"] == providers["https://dns9.quad9.net"]
+    report = analyze(results, providers)
+    assert report["outliers"] == {"https://dns9.quad9.net": ["answers", "protocol_divergence"]}
+def test_get_probe_targets():
+    from api.config import get_probe_targets
+
+    config_data = yaml.safe_load(example_yaml)
+    config_data["servers"][1]["probe_interval"] = 10
+    assert get_probe_targets(APIConfig(**config_data)) == []
+
+    config_data["probes"] = {"interval": 30, "queries": [{"domain": "example.com"}]}
+    config = APIConfig(**config_data)
+    probe_targets = get_probe_targets(config)
+
+    assert config.probes.queries[0].qtype == "A"
+    assert [t["target"] for t in probe_targets] == [t["target"] for t in get_dns_servers_from_yaml(config)]
+    assert probe_targets[0] == {"target": "udp://8.8.8.8:53", "tags": ["DNS_GOOGLE"], "provider": "8.8.8.8", "interval": 30}
+    assert probe_targets[2] == {"target": "udp://8.8.4.4:53", "tags": [], "provider": "8.8.4.4", "interval": 10}
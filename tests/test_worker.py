@@ -1,9 +1,18 @@
+import asyncio
 import json
+import socket
+import threading
+import struct
+
 import pytest
 
-from unittest.mock import patch, MagicMock
-from worker.q import run_q
-from worker.q import get_dns_protocol_from_target
+from unittest.mock import patch, MagicMock, AsyncMock
+from worker.q import run_q, run_q_batch
+from worker.q import Q_VALUE_EXTRACTORS, _q_generic, get_dns_protocol_from_target
+from worker.dnswire import build_query, encode_name, parse_response, reverse_name, type_name
+from worker.native import split_target
+from worker import engine, pool
+from tests.dns_stub import StubDNSServer, StubTLSServer, build_answer, make_self_signed_cert, serve_doq_stub
 
 MOCK_Q_SUCCESS_OUTPUT = b'''
 [
@@ -37,15 +46,18 @@ MOCK_Q_SUCCESS_OUTPUT = b'''
 ]
 '''
 
-@patch("subprocess.Popen")
-def test_run_q_success(mock_popen):
+def mock_q_process(stdout, returncode=0):
+    process = MagicMock()
+    process.communicate = AsyncMock(return_value=(stdout, b""))
+    process.returncode = returncode
+    return process
+
+@patch("asyncio.create_subprocess_exec")
+def test_run_q_success(mock_exec):
     """Test successful execution of q"""
-    mock_process = MagicMock()
-    mock_process.communicate.return_value = (MOCK_Q_SUCCESS_OUTPUT, b"")
-    mock_process.returncode = 0
-    mock_popen.return_value = mock_process
+    mock_exec.return_value = mock_q_process(MOCK_Q_SUCCESS_OUTPUT)
 
-    result = run_q("example.com", "A", [ {"target": "udp://8.8.8.8", "tags": "test"} ], False)
+    result = run_q("example.com", "A", [ {"target": "udp://8.8.8.8", "tags": "test"} ], False, backend="q")
 
     # Check if server key exists in results
     assert "udp://8.8.8.8" in result
@@ -88,4 +100,937 @@ def test_run_q_success(mock_popen):
     ("", "Unknown"),
 ])
 def test_get_dns_protocol_from_target(target, expected):
-    assert get_dns_protocol_from_target(target) == expected
\ No newline at end of file
+    assert get_dns_protocol_from_target(target) == expected
+
+
+@pytest.mark.parametrize("target,expected", [
+    ("udp://8.8.8.8:53", ("udp", "8.8.8.8", 53)),
+    ("tcp://1.1.1.1", ("tcp", "1.1.1.1", 53)),
+    ("udp://[2001:db8::1]:5353", ("udp", "2001:db8::1", 5353)),
+    ("udp://[2001:db8::1]", ("udp", "2001:db8::1", 53)),
+])
+def test_split_target(target, expected):
+    assert split_target(target) == expected
+
+
+def test_parse_response_with_compression():
+    msg_id, query = build_query("example.com", "A", msg_id=4242)
+    records = {("example.com.", 1): [(300, bytes([93, 184, 216, 34])), (300, bytes([93, 184, 216, 35]))]}
+
+    response = parse_response(build_answer(query, records))
+
+    assert response["id"] == 4242
+    assert response["rcode"] == 0
+    assert response["question"] == [{"name": "example.com.", "qtype": 1, "qclass": 1}]
+    assert [ans["value"] for ans in response["answer"]] == ["93.184.216.34", "93.184.216.35"]
+    assert response["answer"][0]["name"] == "example.com."
+
+
+@pytest.mark.parametrize("qtype,rdata,expected", [
+    ("MX", struct.pack("!H", 10) + encode_name("mx.example.com"), "10 mx.example.com."),
+    ("SOA", encode_name("ns1.example.com") + encode_name("hostmaster.example.com") + struct.pack("!IIIII", 2024, 7200, 3600, 1209600, 300),
+     "ns1.example.com. hostmaster.example.com. 2024 7200 3600 1209600 300"),
+    ("SRV", struct.pack("!HHH", 0, 5, 5060) + encode_name("sip.example.com"), "0 5 5060 sip.example.com."),
+    ("CAA", bytes([0, 5]) + b"issue" + b"letsencrypt.org", '0 issue "letsencrypt.org"'),
+    ("DS", struct.pack("!HBB", 2371, 13, 2) + bytes.fromhex("c0ffee"), "2371 13 2 C0FFEE"),
+    ("TXT", bytes([5]) + b"hello" + bytes([6]) + b" world", "hello world"),
+    ("HTTPS", struct.pack("!H", 1) + encode_name("") + struct.pack("!HH", 1, 3) + bytes([2]) + b"h2"
+     + struct.pack("!HH", 4, 4) + bytes([192, 0, 2, 1]), "1 . alpn=h2 ipv4hint=192.0.2.1"),
+    ("NSEC", encode_name("b.example.com") + bytes([0, 1, 0x40]), "b.example.com. A"),
+])
+def test_parse_response_record_types(qtype, rdata, expected):
+    _, query = build_query("example.com", qtype)
+    code = struct.unpack("!H", query[-4:-2])[0]
+
+    response = parse_response(build_answer(query, {("example.com.", code): [(60, rdata), (60, rdata)]}))
+
+    assert [ans["value"] for ans in response["answer"]] == [expected, expected]
+
+
+def test_parse_response_unknown_type():
+    _, query = build_query("example.com", "A")
+    query = query[:-4] + struct.pack("!HH", 65280, 1)
+
+    response = parse_response(build_answer(query, {("example.com.", 65280): [(60, b"\x01\x02")]}))
+
+    assert type_name(65280) == "TYPE65280"
+    assert response["answer"][0]["value"] == "\\# 2 0102"
+
+
+@pytest.mark.parametrize("ans,expected", [
+    ({"hdr": {"rrtype": 15}, "preference": 10, "mx": "mx.example.com."}, "10 mx.example.com."),
+    ({"hdr": {"rrtype": 16}, "txt": ["v=spf1 ", "-all"]}, "v=spf1 -all"),
+    ({"hdr": {"rrtype": 33}, "priority": 0, "weight": 5, "port": 5060, "target": "sip.example.com."}, "0 5 5060 sip.example.com."),
+    ({"hdr": {"rrtype": 43}, "keytag": 2371, "algorithm": 13, "digesttype": 2, "digest": "C0FFEE"}, "2371 13 2 C0FFEE"),
+])
+def test_q_value_extractors(ans, expected):
+    extractor = Q_VALUE_EXTRACTORS.get(ans["hdr"]["rrtype"], _q_generic)
+    assert extractor(ans) == expected
+
+
+def test_reverse_name():
+    assert reverse_name("8.8.8.8") == "8.8.8.8.in-addr.arpa."
+    assert reverse_name("2001:db8::1").endswith(".8.b.d.0.1.0.0.2.ip6.arpa.")
+
+
+@pytest.mark.parametrize("scheme", ["udp", "tcp"])
+def test_run_q_native_backend(scheme):
+    """The native backend returns the same result shape as q, without a subprocess"""
+    with StubDNSServer() as stub, patch("asyncio.create_subprocess_exec") as mock_exec:
+        target = f"{scheme}://127.0.0.1:{stub.port}"
+        result = run_q("example.com", "A", [{"target": target, "tags": ["stub"]}], False, backend="native")
+
+    mock_exec.assert_not_called()
+    server_result = result[target]
+    assert server_result["command_status"] == "ok"
+    assert server_result["dns_protocol"] == "Do53"
+    assert server_result["tags"] == ["stub"]
+    assert server_result["rcode"] == "NOERROR"
+    assert server_result["name"] == "example.com."
+    assert server_result["qtype"] == "A"
+    assert server_result["time_ms"] > 0
+    assert server_result["answers"] == [
+        {"name": "example.com.", "type": "A", "ttl": 300, "value": "93.184.216.34"}
+    ]
+
+
+def test_run_q_native_nxdomain_and_tcp_fallback():
+    with StubDNSServer(truncate_udp=True) as stub:
+        target = f"udp://127.0.0.1:{stub.port}"
+        result = run_q("unknown.example.com", "A", [{"target": target}], False, backend="native")
+
+    assert result[target]["command_status"] == "ok"
+    assert result[target]["rcode"] == "NXDOMAIN"
+    assert result[target]["answers"] == []
+
+
+@patch("worker.native.NATIVE_SCHEMES", ("udp://", "tcp://"))
+@patch("asyncio.create_subprocess_exec")
+def test_run_q_native_backend_delegates_unsupported_targets(mock_exec):
+    mock_exec.return_value = mock_q_process(MOCK_Q_SUCCESS_OUTPUT)
+
+    result = run_q("example.com", "A", [{"target": "tls://1.1.1.1"}], False, backend="native")
+
+    mock_exec.assert_called_once()
+    assert result["tls://1.1.1.1"]["command_status"] == "ok"
+
+
+def test_run_q_many_servers_constant_threads():
+    """Hundreds of targets are queried without spawning a thread per server"""
+    with StubDNSServer() as stub:
+        run_q("example.com", "A", [{"target": f"udp://127.0.0.1:{stub.port}"}], False, backend="native")
+        threads_before = threading.active_count()
+        servers = [{"target": f"udp://127.0.0.1:{stub.port}/{i}"} for i in range(300)]
+        result = run_q("example.com", "A", servers, False, backend="native")
+        threads_after = threading.active_count()
+
+    assert len(result) == 300
+    assert all(r["command_status"] == "ok" for r in result.values())
+    assert threads_after == threads_before
+
+
+def test_run_q_per_server_deadline():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    target = f"udp://127.0.0.1:{silent.getsockname()[1]}"
+    try:
+        with patch("worker.celeryconfig.DNS_SERVER_DEADLINE", 0.2):
+            result = run_q("example.com", "A", [{"target": target}], False, backend="native")
+    finally:
+        silent.close()
+
+    assert result[target]["command_status"] == "error"
+    assert "Deadline of 0.2s exceeded" in result[target]["error"]
+
+
+@pytest.fixture
+def stub_cert(tmp_path):
+    pytest.importorskip("cryptography")
+    return make_self_signed_cert(tmp_path)
+
+
+@pytest.mark.parametrize("protocol,scheme,dns_protocol", [
+    ("dot", "tls", "DoT"),
+    pytest.param("doh", "https", "DoH", marks=pytest.mark.skipif(not pool.HTTP2_AVAILABLE, reason="httpx[http2] not installed")),
+])
+def test_run_q_pooled_connection_reused(stub_cert, protocol, scheme, dns_protocol):
+    with StubTLSServer(*stub_cert, protocol=protocol) as stub:
+        target = f"{scheme}://127.0.0.1:{stub.port}"
+        first = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+        second = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+
+    assert first["command_status"] == "ok", first
+    assert first["dns_protocol"] == dns_protocol
+    assert first["answers"][0]["value"] == "93.184.216.34"
+    assert first["connection_reused"] is False
+    assert first["handshake_ms"] > 0
+
+    assert second["command_status"] == "ok"
+    assert second["connection_reused"] is True
+    assert second["handshake_ms"] == 0
+    assert stub.connections == 1
+
+
+def test_run_q_pooled_connection_idle_eviction(stub_cert):
+    with StubTLSServer(*stub_cert, protocol="dot") as stub:
+        target = f"tls://127.0.0.1:{stub.port}"
+        run_q("example.com", "A", [{"target": target}], True, backend="native")
+        with patch("worker.celeryconfig.DNS_POOL_IDLE_TIMEOUT", 0):
+            result = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+
+    assert result["command_status"] == "ok"
+    assert result["connection_reused"] is False
+    assert stub.connections == 2
+
+
+def test_run_q_pooled_connection_certificate_verification(stub_cert):
+    with StubTLSServer(*stub_cert, protocol="dot") as stub:
+        target = f"tls://127.0.0.1:{stub.port}"
+        result = run_q("example.com", "A", [{"target": target}], False, backend="native")[target]
+
+    assert result["command_status"] == "error"
+    assert "CERTIFICATE_VERIFY_FAILED" in result["error"]
+
+
+@pytest.mark.skipif(not pool.QUIC_AVAILABLE, reason="aioquic not installed")
+def test_run_q_doq_session_resumption(stub_cert):
+    async def start():
+        return await serve_doq_stub(*stub_cert)
+
+    server, port = engine.run(start())
+    target = f"quic://127.0.0.1:{port}"
+    try:
+        first = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+        second = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+        with patch("worker.celeryconfig.DNS_POOL_IDLE_TIMEOUT", 0):
+            third = run_q("example.com", "A", [{"target": target}], True, backend="native")[target]
+    finally:
+        server.close()
+
+    assert first["command_status"] == "ok", first
+    assert first["dns_protocol"] == "DoQ"
+    assert first["connection_reused"] is False
+    assert second["connection_reused"] is True
+    assert third["connection_reused"] is False
+    assert third["session_resumed"] is True
+
+
+def test_run_q_batch():
+    with StubDNSServer() as stub:
+        target = f"udp://127.0.0.1:{stub.port}"
+        results = run_q_batch([("example.com", "A"), ("unknown.example.com", "A")], [{"target": target}], False, backend="native")
+
+    assert [(r["domain"], r["qtype"]) for r in results] == [("example.com", "A"), ("unknown.example.com", "A")]
+    assert results[0]["details"][target]["rcode"] == "NOERROR"
+    assert results[1]["details"][target]["rcode"] == "NXDOMAIN"
+    assert all(r["duration"] >= 0 for r in results)
+
+
+def test_lookup_dns_streams_partial_results():
+    from worker.lookup import lookup_dns
+
+    with StubDNSServer() as stub, \
+            patch("worker.celeryconfig.RESULT_STREAMING", True), \
+            patch("worker.celeryconfig.DNS_BACKEND", "native"), \
+            patch("worker.streams.publish", new_callable=AsyncMock) as mock_publish:
+        target = f"udp://127.0.0.1:{stub.port}"
+        result = lookup_dns.apply(args=("example.com", "A", [{"target": target}], False), task_id="task-1").get()
+
+    assert result["details"][target]["command_status"] == "ok"
+    events = [c.args for c in mock_publish.await_args_list]
+    assert events[0] == ("task-1", "result", {"server": target, "result": result["details"][target]})
+    assert events[-1][:2] == ("task-1", "summary")
+    assert events[-1][2]["nb_servers"] == 1
+    assert events[-1][2]["nb_ok"] == 1
+
+
+@pytest.mark.parametrize("result, expected", [
+    ({"command_status": "ok", "rcode": "NOERROR", "answers": [{"ttl": 300}, {"ttl": 60}]}, 60),
+    ({"command_status": "ok", "rcode": "NXDOMAIN", "answers": []}, 30),
+    ({"command_status": "ok", "rcode": "SERVFAIL", "answers": []}, 30),
+    ({"command_status": "ok", "rcode": "NOERROR", "answers": []}, 30),
+    ({"command_status": "ok", "rcode": "REFUSED", "answers": []}, 0),
+    ({"command_status": "error", "error": "timeout"}, 0),
+])
+def test_cache_ttl(result, expected):
+    from worker.cache import cache_ttl
+
+    with patch("worker.celeryconfig.DNS_CACHE_NEGATIVE_TTL", 30):
+        assert cache_ttl(result) == expected
+
+
+def test_run_q_answer_cache():
+    from worker.cache import AnswerCache
+
+    redis_client = AsyncMock()
+    redis_client.get.return_value = None
+    with StubDNSServer() as stub, \
+            patch("worker.celeryconfig.DNS_CACHE_ENABLED", True), \
+            patch("worker.q.get_cache", return_value=AnswerCache(100)), \
+            patch("worker.cache.get_async_redis", return_value=redis_client):
+        target = f"udp://127.0.0.1:{stub.port}"
+        first = run_q("example.com", "A", [{"target": target}], False, backend="native")
+        second = run_q("example.com", "A", [{"target": target}], False, backend="native")
+        bypassed = run_q("example.com", "A", [{"target": target}], False, backend="native", bypass_cache=True)
+        queries = stub.queries
+
+    assert queries == 2
+    assert "cached" not in first[target]
+    assert second[target]["cached"] is True
+    assert second[target]["answers"][0]["value"] == "93.184.216.34"
+    assert "cached" not in bypassed[target]
+    key, payload = redis_client.set.await_args.args
+    assert key == f"dnstester:cache:{target}|example.com|A"
+    assert json.loads(payload)["result"]["rcode"] == "NOERROR"
+    assert redis_client.set.await_args.kwargs["ex"] == 300 + 300
+
+
+def test_due_probes_spread_over_interval():
+    from worker.probes import due_probes
+
+    targets = [{"target": f"udp://192.0.2.{i}", "tags": [], "interval": 60} for i in range(1, 101)]
+    due = due_probes(targets, 1200, 1260)
+
+    assert sorted(t["target"] for t, _ in due) == sorted(t["target"] for t in targets)
+    assert all(1200 <= due_at < 1260 for _, due_at in due)
+    # probes are spread over the interval, not all at the window start
+    assert len({int(due_at) // 10 for _, due_at in due}) == 6
+    assert due_probes(targets, 1260, 1320)[0][1] == due[0][1] + 60
+
+    fast = [{"target": "udp://192.0.2.1", "tags": [], "interval": 5}]
+    assert len(due_probes(fast, 1200, 1210)) == 2
+
+
+def test_dispatch_probes():
+    from api.models_config import ProbesConfig
+    from worker.lookup import dispatch_probes
+
+    config = ProbesConfig(interval=60, jitter=0.5, queries=[{"domain": "example.com", "qtype": "A"}])
+    targets = [{"target": "udp://192.0.2.1", "tags": ["T"], "interval": 10}]
+    with patch("worker.probes.load_probes", return_value=(config, targets)), \
+            patch("worker.celeryconfig.PROBE_TICK", 10), \
+            patch("worker.lookup.probe_server.apply_async") as mock_apply_async:
+        dispatch_probes.apply()
+
+    mock_apply_async.assert_called_once()
+    kwargs = mock_apply_async.call_args.kwargs
+    assert kwargs["args"] == ({"target": "udp://192.0.2.1", "tags": ["T"]}, [("example.com", "A")], False)
+    assert 0 <= kwargs["countdown"] < 10 + 5
+    # relative to now, like countdown
+    assert kwargs["countdown"] <= kwargs["expires"] <= kwargs["countdown"] + 10
+
+
+def test_probe_server_bypasses_cache():
+    from worker.lookup import probe_server
+
+    with patch("worker.lookup.run_q") as mock_run_q:
+        result = probe_server.apply(args=({"target": "udp://192.0.2.1", "tags": []}, [("example.com", "A"), ("example.com", "AAAA")], False))
+
+    assert result.get() is None
+    assert mock_run_q.call_count == 2
+    mock_run_q.assert_called_with("example.com", "AAAA", [{"target": "udp://192.0.2.1", "tags": []}], False, bypass_cache=True)
+
+
+def test_loadgen_percentile():
+    from worker.loadgen import percentile
+
+    values = list(range(1, 1001))
+    assert percentile(values, 50) == 500
+    assert percentile(values, 99.9) == 999
+    assert percentile(values, 100) == 1000
+    assert percentile([], 50) is None
+
+
+def test_load_test_open_loop():
+    from worker.lookup import load_test
+
+    with StubDNSServer() as stub:
+        target = f"udp://127.0.0.1:{stub.port}"
+        result = load_test.apply(args=(
+            [{"target": target}], [("example.com", "A"), ("unknown.example.com", "A")], 200, 0.5, False,
+        )).get()
+        queries = stub.queries
+
+    stats = result["details"][target]
+    assert queries == stats["sent"] == 100
+    assert stats["completed"] == 100 and stats["timeouts"] == 0 and stats["errors"] == 0
+    assert stats["rcodes"] == {"NOERROR": 50, "NXDOMAIN": 50}
+    assert stats["latency_ms"]["p50"] <= stats["latency_ms"]["p99"] <= stats["latency_ms"]["max"]
+    assert 0.45 <= result["duration"] < 2
+    assert stats["dns_protocol"] == "Do53"
+
+
+def test_load_target_caps_in_flight_queries_when_behind():
+    from worker.loadgen import load_target
+
+    in_flight = peak = 0
+
+    async def slow_query(*args):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return {"rcode": 0}, None
+
+    with patch("worker.loadgen.native.query", new=slow_query), patch("worker.celeryconfig.DNS_QUERY_TIMEOUT", 0.01):
+        stats = engine.run(load_target("udp://192.0.2.1", [("example.com", "A")], 1000, 0.1, False))
+
+    assert stats["sent"] == stats["completed"] == 100
+    assert peak <= 11
+
+
+def test_run_load_test_shares_the_fd_budget_and_counts_local_errors():
+    import errno
+    from worker.loadgen import run_load_test
+
+    in_flight = peak = 0
+
+    async def query(domain, qtype, target, *args):
+        nonlocal in_flight, peak
+        if target == "udp://192.0.2.2":
+            raise OSError(errno.EMFILE, "Too many open files")
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return {"rcode": 0}, None
+
+    with patch("worker.loadgen.native.query", new=query), patch("worker.loadgen.fd_budget", return_value=10):
+        results = engine.run(run_load_test(["udp://192.0.2.1", "udp://192.0.2.2"], [("example.com", "A")], 1000, 0.1, False))
+
+    assert results["udp://192.0.2.1"]["completed"] == 100
+    assert peak <= 5
+    assert results["udp://192.0.2.2"]["local_errors"] == 100
+    assert results["udp://192.0.2.2"]["errors"] == 0
+
+
+def test_latency_sketch_accuracy_and_merge():
+    import random
+    from worker.sketch import LatencySketch
+
+    rng = random.Random(42)
+    values = [rng.lognormvariate(2.5, 0.8) for _ in range(20000)]
+    first, second = LatencySketch(), LatencySketch()
+    for i, value in enumerate(values):
+        (first if i % 2 else second).add(value)
+    first.merge(second)
+
+    values.sort()
+    assert first.count == len(values)
+    for q in (0.5, 0.95, 0.99, 0.999):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(first.quantile(q) - exact) / exact <= 0.011
+    # memory depends on the range of the values, not on their number
+    assert len(first.bins) < 600
+    assert LatencySketch().quantile(0.5) is None
+
+
+def test_latency_flush_and_read_window():
+    from worker import latency
+
+    store = {}
+
+    class FakePipeline:
+        def __init__(self):
+            self.calls = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def hincrby(self, key, field, count):
+            self.calls.append(("hincrby", key, field, count))
+
+        def expire(self, key, ttl):
+            self.calls.append(("expire", key, ttl))
+
+        def hgetall(self, key):
+            self.calls.append(("hgetall", key))
+
+        async def execute(self):
+            replies = []
+            for call in self.calls:
+                if call[0] == "hincrby":
+                    fields = store.setdefault(call[1], {})
+                    fields[call[2].encode()] = fields.get(call[2].encode(), 0) + call[3]
+                if call[0] == "hgetall":
+                    replies.append(store.get(call[1], {}))
+            return replies
+
+    redis_client = MagicMock()
+    redis_client.pipeline.side_effect = lambda **kwargs: FakePipeline()
+    with patch("worker.latency.get_async_redis", return_value=redis_client):
+        # two workers flushing the same series are merged in Redis
+        for _ in range(2):
+            for ms in (10, 20, 30, 40):
+                latency.record("udp://192.0.2.1", "Do53", "A", ms)
+            engine.run(latency.flush())
+        sketches = engine.run(latency.read_window(60))
+
+    sketch = sketches[("udp://192.0.2.1", "Do53", "A")]
+    assert sketch.count == 8
+    assert abs(sketch.quantile(0.5) - 20) <= 0.2
+
+
+@pytest.mark.parametrize("nb_servers", [1, 200])
+def test_compact_result_encoding(nb_servers):
+    from kombu.serialization import dumps, loads
+    from scripts.benchmark_result_encoding import make_result
+    from worker import serialization
+
+    meta = make_result(nb_servers)
+    content_type, content_encoding, data = dumps(meta, serializer=serialization.SERIALIZER_NAME)
+
+    assert content_type == serialization.CONTENT_TYPE
+    assert loads(data, content_type, content_encoding, accept=[serialization.CONTENT_TYPE]) == meta
+    assert len(data) < len(json.dumps(meta))
+    if nb_servers > 1:
+        assert data[:1] == serialization.FORMAT_ZSTD
+        assert len(data) < len(json.dumps(meta)) / 5
+
+
+def test_lookup_result_compact_backend():
+    from worker import serialization
+    from worker.lookup import wrk
+
+    assert serialization.SERIALIZER_NAME in wrk.conf.result_accept_content
+    backend = wrk.backend
+    with patch.object(backend, "serializer", serialization.SERIALIZER_NAME), \
+            patch.object(backend, "content_type", serialization.CONTENT_TYPE), \
+            patch.object(backend, "content_encoding", "binary"):
+        payload = backend.encode({"status": "SUCCESS", "result": {"details": {}, "duration": 0.1}})
+        assert backend.decode(payload) == {"status": "SUCCESS", "result": {"details": {}, "duration": 0.1}}
+
+
+def make_history_result(time_ms, status="ok", value="93.184.216.34"):
+    if status != "ok":
+        return {"command_status": "error", "error": "timeout"}
+    return {
+        "command_status": "ok", "time_ms": time_ms, "dns_protocol": "DoH", "rcode": "NOERROR",
+        "answers": [{"name": "example.com.", "type": "A", "ttl": 300, "value": value}],
+    }
+
+
+def test_history_record_query_and_rollup(tmp_path):
+    from worker import history
+
+    day = 86400
+    now = 20000 * day + 3600 * 10
+    target = "https://9.9.9.9"
+    with patch("worker.celeryconfig.HISTORY_DIR", str(tmp_path)), \
+            patch("worker.celeryconfig.HISTORY_RAW_DAYS", 7), \
+            patch("worker.celeryconfig.HISTORY_RETENTION_DAYS", 30), \
+            patch("worker.history._writer", None):
+        for days_ago in (40, 8, 0):
+            for i, ms in enumerate((10, 20, 30, None)):
+                result = make_history_result(ms, status="ok" if ms else "error")
+                history.record("example.com", "A", {target: result, "udp://8.8.8.8": {**result, "cached": True}},
+                               timestamp=now - days_ago * day + i)
+        history.get_writer().flush()
+
+        rows = history.query_results(now - 3600, now + 3600, target=target)
+        assert [(r["time_ms"], r["status"]) for r in rows] == [(10, "ok"), (20, "ok"), (30, "ok"), (None, "error")]
+        assert rows[0]["answer_hash"] == history.answer_hash([{"type": "A", "value": "93.184.216.34"}])
+        assert history.query_results(now - 3600, now + 3600, target="udp://8.8.8.8") == []
+
+        history.maintain(now)
+
+        assert sorted(p.name for p in tmp_path.glob("*.sqlite")) == [
+            f"results-{history.day_of(now - 8 * day):%Y%m%d}.sqlite",
+            f"results-{history.day_of(now):%Y%m%d}.sqlite",
+        ]
+        # the raw rows of the downsampled day are gone, its hourly aggregate remains
+        assert history.query_results(now - 9 * day, now - 7 * day) == []
+        series = history.aggregate(now - 9 * day, now + 3600, 86400, target=target)
+
+    assert [(b["count"], b["errors"], b["avg_ms"]) for b in series] == [(4, 1, 20.0), (4, 1, 20.0)]
+    assert abs(series[0]["p50"] - 20) <= 0.2
+    assert series[0]["p50"] == series[1]["p50"]
+
+
+def test_circuit_breaker_and_adaptive_timeout():
+    from worker.health import CLOSED, HALF_OPEN, OPEN, HealthTracker
+
+    tracker = HealthTracker()
+    target = "udp://192.0.2.1"
+    with patch("worker.celeryconfig.DNS_BREAKER_THRESHOLD", 3), \
+            patch("worker.celeryconfig.DNS_BREAKER_COOLDOWN", 30), \
+            patch("worker.celeryconfig.DNS_QUERY_TIMEOUT", 3), \
+            patch("worker.celeryconfig.DNS_TIMEOUT_MIN", 0.05), \
+            patch("worker.health.time.monotonic") as mock_now:
+        mock_now.return_value = 1000
+        assert tracker.timeout(target) == 3
+        for _ in range(20):
+            tracker.record(target, {"command_status": "ok", "time_ms": 20})
+        assert 0.02 <= tracker.timeout(target) < 0.1
+
+        for _ in range(3):
+            assert tracker.allow(target)
+            tracker.record(target, {"command_status": "error", "error": "timeout"})
+        assert tracker.get(target).state == OPEN
+        assert not tracker.allow(target)
+        assert tracker.skipped_result(target)["command_status"] == "skipped"
+
+        # after the cooldown a single probe goes through
+        mock_now.return_value = 1031
+        assert tracker.allow(target)
+        assert tracker.get(target).state == HALF_OPEN
+        assert not tracker.allow(target)
+        tracker.record(target, {"command_status": "error", "error": "timeout"})
+        assert tracker.get(target).state == OPEN
+
+        mock_now.return_value = 1062
+        assert tracker.allow(target)
+        tracker.record(target, {"command_status": "ok", "time_ms": 20})
+        assert tracker.get(target).state == CLOSED
+        assert tracker.allow(target)
+
+
+def test_run_q_skips_server_with_open_breaker():
+    from worker.health import HealthTracker
+
+    dead = "udp://127.0.0.1:9"
+    with patch("worker.health._tracker", HealthTracker()), \
+            patch("worker.celeryconfig.DNS_BREAKER_THRESHOLD", 2), \
+            patch("worker.celeryconfig.DNS_QUERY_TIMEOUT", 0.1), \
+            patch("worker.q.native.query", side_effect=ConnectionRefusedError("refused")) as mock_query:
+        for _ in range(2):
+            assert run_q("example.com", "A", [{"target": dead}], False, backend="native")[dead]["command_status"] == "error"
+        calls = mock_query.call_count
+        result = run_q("example.com", "A", [{"target": dead, "tags": ["lab"]}], False, backend="native")[dead]
+
+    assert mock_query.call_count == calls
+    assert result["command_status"] == "skipped"
+    assert result["dns_protocol"] == "Do53"
+    assert result["tags"] == ["lab"]
+    assert "Circuit breaker open after 2 consecutive failures" in result["error"]
+
+
+def test_breaker_probe_released_when_cancelled_waiting_for_limiter():
+    import asyncio
+    from worker.health import HALF_OPEN, HealthTracker
+    from worker.q import _query_server
+
+    target = "udp://192.0.2.1"
+    tracker = HealthTracker()
+    tracker.get(target).state = HALF_OPEN
+
+    async def cancel_while_queued():
+        # no slot ever frees up: the probe is cancelled before being sent
+        with patch("worker.engine.limiter", return_value=asyncio.Semaphore(0)):
+            task = asyncio.create_task(_query_server("example.com", "A", {"target": target}, False, backend="native"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    with patch("worker.health._tracker", tracker):
+        assert engine.run(cancel_while_queued())
+
+    assert tracker.get(target).probing is False
+    assert tracker.allow(target)
+
+
+def test_run_q_first_answers_cancels_outstanding_queries():
+    from worker.health import HealthTracker
+
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    slow = f"udp://127.0.0.1:{silent.getsockname()[1]}"
+    try:
+        with StubDNSServer() as stub, patch("worker.health._tracker", HealthTracker()):
+            fast = f"udp://127.0.0.1:{stub.port}"
+            start = engine.get_loop().time()
+            result = run_q("example.com", "A", [{"target": slow}, {"target": fast}], False, backend="native", first_answers=1)
+            elapsed = engine.get_loop().time() - start
+    finally:
+        silent.close()
+
+    assert list(result) == [slow, fast]
+    assert result[fast]["command_status"] == "ok"
+    assert result[slow]["command_status"] == "unanswered"
+    assert result[slow]["error"].startswith("Cancelled")
+    assert elapsed < 1
+
+
+def test_run_q_hedged_lookup():
+    from worker.health import HealthTracker
+
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    slow = f"udp://127.0.0.1:{silent.getsockname()[1]}"
+    try:
+        with StubDNSServer() as stub, StubDNSServer() as spare, \
+                patch("worker.health._tracker", HealthTracker()), \
+                patch("worker.celeryconfig.DNS_HEDGE_DELAY", 0.05):
+            fast = f"udp://127.0.0.1:{stub.port}"
+            unused = f"udp://127.0.0.1:{spare.port}"
+            servers = [{"target": slow}, {"target": fast}, {"target": unused}]
+            result = run_q("example.com", "A", servers, False, backend="native", hedge=True)
+    finally:
+        silent.close()
+
+    assert result[fast]["command_status"] == "ok"
+    assert result[slow]["command_status"] == "unanswered"
+    assert result[unused]["command_status"] == "unanswered"
+    assert result[unused]["error"].startswith("Not queried")
+    assert spare.queries == 0
+
+
+def test_run_q_deadline():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    target = f"udp://127.0.0.1:{silent.getsockname()[1]}"
+    try:
+        with patch("worker.health._tracker", None):
+            result = run_q("example.com", "A", [{"target": target}], False, backend="native", deadline=0.1)
+    finally:
+        silent.close()
+
+    assert result[target]["command_status"] == "unanswered"
+
+
+def test_run_q_multiple_qtypes():
+    """All the qtypes are resolved in one fan-out, grouped by server then by qtype"""
+    from worker.health import HealthTracker
+
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    slow = f"udp://127.0.0.1:{silent.getsockname()[1]}"
+    try:
+        with StubDNSServer() as stub, patch("worker.health._tracker", HealthTracker()):
+            fast = f"udp://127.0.0.1:{stub.port}"
+            result = run_q("example.com", ["A", "AAAA"], [{"target": fast}, {"target": slow}], False,
+                           backend="native", deadline=0.3)
+    finally:
+        silent.close()
+
+    assert list(result) == [fast, slow]
+    assert list(result[fast]) == ["A", "AAAA"]
+    assert result[fast]["A"]["answers"][0]["value"] == "93.184.216.34"
+    assert result[fast]["AAAA"]["qtype"] == "AAAA"
+    assert result[fast]["AAAA"]["answers"] == []
+    assert result[slow]["A"]["command_status"] == "unanswered"
+    assert result[slow]["AAAA"]["qtype"] == "AAAA"
+    assert stub.queries == 2
+
+
+def test_run_q_multiple_qtypes_rejects_early_return():
+    with pytest.raises(ValueError):
+        run_q("example.com", ["A", "AAAA"], [{"target": "udp://127.0.0.1:53"}], False, first_answers=1)
+
+
+def test_task_routes_and_queue_wait_time():
+    from types import SimpleNamespace
+    from worker import metrics, queues
+    from worker.lookup import wrk
+
+    assert wrk.amqp.router.route({}, "worker.lookup.lookup_dns")["queue"].name == "interactive"
+    assert wrk.amqp.router.route({}, "worker.lookup.lookup_dns_batch")["queue"].name == "bulk"
+
+    headers = {}
+    with patch("time.time", return_value=1000.0):
+        queues.stamp_sent_at(headers)
+    request = SimpleNamespace(delivery_info={"routing_key": "bulk"}, eta=None, **headers)
+    before = metrics.dns_queue_wait_time.labels(queue="bulk")._sum.get()
+    with patch("time.time", return_value=1012.5):
+        queues.observe_wait(request)
+
+    assert metrics.dns_queue_wait_time.labels(queue="bulk")._sum.get() == before + 12.5
+
+
+def test_lookup_sharded_by_protocol():
+    from celery.exceptions import Ignore
+    from worker.lookup import lookup_dns, merge_shards
+
+    servers = [{"target": "udp://8.8.8.8"}, {"target": "quic://1.1.1.1"}, {"target": "tcp://9.9.9.9"}]
+    with patch("worker.celeryconfig.PROTOCOL_SHARDING", True), \
+            patch("worker.lookup.run_q") as mock_run_q, \
+            patch.object(lookup_dns, "replace", side_effect=Ignore()) as mock_replace:
+        lookup_dns.apply(args=("example.com", "A", servers, False), task_id="task-id")
+
+    mock_run_q.assert_not_called()
+    sharded = mock_replace.call_args.args[0]
+    assert [(task.args[2], task.options["queue"]) for task in sharded.tasks] == [
+        ([servers[0], servers[2]], "interactive-do53"),
+        ([servers[1]], "interactive-doq"),
+    ]
+    assert sharded.body.args[0] == ["udp://8.8.8.8", "quic://1.1.1.1", "tcp://9.9.9.9"]
+
+    merged = merge_shards.run(
+        [{"quic://1.1.1.1": {"command_status": "ok"}}, {"tcp://9.9.9.9": {"command_status": "error"}, "udp://8.8.8.8": {"command_status": "ok"}}],
+        sharded.body.args[0], 0,
+    )
+    assert list(merged["details"]) == ["udp://8.8.8.8", "quic://1.1.1.1", "tcp://9.9.9.9"]
+
+
+def test_lookup_sharded_keeps_the_providers_for_consistency():
+    from celery.exceptions import Ignore
+    from worker.lookup import lookup_dns, merge_shards
+
+    servers = [{"target": "udp://9.9.9.9", "provider": "dns9.quad9.net"}, {"target": "quic://dns9.quad9.net", "provider": "dns9.quad9.net"}]
+    with patch("worker.celeryconfig.PROTOCOL_SHARDING", True), \
+            patch.object(lookup_dns, "replace", side_effect=Ignore()) as mock_replace:
+        lookup_dns.apply(args=("example.com", "A", servers, False), kwargs={"consistency": True}, task_id="task-id")
+
+    merge = mock_replace.call_args.args[0].body
+    ok = {"command_status": "ok", "rcode": "NOERROR", "answers": [{"type": "A", "ttl": 300, "value": "192.0.2.1"}]}
+    with patch("worker.consistency.update_metrics"):
+        merged = merge_shards.run([{"udp://9.9.9.9": ok}, {"quic://dns9.quad9.net": {**ok, "rcode": "SERVFAIL"}}], *merge.args)
+
+    assert merged["consistency"]["outliers"] == {"quic://dns9.quad9.net": ["rcode", "protocol_divergence"]}
+
+
+def test_inventory_version_resolved_once():
+    from worker import inventory
+
+    servers = [{"target": "udp://8.8.8.8:53", "tags": ["google"]}]
+    published = inventory.Inventory(servers)
+    assert inventory.Inventory(list(servers)).version == published.version
+
+    redis_client = AsyncMock()
+    redis_client.get.return_value = published.payload.encode()
+    with patch("worker.inventory.get_async_redis", return_value=redis_client), \
+            patch("worker.inventory._versions", inventory.OrderedDict()):
+        assert inventory.resolve_servers(published.version) == servers
+        assert inventory.resolve_servers(published.version) == servers
+        assert inventory.resolve_servers(servers) is servers
+        redis_client.get.return_value = None
+        with pytest.raises(LookupError):
+            inventory.resolve_servers("0000000000000000")
+
+    assert redis_client.get.call_count == 2
+
+
+def test_inventory_version_recovered_from_local_config():
+    from worker import inventory
+
+    servers = [{"target": "udp://8.8.8.8:53", "tags": ["google"]}]
+    redis_client = AsyncMock()
+    redis_client.get.return_value = None
+    with patch("worker.inventory.get_async_redis", return_value=redis_client), \
+            patch("worker.inventory._versions", inventory.OrderedDict()), \
+            patch("worker.inventory.local_inventory", side_effect=lambda: inventory.Inventory(servers)):
+        assert inventory.resolve_servers(inventory.Inventory(servers).version) == servers
+        with pytest.raises(LookupError):
+            inventory.resolve_servers("0000000000000000")
+
+    # published again for the other workers
+    redis_client.set.assert_called_once()
+
+
+def test_inventory_selection():
+    from worker.inventory import Inventory, filter_servers
+
+    servers = [
+        {"target": "udp://8.8.8.8:53", "tags": ["DNS_GOOGLE"]},
+        {"target": "tls://dns9.quad9.net", "tags": ["DNS_QUAD9"]},
+        {"target": "udp://9.9.9.9", "tags": ["DNS_QUAD9", "FILTERING"]},
+        {"target": "https://dns9.quad9.net", "tags": ["DNS_QUAD9"]},
+        {"target": "udp://1.1.1.1", "tags": []},
+    ]
+    inventory = Inventory(servers)
+    cases = [
+        ({"include_tags": ["DNS_QUAD9"]}, [1, 2, 3]),
+        ({"include_tags": ["DNS_QUAD9"], "exclude_tags": ["FILTERING"]}, [1, 3]),
+        ({"include_tags": ["DNS_QUAD9", "DNS_GOOGLE"], "protocols": ["do53"]}, [0, 2]),
+        ({"protocols": ["dot", "doh"]}, [1, 3]),
+        ({"exclude_tags": ["DNS_QUAD9"]}, [0, 4]),
+        ({"include_tags": ["UNKNOWN"]}, []),
+    ]
+    for filters, expected in cases:
+        assert inventory.select(**filters) == [servers[i] for i in expected]
+        assert filter_servers(servers, **filters) == [servers[i] for i in expected]
+
+
+def test_answer_consistency():
+    from worker.consistency import analyze, check
+
+    def ok(values, ttl=300, tags=None, rcode="NOERROR"):
+        return {
+            "command_status": "ok", "rcode": rcode, "tags": tags or [],
+            "answers": [{"name": "example.com.", "type": "A", "ttl": ttl, "value": value} for value in values],
+        }
+
+    results = {
+        "udp://8.8.8.8": ok(["192.0.2.1", "192.0.2.2"], tags=["GOOGLE"]),
+        "https://8.8.8.8/dns-query": ok(["192.0.2.3"], tags=["GOOGLE"]),
+        "udp://9.9.9.9": ok(["192.0.2.2", "192.0.2.1"], ttl=250, tags=["PUBLIC"]),
+        "udp://1.1.1.1": ok(["192.0.2.1", "192.0.2.2"], ttl=86400),
+        "udp://192.0.2.53": ok([], rcode="NXDOMAIN", tags=["PUBLIC"]),
+        "udp://192.0.2.54": {"command_status": "error", "error": "timeout"},
+    }
+    report = analyze(results)
+
+    consensus = report["clusters"][0]
+    assert consensus["servers"] == ["udp://8.8.8.8", "udp://9.9.9.9", "udp://1.1.1.1"]
+    assert consensus["answers"] == ["192.0.2.1", "192.0.2.2"]
+    assert (consensus["ttl_min"], consensus["ttl_max"]) == (250, 86400)
+    assert report["agreement"] == 0.6
+    assert report["outliers"] == {
+        "https://8.8.8.8/dns-query": ["answers", "protocol_divergence"],
+        # same tag, but different resolvers: no protocol divergence
+        "udp://192.0.2.53": ["rcode"],
+        "udp://1.1.1.1": ["ttl_skew"],
+    }
+
+    with patch("worker.metrics.dns_consistency_outliers") as mock_outliers:
+        check(results)
+    mock_outliers.labels.assert_any_call(server="udp://1.1.1.1", reason="ttl_skew")
+
+
+def test_reverse_sweep_chunk():
+    import ipaddress
+    from worker import sweep
+
+    assert list(sweep.chunk_bounds(ipaddress.ip_network("192.0.2.0/30"), 3)) == [("192.0.2.0", 3), ("192.0.2.3", 1)]
+    assert list(sweep.addresses("2001:db8::ffff", 2)) == ["2001:db8::ffff", "2001:db8::1:0"]
+
+    details = {
+        "udp://8.8.8.8": {"command_status": "ok", "rcode": "NOERROR", "answers": [{"type": "PTR", "value": "host.example."}]},
+        "udp://1.1.1.1": {"command_status": "ok", "rcode": "NXDOMAIN", "answers": []},
+        "udp://9.9.9.9": {"command_status": "error", "error": "timeout"},
+    }
+    assert sweep.ptr_row("192.0.2.1", details) == {
+        "ip": "192.0.2.1",
+        "ptr": {"udp://8.8.8.8": ["host.example."]},
+        "rcode": {"udp://8.8.8.8": "NOERROR", "udp://1.1.1.1": "NXDOMAIN", "udp://9.9.9.9": "error"},
+    }
+
+
+def test_worker_does_not_import_the_api():
+    import subprocess
+    import sys
+
+    code = "import sys, worker.lookup; print(sorted(name for name in sys.modules if name.split('.')[0] == 'api'))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+    assert output.strip() == "[]"
+
+
+def test_failed_sweep_chunk_fails_the_chunks_chained_after_it():
+    from worker.lookup import fail_sweep_chunks, wrk
+
+    error = RuntimeError("boom")
+    chunks = [MagicMock(id=f"chunk-{i}", **{"ready.return_value": i < 2}) for i in range(4)]
+    with patch("worker.lookup.GroupResult.restore", return_value=MagicMock(results=chunks)) as mock_restore, \
+            patch.object(type(wrk.backend), "mark_as_failure") as mock_mark_as_failure:
+        fail_sweep_chunks(MagicMock(), error, None, "fake-sweep-id")
+
+    assert mock_restore.call_args.args == ("fake-sweep-id",)
+    assert mock_mark_as_failure.call_args_list == [(("chunk-2", error),), (("chunk-3", error),)]
+
+
+def test_run_q_batch_paced():
+    with patch("worker.q._timed_fan_out", new=AsyncMock(side_effect=lambda domain, qtype, *args, **kwargs: {
+                "domain": domain, "qtype": qtype, "details": {}, "duration": 0})), \
+            patch("worker.celeryconfig.HISTORY_DIR", None):
+        start = engine.get_loop().time()
+        results = run_q_batch(((f"192.0.2.{i}", "PTR") for i in range(5)), [{"target": "udp://8.8.8.8"}], False, qps=50)
+        elapsed = engine.get_loop().time() - start
+
+    assert [item["domain"] for item in results] == [f"192.0.2.{i}" for i in range(5)]
+    assert elapsed >= 0.08
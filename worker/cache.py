@@ -0,0 +1,114 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import redis
+
+import worker.metrics
+from worker import celeryconfig
+from worker.redis_client import get_async_redis
+
+# Answers are cached per (target, domain, qtype) in Redis, shared by all
+# workers, with a small in-process LRU in front of it.
+CACHE_PREFIX = "dnstester:cache:"
+
+NEGATIVE_RCODES = ("NXDOMAIN", "SERVFAIL")
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def cache_key(target: str, domain: str, qtype: str) -> str:
+    return f"{CACHE_PREFIX}{target}|{domain.lower().rstrip('.')}|{qtype}"
+
+
+def cache_ttl(result: dict) -> int:
+    """
+    Seconds a result may be served from cache: the minimum answer TTL for
+    positive answers, DNS_CACHE_NEGATIVE_TTL for NXDOMAIN, SERVFAIL and
+    empty answers. Errors and other rcodes are not cached.
+    """
+    if result.get("command_status") != "ok":
+        return 0
+    rcode = result.get("rcode")
+    if rcode == "NOERROR" and result.get("answers"):
+        return min(answer["ttl"] for answer in result["answers"])
+    if rcode in NEGATIVE_RCODES or rcode == "NOERROR":
+        return celeryconfig.DNS_CACHE_NEGATIVE_TTL
+    return 0
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.local = OrderedDict()
+
+    def _get_local(self, key: str):
+        entry = self.local.get(key)
+        if entry is not None:
+            self.local.move_to_end(key)
+        return entry
+
+    def _set_local(self, key: str, entry: dict):
+        self.local[key] = entry
+        self.local.move_to_end(key)
+        while len(self.local) > self.max_entries:
+            self.local.popitem(last=False)
+
+    async def get(self, target: str, domain: str, qtype: str, max_staleness: float = 0) -> dict | None:
+        """
+        Return the cached result, or None. Entries expired for less than
+        max_staleness seconds are still served.
+        """
+        key = cache_key(target, domain, qtype)
+        now = time.time()
+
+        tier, entry = "local", self._get_local(key)
+        if entry is None or now > entry["expires_at"] + max_staleness:
+            tier, entry = "redis", None
+            try:
+                raw = await get_async_redis().get(key)
+            except redis.RedisError as e:
+                dnstester_logger.warning(f"answer cache unavailable: {e}")
+                raw = None
+            if raw is not None:
+                entry = json.loads(raw)
+                self._set_local(key, entry)
+
+        if entry is None or now > entry["expires_at"] + max_staleness:
+            worker.metrics.dns_cache_misses.labels(server=target).inc()
+            return None
+
+        worker.metrics.dns_cache_hits.labels(server=target, tier=tier).inc()
+        age = now - entry["stored_at"]
+        result = dict(entry["result"])
+        result["cached"] = True
+        result["cache_age"] = round(age, 3)
+        result["answers"] = [
+            {**answer, "ttl": max(0, answer["ttl"] - int(age))} for answer in result.get("answers") or []
+        ]
+        return result
+
+    async def set(self, target: str, domain: str, qtype: str, result: dict):
+        ttl = cache_ttl(result)
+        if ttl <= 0:
+            return
+        now = time.time()
+        entry = {"result": dict(result), "stored_at": now, "expires_at": now + ttl}
+        key = cache_key(target, domain, qtype)
+        self._set_local(key, entry)
+        try:
+            # keep the entry in Redis long enough to be served stale on request
+            await get_async_redis().set(key, json.dumps(entry), ex=int(ttl + celeryconfig.DNS_CACHE_MAX_STALE))
+        except redis.RedisError as e:
+            dnstester_logger.warning(f"answer cache unavailable: {e}")
+
+
+_cache = None
+
+
+def get_cache() -> AnswerCache:
+    global _cache
+    if _cache is None:
+        _cache = AnswerCache(celeryconfig.DNS_CACHE_LOCAL_SIZE)
+    return _cache
@@ -6,3 +6,56 @@ CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0
 CELERY_TASK_RESULT_EXPIRES = int(os.getenv("CELERY_TASK_RESULT_EXPIRES", 86400))
 # Auto-retry if broker is unavailable at startup
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = os.getenv("BROKER_CONNECTION_RETRY_ON_STARTUP", "true").lower() == "true"
+
+# DNS resolver backend: "native" resolves Do53 in-process, "q" always runs the q binary
+DNS_BACKEND = os.getenv("DNS_BACKEND", "native").lower()
+DNS_QUERY_TIMEOUT = float(os.getenv("DNS_QUERY_TIMEOUT", 3))
+# Per-target adaptive timeout (srtt + 4 * rttvar, between DNS_TIMEOUT_MIN and DNS_QUERY_TIMEOUT)
+DNS_ADAPTIVE_TIMEOUT = os.getenv("DNS_ADAPTIVE_TIMEOUT", "true").lower() == "true"
+DNS_TIMEOUT_MIN = float(os.getenv("DNS_TIMEOUT_MIN", 0.5))
+# Circuit breaker: skip a target after this many consecutive failures (0 disables), probe it again after the cooldown
+DNS_BREAKER_THRESHOLD = int(os.getenv("DNS_BREAKER_THRESHOLD", 5))
+DNS_BREAKER_COOLDOWN = float(os.getenv("DNS_BREAKER_COOLDOWN", 30))
+# Hedged lookups: delay before querying the next server when the RTT of the first one is not known yet
+DNS_HEDGE_DELAY = float(os.getenv("DNS_HEDGE_DELAY", 0.2))
+# Split lookups into one sub-task per protocol family, sent to per-protocol queues and merged by a chord
+PROTOCOL_SHARDING = os.getenv("PROTOCOL_SHARDING", "false").lower() == "true"
+# Answer consistency: TTL difference to the median of a cluster reported as skew (seconds)
+CONSISTENCY_TTL_SKEW = int(os.getenv("CONSISTENCY_TTL_SKEW", 300))
+# Fan-out: max in-flight queries per worker process and per-server deadline (retries included)
+DNS_MAX_CONCURRENCY = int(os.getenv("DNS_MAX_CONCURRENCY", 64))
+DNS_SERVER_DEADLINE = float(os.getenv("DNS_SERVER_DEADLINE", 10))
+# Pooled DoT/DoH/DoQ connections idle for longer than this (seconds) are closed
+DNS_POOL_IDLE_TIMEOUT = float(os.getenv("DNS_POOL_IDLE_TIMEOUT", 30))
+# Redis used by DNS Tester itself (result streams), defaults to the result backend
+DNSTESTER_REDIS_URL = os.getenv("DNSTESTER_REDIS_URL", CELERY_RESULT_BACKEND)
+# Publish per-server results to Redis streams as soon as each server answers
+RESULT_STREAMING = os.getenv("RESULT_STREAMING", "false").lower() == "true"
+RESULT_STREAM_MAXLEN = int(os.getenv("RESULT_STREAM_MAXLEN", 10000))
+RESULT_STREAM_TTL = int(os.getenv("RESULT_STREAM_TTL", 300))
+# Shared answer cache (Redis + in-process LRU), opt-in
+DNS_CACHE_ENABLED = os.getenv("DNS_CACHE_ENABLED", "false").lower() == "true"
+DNS_CACHE_LOCAL_SIZE = int(os.getenv("DNS_CACHE_LOCAL_SIZE", 10000))
+DNS_CACHE_NEGATIVE_TTL = int(os.getenv("DNS_CACHE_NEGATIVE_TTL", 30))
+# How long (seconds) expired entries are kept so that requests with max_staleness can use them
+DNS_CACHE_MAX_STALE = int(os.getenv("DNS_CACHE_MAX_STALE", 300))
+# Scheduled probing: the beat tick dispatches the probes due in the next PROBE_TICK seconds
+CONFIG_PATH = os.getenv("CONFIG_PATH", "conf/config.yaml")
+PROBE_TICK = float(os.getenv("PROBE_TICK", 10))
+# Shared directory for Prometheus multiprocess mode, metrics of all processes are aggregated by the API
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Latency sketches per (server, protocol, qtype) merged in Redis, served by the API /latency endpoint
+LATENCY_SKETCHES = os.getenv("LATENCY_SKETCHES", "false").lower() == "true"
+LATENCY_SLOT_SECONDS = int(os.getenv("LATENCY_SLOT_SECONDS", 10))
+LATENCY_FLUSH_INTERVAL = float(os.getenv("LATENCY_FLUSH_INTERVAL", 5))
+LATENCY_RETENTION = int(os.getenv("LATENCY_RETENTION", 3600))
+# Result encoding in the result backend: "json" (Celery default) or "compact" (msgpack + string table + zstd)
+RESULT_ENCODING = os.getenv("RESULT_ENCODING", "json").lower()
+RESULT_COMPRESSION_THRESHOLD = int(os.getenv("RESULT_COMPRESSION_THRESHOLD", 1024))
+# Persisted history of per-query results: one SQLite file per day in HISTORY_DIR (disabled when unset)
+HISTORY_DIR = os.getenv("HISTORY_DIR")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 5))
+# Raw results are downsampled to hourly aggregates after HISTORY_RAW_DAYS, and deleted after HISTORY_RETENTION_DAYS
+HISTORY_RAW_DAYS = int(os.getenv("HISTORY_RAW_DAYS", 7))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 90))
@@ -0,0 +1,154 @@
+"""
+The configuration file: its models, loading, and expansion into targets.
+Shared by the API and the workers, which both read CONFIG_PATH.
+"""
+import ipaddress
+import os
+from enum import Enum
+from typing import List, Literal, Optional, Annotated
+
+import yaml
+from pydantic import BaseModel, Field, conint, model_validator
+
+# Query types the workers can ask and decode
+QUERY_TYPES = (
+    "A", "AAAA", "CAA", "CDNSKEY", "CDS", "CNAME", "DNAME", "DNSKEY", "DS", "HINFO", "HTTPS", "MX",
+    "NAPTR", "NS", "NSEC", "NSEC3PARAM", "PTR", "RRSIG", "SOA", "SPF", "SRV", "SSHFP", "SVCB", "TLSA", "TXT", "URI",
+)
+QueryType = Literal[QUERY_TYPES]
+
+PortType = Annotated[int, conint(gt=0, le=65535)]
+
+class ServiceType(str, Enum):
+    do53_udp = "do53/udp"
+    do53_tcp = "do53/tcp"
+    dot = "dot"
+    doh = "doh"
+    doq = "doq"
+
+class DNSServer(BaseModel):
+    ip: Optional[str] = None
+    port: Optional[PortType] = None
+    hostname: Optional[str] = None
+    services: List[ServiceType]
+    tags: Optional[List[str]] = None
+    probe_interval: Optional[int] = Field(None, gt=0, description="Probe interval in seconds, overrides probes.interval")
+
+    @model_validator(mode="before")
+    def validate_ip_or_hostname(cls, values):
+        ip = values.get("ip")
+        hostname = values.get("hostname")
+
+        if not ip and not hostname:
+            raise ValueError("At least one of 'ip' or 'hostname' must be provided.")
+
+        if ip:
+            try:
+                ipaddress.ip_address(ip)
+            except ValueError:
+                raise ValueError(f"Invalid IP address: {ip}")
+
+        return values
+
+    @model_validator(mode="after")
+    def validate_do53_requires_ip(cls, values):
+        if any(s in [ServiceType.do53_udp, ServiceType.do53_tcp] for s in values.services):
+            if not values.ip:
+                raise ValueError("do53/udp and do53/tcp require an IP address (not just a hostname).")
+        return values
+
+class ProbeQuery(BaseModel):
+    domain: str
+    qtype: QueryType = "A"
+
+class ProbesConfig(BaseModel):
+    interval: int = Field(60, gt=0, description="Default probe interval in seconds")
+    jitter: float = Field(0.1, ge=0, le=1, description="Random delay added to each probe, as a fraction of its interval")
+    tls_insecure_skip_verify: bool = False
+    queries: List[ProbeQuery] = Field(..., min_length=1)
+
+class APIConfig(BaseModel):
+    servers: List[DNSServer]
+    probes: Optional[ProbesConfig] = None
+
+def load_yaml_config(file_path: str) -> APIConfig:
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Config file not found: {file_path}")
+
+    with open(file_path, "r") as f:
+        raw_data = yaml.safe_load(f)
+
+    # Validation with Pydantic
+    return APIConfig(**raw_data)
+
+# Mapping of service types to their URL schemes
+SERVICE_SCHEMES = {
+    'doh': 'https',
+    'dot': 'tls',
+    'doq': 'quic'
+}
+
+def get_server_targets(server: DNSServer) -> list:
+    """
+    Return one {"target", "tags", "provider"} entry per service of a configured
+    server. The provider names the configuration entry (its hostname, or its IP):
+    the targets of all its protocols share it.
+    """
+    dns_info_list = []
+    provider = server.hostname or server.ip
+
+    def add_dns_entry(host: str, scheme: str, port: int, tags: list):
+        """Add a DNS entry to the list"""
+        target = f"{scheme}://{host}"
+        if port:
+            target += f":{port}"
+        dns_info_list.append({"target": target, "tags": tags, "provider": provider})
+
+    for service in server.services:
+        service = service.strip()
+        if '/' in service:
+            service_type, proto = service.split('/', 1)
+        else:
+            service_type, proto = service, None
+
+        tags = server.tags if server.tags is not None else []
+
+        if service_type == 'do53':
+            scheme = proto if proto else 'udp'
+            add_dns_entry(server.ip, scheme, server.port, tags)
+
+        elif service_type in SERVICE_SCHEMES:
+            scheme = SERVICE_SCHEMES[service_type]
+
+            # Add entry for hostname if present
+            if server.hostname:
+                add_dns_entry(server.hostname, scheme, server.port, tags)
+
+            # Add entry for IP if present
+            if server.ip:
+                add_dns_entry(server.ip, scheme, server.port, tags)
+
+    return dns_info_list
+
+def get_dns_servers_from_yaml(config: APIConfig) -> list:
+    """
+    Extract DNS servers from the loaded YAML configuration.
+    """
+    dns_info_list = []
+    for server in config.servers:
+        dns_info_list.extend(get_server_targets(server))
+    return dns_info_list
+
+def get_probe_targets(config: APIConfig) -> list:
+    """
+    Return the servers to probe, each with its probe interval in seconds.
+    Empty when the configuration has no probes section.
+    """
+    if config.probes is None:
+        return []
+    probe_targets = []
+    for server in config.servers:
+        interval = server.probe_interval or config.probes.interval
+        for entry in get_server_targets(server):
+            probe_targets.append({**entry, "interval": interval})
+    return probe_targets
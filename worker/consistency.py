@@ -0,0 +1,133 @@
+import hashlib
+import statistics
+
+import worker.metrics
+from worker import celeryconfig
+from worker.native import split_target
+
+# Outlier reasons
+REASON_RCODE = "rcode"
+REASON_ANSWERS = "answers"
+REASON_TTL = "ttl_skew"
+REASON_PROTOCOL = "protocol_divergence"
+
+
+def normalize_value(value: str) -> str:
+    return str(value).lower().rstrip(".")
+
+
+def rrset_hash(rcode: str, answers) -> str:
+    """
+    Hash of the response code and answer RRset of a server, independent of
+    the order, the case and the TTL of the records.
+    """
+    records = sorted(f"{answer['type']} {normalize_value(answer['value'])}" for answer in answers or ())
+    return hashlib.sha1("\n".join([rcode or "", *records]).encode()).hexdigest()[:16]
+
+
+def min_ttl(answers) -> int | None:
+    return min((answer["ttl"] for answer in answers or ()), default=None)
+
+
+def provider_key(target: str, providers: dict) -> str:
+    """
+    The provider of a target: the configuration entry it was expanded from,
+    shared by all its protocols (udp://9.9.9.9, https://dns9.quad9.net...).
+    Ad-hoc targets fall back to their host. Tags are not an identity,
+    unrelated servers often share them.
+    """
+    return providers.get(target) or split_target(target)[1].lower()
+
+
+def server_providers(dns_servers: list) -> dict:
+    """
+    Provider of each target of a server list, for the targets of the configuration.
+    """
+    return {server["target"]: server["provider"] for server in dns_servers if server.get("provider")}
+
+
+def analyze(results: dict, providers: dict = None) -> dict:
+    """
+    Group the servers that answered into clusters of identical RRsets and
+    flag the outliers of the largest cluster (the consensus): a different
+    rcode or answer set, a TTL away from the median of their cluster by
+    more than CONSISTENCY_TTL_SKEW seconds, or a provider whose protocols
+    disagree. Linear in the number of servers, apart from the TTL medians.
+    """
+    clusters = {}
+    provider_clusters = {}
+    for target, result in results.items():
+        if result.get("command_status") != "ok":
+            continue
+        key = rrset_hash(result.get("rcode"), result.get("answers"))
+        cluster = clusters.get(key)
+        if cluster is None:
+            cluster = clusters[key] = {
+                "rcode": result.get("rcode"),
+                "answers_hash": key,
+                "answers": sorted({normalize_value(answer["value"]) for answer in result.get("answers") or ()}),
+                "servers": [],
+                "ttls": {},
+            }
+        cluster["servers"].append(target)
+        ttl = min_ttl(result.get("answers"))
+        if ttl is not None:
+            cluster["ttls"][target] = ttl
+        provider_clusters.setdefault(provider_key(target, providers or {}), {}).setdefault(key, []).append(target)
+
+    ordered = sorted(clusters.values(), key=lambda cluster: len(cluster["servers"]), reverse=True)
+    answered = sum(len(cluster["servers"]) for cluster in ordered)
+    outliers = {}
+
+    def flag(target, reason):
+        outliers.setdefault(target, []).append(reason)
+
+    consensus = ordered[0] if ordered else None
+    for cluster in ordered[1:]:
+        reason = REASON_RCODE if cluster["rcode"] != consensus["rcode"] else REASON_ANSWERS
+        for target in cluster["servers"]:
+            flag(target, reason)
+
+    for cluster in ordered:
+        ttls = cluster.pop("ttls")
+        cluster["ttl_min"] = min(ttls.values(), default=None)
+        cluster["ttl_max"] = max(ttls.values(), default=None)
+        if len(ttls) > 2:
+            median = statistics.median_low(ttls.values())
+            for target, ttl in ttls.items():
+                if abs(ttl - median) > celeryconfig.CONSISTENCY_TTL_SKEW:
+                    flag(target, REASON_TTL)
+
+    for by_answers in provider_clusters.values():
+        if len(by_answers) < 2:
+            continue
+        # the targets of the provider that disagree with the consensus, or with the provider's majority
+        reference = consensus["answers_hash"]
+        if reference not in by_answers:
+            reference = max(by_answers, key=lambda key: len(by_answers[key]))
+        for key, targets in by_answers.items():
+            if key != reference:
+                for target in targets:
+                    flag(target, REASON_PROTOCOL)
+
+    return {
+        "clusters": ordered,
+        "agreement": round(len(consensus["servers"]) / answered, 4) if consensus else None,
+        "outliers": outliers,
+    }
+
+
+def update_metrics(report: dict):
+    worker.metrics.dns_consistency_checks.labels(result="divergent" if report["outliers"] else "consistent").inc()
+    for target, reasons in report["outliers"].items():
+        for reason in reasons:
+            worker.metrics.dns_consistency_outliers.labels(server=target, reason=reason).inc()
+
+
+def check(results: dict, providers: dict = None) -> dict:
+    """
+    Analyze the results of a lookup and count the outliers.
+    """
+    report = analyze(results, providers)
+    update_metrics(report)
+    return report
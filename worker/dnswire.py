@@ -0,0 +1,436 @@
+import base64
+import ipaddress
+import random
+import struct
+
+
+# Mapping des rcode et types DNS (IANA registries). Extended rcodes above 15
+# only occur with EDNS or TSIG.
+RCODE_MAPPING = {
+    0: "NOERROR",
+    1: "FORMERR",
+    2: "SERVFAIL",
+    3: "NXDOMAIN",
+    4: "NOTIMP",
+    5: "REFUSED",
+    6: "YXDOMAIN",
+    7: "YXRRSET",
+    8: "NXRRSET",
+    9: "NOTAUTH",
+    10: "NOTZONE",
+    11: "DSOTYPENI",
+    16: "BADVERS",
+    17: "BADKEY",
+    18: "BADTIME",
+    19: "BADMODE",
+    20: "BADNAME",
+    21: "BADALG",
+    22: "BADTRUNC",
+    23: "BADCOOKIE",
+}
+
+TYPE_MAPPING = {
+    1: "A",
+    2: "NS",
+    5: "CNAME",
+    6: "SOA",
+    12: "PTR",
+    13: "HINFO",
+    15: "MX",
+    16: "TXT",
+    17: "RP",
+    18: "AFSDB",
+    24: "SIG",
+    25: "KEY",
+    28: "AAAA",
+    29: "LOC",
+    33: "SRV",
+    35: "NAPTR",
+    36: "KX",
+    37: "CERT",
+    39: "DNAME",
+    41: "OPT",
+    42: "APL",
+    43: "DS",
+    44: "SSHFP",
+    45: "IPSECKEY",
+    46: "RRSIG",
+    47: "NSEC",
+    48: "DNSKEY",
+    49: "DHCID",
+    50: "NSEC3",
+    51: "NSEC3PARAM",
+    52: "TLSA",
+    53: "SMIMEA",
+    55: "HIP",
+    59: "CDS",
+    60: "CDNSKEY",
+    61: "OPENPGPKEY",
+    62: "CSYNC",
+    63: "ZONEMD",
+    64: "SVCB",
+    65: "HTTPS",
+    99: "SPF",
+    108: "EUI48",
+    109: "EUI64",
+    249: "TKEY",
+    250: "TSIG",
+    251: "IXFR",
+    252: "AXFR",
+    255: "ANY",
+    256: "URI",
+    257: "CAA",
+    32768: "TA",
+    32769: "DLV",
+}
+
+# Meta types that cannot be asked in a plain recursive query
+_META_TYPES = {"OPT", "TKEY", "TSIG", "IXFR", "AXFR"}
+
+QTYPE_CODES = {name: code for code, name in TYPE_MAPPING.items() if name not in _META_TYPES}
+
+
+def type_name(code) -> str:
+    """
+    Mnemonic of a type code, TYPEnnn (RFC 3597) when it has none.
+    """
+    name = TYPE_MAPPING.get(code)
+    if name is None:
+        return f"TYPE{code}" if isinstance(code, int) else "Unknown"
+    return name
+
+
+def rcode_name(code) -> str:
+    name = RCODE_MAPPING.get(code)
+    if name is None:
+        return f"RCODE{code}" if isinstance(code, int) else "Unknown"
+    return name
+
+CLASS_IN = 1
+FLAG_RD = 0x0100
+FLAG_TC = 0x0200
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR_FIXED = struct.Struct("!HHIH")
+
+
+class DNSWireError(Exception):
+    """Raised when a DNS message cannot be encoded or decoded."""
+
+
+def reverse_name(ip: str) -> str:
+    """Return the in-addr.arpa / ip6.arpa name for an IP address."""
+    return ipaddress.ip_address(ip).reverse_pointer + "."
+
+
+def encode_name(name: str) -> bytes:
+    labels = [label for label in name.rstrip(".").split(".") if label]
+    out = bytearray()
+    for label in labels:
+        raw = label.encode("idna") if not label.isascii() else label.encode("ascii")
+        if len(raw) > 63:
+            raise DNSWireError(f"label too long in {name!r}")
+        out.append(len(raw))
+        out += raw
+    out.append(0)
+    if len(out) > 255:
+        raise DNSWireError(f"name too long: {name!r}")
+    return bytes(out)
+
+
+def build_query(name: str, qtype: str, msg_id: int | None = None) -> tuple[int, bytes]:
+    """
+    Build a recursive query for name/qtype and return (message id, wire bytes).
+    """
+    if qtype not in QTYPE_CODES:
+        raise DNSWireError(f"unsupported qtype: {qtype}")
+    if msg_id is None:
+        msg_id = random.getrandbits(16)
+    header = _HEADER.pack(msg_id, FLAG_RD, 1, 0, 0, 0)
+    question = encode_name(name) + struct.pack("!HH", QTYPE_CODES[qtype], CLASS_IN)
+    return msg_id, header + question
+
+
+def decode_name(data: bytes, offset: int) -> tuple[str, int]:
+    """
+    Decode a possibly compressed domain name starting at offset.
+    Returns the name (with trailing dot) and the offset just after it.
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DNSWireError("name runs past end of message")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DNSWireError("truncated compression pointer")
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            jumps += 1
+            if jumps > 64:
+                raise DNSWireError("compression loop")
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii", errors="backslashreplace"))
+        offset += length
+    return ".".join(labels) + ".", end if end is not None else offset
+
+
+def _decode_a(data, offset, rdlength):
+    return str(ipaddress.IPv4Address(data[offset:offset + rdlength]))
+
+
+def _decode_aaaa(data, offset, rdlength):
+    return str(ipaddress.IPv6Address(data[offset:offset + rdlength]))
+
+
+def _decode_domain(data, offset, rdlength):
+    return decode_name(data, offset)[0]
+
+
+def _character_strings(data, offset, end) -> list[str]:
+    strings = []
+    while offset < end:
+        length = data[offset]
+        strings.append(data[offset + 1:offset + 1 + length].decode("utf-8", errors="replace"))
+        offset += 1 + length
+    return strings
+
+
+def _quoted(strings) -> str:
+    return " ".join(f'"{string}"' for string in strings)
+
+
+def _decode_txt(data, offset, rdlength):
+    return "".join(_character_strings(data, offset, offset + rdlength))
+
+
+def _decode_hinfo(data, offset, rdlength):
+    return _quoted(_character_strings(data, offset, offset + rdlength))
+
+
+def _decode_soa(data, offset, rdlength):
+    mname, offset = decode_name(data, offset)
+    rname, offset = decode_name(data, offset)
+    serial, refresh, retry, expire, minimum = struct.unpack_from("!IIIII", data, offset)
+    return f"{mname} {rname} {serial} {refresh} {retry} {expire} {minimum}"
+
+
+def _decode_mx(data, offset, rdlength):
+    (preference,) = struct.unpack_from("!H", data, offset)
+    return f"{preference} {decode_name(data, offset + 2)[0]}"
+
+
+def _decode_srv(data, offset, rdlength):
+    priority, weight, port = struct.unpack_from("!HHH", data, offset)
+    return f"{priority} {weight} {port} {decode_name(data, offset + 6)[0]}"
+
+
+def _decode_naptr(data, offset, rdlength):
+    order, preference = struct.unpack_from("!HH", data, offset)
+    offset += 4
+    fields = []
+    for _ in range(3):
+        length = data[offset]
+        fields.append(data[offset + 1:offset + 1 + length].decode("utf-8", errors="replace"))
+        offset += 1 + length
+    return f"{order} {preference} {_quoted(fields)} {decode_name(data, offset)[0]}"
+
+
+def _decode_ds(data, offset, rdlength):
+    key_tag, algorithm, digest_type = struct.unpack_from("!HBB", data, offset)
+    return f"{key_tag} {algorithm} {digest_type} {data[offset + 4:offset + rdlength].hex().upper()}"
+
+
+def _decode_sshfp(data, offset, rdlength):
+    algorithm, fp_type = struct.unpack_from("!BB", data, offset)
+    return f"{algorithm} {fp_type} {data[offset + 2:offset + rdlength].hex().upper()}"
+
+
+def _decode_tlsa(data, offset, rdlength):
+    usage, selector, matching_type = struct.unpack_from("!BBB", data, offset)
+    return f"{usage} {selector} {matching_type} {data[offset + 3:offset + rdlength].hex().upper()}"
+
+
+def _decode_dnskey(data, offset, rdlength):
+    flags, protocol, algorithm = struct.unpack_from("!HBB", data, offset)
+    return f"{flags} {protocol} {algorithm} {base64.b64encode(data[offset + 4:offset + rdlength]).decode()}"
+
+
+def _decode_rrsig(data, offset, rdlength):
+    end = offset + rdlength
+    covered, algorithm, labels, original_ttl, expiration, inception, key_tag = struct.unpack_from("!HBBIIIH", data, offset)
+    signer, offset = decode_name(data, offset + 18)
+    signature = base64.b64encode(data[offset:end]).decode()
+    return f"{type_name(covered)} {algorithm} {labels} {original_ttl} {expiration} {inception} {key_tag} {signer} {signature}"
+
+
+def _type_bitmap(data, offset, end) -> str:
+    types = []
+    while offset + 2 <= end:
+        window, length = data[offset], data[offset + 1]
+        for index, byte in enumerate(data[offset + 2:offset + 2 + length]):
+            for bit in range(8):
+                if byte & (0x80 >> bit):
+                    types.append(type_name(window * 256 + index * 8 + bit))
+        offset += 2 + length
+    return " ".join(types)
+
+
+def _decode_nsec(data, offset, rdlength):
+    next_name, bitmap = decode_name(data, offset)
+    return f"{next_name} {_type_bitmap(data, bitmap, offset + rdlength)}".rstrip()
+
+
+_BASE32HEX = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", b"0123456789ABCDEFGHIJKLMNOPQRSTUV")
+
+
+def _nsec3_params(data, offset):
+    algorithm, flags, iterations, salt_length = struct.unpack_from("!BBHB", data, offset)
+    salt = data[offset + 5:offset + 5 + salt_length].hex().upper() or "-"
+    return f"{algorithm} {flags} {iterations} {salt}", offset + 5 + salt_length
+
+
+def _decode_nsec3(data, offset, rdlength):
+    end = offset + rdlength
+    params, offset = _nsec3_params(data, offset)
+    hash_length = data[offset]
+    next_hash = base64.b32encode(data[offset + 1:offset + 1 + hash_length]).translate(_BASE32HEX).decode().rstrip("=")
+    return f"{params} {next_hash} {_type_bitmap(data, offset + 1 + hash_length, end)}".rstrip()
+
+
+def _decode_nsec3param(data, offset, rdlength):
+    return _nsec3_params(data, offset)[0]
+
+
+def _decode_caa(data, offset, rdlength):
+    flags, tag_length = data[offset], data[offset + 1]
+    tag = data[offset + 2:offset + 2 + tag_length].decode("ascii", errors="replace")
+    value = data[offset + 2 + tag_length:offset + rdlength].decode("utf-8", errors="replace")
+    return f'{flags} {tag} "{value}"'
+
+
+def _decode_uri(data, offset, rdlength):
+    priority, weight = struct.unpack_from("!HH", data, offset)
+    return f'{priority} {weight} "{data[offset + 4:offset + rdlength].decode("utf-8", errors="replace")}"'
+
+
+def _svc_param(key: int, value: bytes) -> str:
+    if key == 0:
+        return "mandatory=" + ",".join(f"key{k}" if k > 6 else SVC_PARAM_KEYS[k] for (k,) in struct.iter_unpack("!H", value))
+    if key == 1:
+        return "alpn=" + ",".join(_character_strings(value, 0, len(value)))
+    if key == 2:
+        return "no-default-alpn"
+    if key == 3:
+        return f"port={struct.unpack('!H', value)[0]}"
+    if key == 4:
+        return "ipv4hint=" + ",".join(str(ipaddress.IPv4Address(value[i:i + 4])) for i in range(0, len(value), 4))
+    if key == 5:
+        return "ech=" + base64.b64encode(value).decode()
+    if key == 6:
+        return "ipv6hint=" + ",".join(str(ipaddress.IPv6Address(value[i:i + 16])) for i in range(0, len(value), 16))
+    return f"key{key}={value.hex()}"
+
+
+SVC_PARAM_KEYS = ("mandatory", "alpn", "no-default-alpn", "port", "ipv4hint", "ech", "ipv6hint")
+
+
+def _decode_svcb(data, offset, rdlength):
+    end = offset + rdlength
+    (priority,) = struct.unpack_from("!H", data, offset)
+    target, offset = decode_name(data, offset + 2)
+    params = []
+    while offset + 4 <= end:
+        key, length = struct.unpack_from("!HH", data, offset)
+        params.append(_svc_param(key, data[offset + 4:offset + 4 + length]))
+        offset += 4 + length
+    return " ".join([str(priority), target, *params])
+
+
+def _decode_unknown(data, offset, rdlength):
+    # RFC 3597 generic representation
+    return f"\\# {rdlength} {data[offset:offset + rdlength].hex()}"
+
+
+# Presentation format of the rdata, per type code
+RDATA_DECODERS = {
+    1: _decode_a,
+    2: _decode_domain,
+    5: _decode_domain,
+    6: _decode_soa,
+    12: _decode_domain,
+    13: _decode_hinfo,
+    15: _decode_mx,
+    16: _decode_txt,
+    28: _decode_aaaa,
+    33: _decode_srv,
+    35: _decode_naptr,
+    39: _decode_domain,
+    43: _decode_ds,
+    44: _decode_sshfp,
+    46: _decode_rrsig,
+    47: _decode_nsec,
+    48: _decode_dnskey,
+    50: _decode_nsec3,
+    51: _decode_nsec3param,
+    52: _decode_tlsa,
+    59: _decode_ds,
+    60: _decode_dnskey,
+    64: _decode_svcb,
+    65: _decode_svcb,
+    99: _decode_txt,
+    256: _decode_uri,
+    257: _decode_caa,
+}
+
+
+def parse_response(data: bytes) -> dict:
+    """
+    Parse a DNS response into a dict with id, flags, rcode, question and answer.
+    Each answer is a dict with name, rrtype, ttl and value.
+    """
+    if len(data) < _HEADER.size:
+        raise DNSWireError("message shorter than DNS header")
+
+    msg_id, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+
+    question = []
+    for _ in range(qdcount):
+        name, offset = decode_name(data, offset)
+        qtype, qclass = struct.unpack_from("!HH", data, offset)
+        offset += 4
+        question.append({"name": name, "qtype": qtype, "qclass": qclass})
+
+    answer = []
+    for _ in range(ancount):
+        name, offset = decode_name(data, offset)
+        if offset + _RR_FIXED.size > len(data):
+            raise DNSWireError("truncated resource record")
+        rrtype, _, ttl, rdlength = _RR_FIXED.unpack_from(data, offset)
+        offset += _RR_FIXED.size
+        if offset + rdlength > len(data):
+            raise DNSWireError("truncated rdata")
+        decoder = RDATA_DECODERS.get(rrtype, _decode_unknown)
+        answer.append({
+            "name": name,
+            "rrtype": rrtype,
+            "ttl": ttl,
+            "value": decoder(data, offset, rdlength),
+        })
+        offset += rdlength
+
+    return {
+        "id": msg_id,
+        "flags": flags,
+        "rcode": flags & 0x000F,
+        "truncated": bool(flags & FLAG_TC),
+        "question": question,
+        "answer": answer,
+    }
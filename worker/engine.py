@@ -0,0 +1,38 @@
+import asyncio
+import os
+import threading
+
+from worker import celeryconfig
+
+# One event loop per worker process, running in a single background thread.
+# It is created lazily so that each Celery prefork child gets its own loop.
+_lock = threading.Lock()
+_loop = None
+_pid = None
+_semaphore = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _pid, _semaphore
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _semaphore = asyncio.Semaphore(celeryconfig.DNS_MAX_CONCURRENCY)
+            _pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="dnstester-engine", daemon=True).start()
+    return _loop
+
+
+def limiter() -> asyncio.Semaphore:
+    """
+    Global concurrency limit shared by all tasks of the worker process.
+    """
+    get_loop()
+    return _semaphore
+
+
+def run(coro):
+    """
+    Run a coroutine on the engine loop and wait for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
@@ -0,0 +1,124 @@
+import time
+
+from worker import celeryconfig
+
+# Per-target health shared by all the tasks of a worker process. It is only
+# used from the engine loop, so it needs no locking.
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class TargetHealth:
+    """
+    Smoothed RTT of a target (RFC 6298 estimator) and the state of its
+    circuit breaker.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def timeout(self) -> float:
+        """
+        Per-attempt timeout: srtt + 4 * rttvar, bounded by DNS_TIMEOUT_MIN and DNS_QUERY_TIMEOUT.
+        """
+        if not celeryconfig.DNS_ADAPTIVE_TIMEOUT or self.srtt is None:
+            return celeryconfig.DNS_QUERY_TIMEOUT
+        return min(max(self.srtt + 4 * self.rttvar, celeryconfig.DNS_TIMEOUT_MIN), celeryconfig.DNS_QUERY_TIMEOUT)
+
+    def hedge_delay(self) -> float:
+        """
+        Estimated 95th percentile of the RTT (srtt + 2 * rttvar), after which
+        an unanswered query is likely in the tail. DNS_HEDGE_DELAY until the
+        target has answered once.
+        """
+        if self.srtt is None:
+            return celeryconfig.DNS_HEDGE_DELAY
+        return self.srtt + 2 * self.rttvar
+
+    def allow(self, now: float) -> bool:
+        """
+        Whether a query may be sent. Once the cooldown of an open circuit
+        is over, a single query is let through to probe the target.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= celeryconfig.DNS_BREAKER_COOLDOWN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def success(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.failures = 0
+        self.state = CLOSED
+        self.probing = False
+
+    def failure(self, now: float):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (
+            celeryconfig.DNS_BREAKER_THRESHOLD and self.failures >= celeryconfig.DNS_BREAKER_THRESHOLD
+        ):
+            self.state = OPEN
+            self.opened_at = now
+
+    def release(self):
+        """
+        Forget an interrupted probe, so that the next query probes again.
+        """
+        self.probing = False
+
+
+class HealthTracker:
+    def __init__(self):
+        self.targets = {}
+
+    def get(self, target: str) -> TargetHealth:
+        health = self.targets.get(target)
+        if health is None:
+            health = self.targets[target] = TargetHealth()
+        return health
+
+    def allow(self, target: str) -> bool:
+        return self.get(target).allow(time.monotonic())
+
+    def timeout(self, target: str) -> float:
+        return self.get(target).timeout()
+
+    def hedge_delay(self, target: str) -> float:
+        return self.get(target).hedge_delay()
+
+    def record(self, target: str, result: dict):
+        health = self.get(target)
+        if result.get("command_status") == "ok":
+            health.success(result["time_ms"] / 1000)
+        else:
+            health.failure(time.monotonic())
+
+    def skipped_result(self, target: str) -> dict:
+        health = self.get(target)
+        retry_in = max(0.0, celeryconfig.DNS_BREAKER_COOLDOWN - (time.monotonic() - health.opened_at))
+        return {
+            "command_status": "skipped",
+            "error": f"Circuit breaker open after {health.failures} consecutive failures, next probe in {retry_in:.0f}s",
+        }
+
+
+_tracker = None
+
+
+def get_tracker() -> HealthTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = HealthTracker()
+    return _tracker
@@ -0,0 +1,318 @@
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from worker import celeryconfig
+from worker.sketch import LatencySketch
+
+# Append-only history of per-query results, in one SQLite file per UTC day
+# under HISTORY_DIR. Raw rows older than HISTORY_RAW_DAYS are downsampled to
+# hourly rows (with a latency sketch, so percentiles survive), and partitions
+# older than HISTORY_RETENTION_DAYS are deleted.
+PARTITION_PREFIX = "results-"
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    ts REAL NOT NULL,
+    target TEXT NOT NULL,
+    protocol TEXT,
+    domain TEXT,
+    qtype TEXT,
+    status TEXT NOT NULL,
+    rcode TEXT,
+    time_ms REAL,
+    answer_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS results_target_ts ON results (target, ts);
+"""
+
+HOURLY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hourly (
+    ts INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    protocol TEXT,
+    qtype TEXT,
+    count INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    sum_ms REAL NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (ts, target, protocol, qtype)
+);
+"""
+
+RESULT_COLUMNS = ("ts", "target", "protocol", "domain", "qtype", "status", "rcode", "time_ms", "answer_hash")
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def partition_path(day: datetime.date) -> str:
+    return os.path.join(celeryconfig.HISTORY_DIR, f"{PARTITION_PREFIX}{day:%Y%m%d}.sqlite")
+
+
+def day_of(timestamp: float) -> datetime.date:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+
+
+def connect(path: str, schema: str = None) -> sqlite3.Connection:
+    # Several worker processes append to the same partition
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    if schema:
+        conn.executescript(schema)
+    return conn
+
+
+def existing_partitions(start: float, end: float) -> list[str]:
+    paths = []
+    day, last = day_of(start), day_of(end)
+    while day <= last:
+        path = partition_path(day)
+        if os.path.exists(path):
+            paths.append(path)
+        day += datetime.timedelta(days=1)
+    return paths
+
+
+def answer_hash(answers) -> str | None:
+    """
+    Short hash of an answer section, independent of the order of the records.
+    """
+    if not answers:
+        return None
+    records = sorted(f"{answer['type']} {answer['value']}" for answer in answers)
+    return hashlib.sha1("\n".join(records).encode()).hexdigest()[:16]
+
+
+class HistoryWriter:
+    """
+    Buffer rows and insert them in bulk, every HISTORY_BATCH_SIZE rows or
+    HISTORY_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+    def add(self, rows: list[tuple]):
+        with self.lock:
+            if not self.rows:
+                # rows are written at the latest after the interval, even without new lookups
+                timer = threading.Timer(celeryconfig.HISTORY_FLUSH_INTERVAL, self.flush)
+                timer.daemon = True
+                timer.start()
+            self.rows.extend(rows)
+            if len(self.rows) < celeryconfig.HISTORY_BATCH_SIZE and \
+                    time.monotonic() - self.last_flush < celeryconfig.HISTORY_FLUSH_INTERVAL:
+                return
+            rows, self.rows = self.rows, []
+            self.last_flush = time.monotonic()
+        self.write(rows)
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+            self.last_flush = time.monotonic()
+        self.write(rows)
+
+    def write(self, rows: list[tuple]):
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[day_of(row[0])].append(row)
+        for day, day_rows in by_day.items():
+            try:
+                conn = connect(partition_path(day), RESULTS_SCHEMA)
+                with conn:
+                    conn.executemany(f"INSERT INTO results VALUES ({', '.join('?' * len(RESULT_COLUMNS))})", day_rows)
+                conn.close()
+            except sqlite3.Error as e:
+                dnstester_logger.warning(f"unable to write {len(day_rows)} history rows: {e}")
+
+
+_writer = None
+_writer_pid = None
+
+
+def get_writer() -> HistoryWriter:
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer, _writer_pid = HistoryWriter(), os.getpid()
+    return _writer
+
+
+def record(domain: str, qtype: str, results: dict, timestamp: float = None):
+    """
+    Append the results of one lookup, keyed by target. Cached answers,
+    servers skipped by their circuit breaker and servers left unanswered by
+    an early-returning lookup are not recorded.
+    """
+    # worker.q imports this module
+    from worker.q import get_dns_protocol_from_target
+
+    timestamp = time.time() if timestamp is None else timestamp
+    rows = [
+        (
+            timestamp,
+            target,
+            result.get("dns_protocol") or get_dns_protocol_from_target(target),
+            domain,
+            qtype,
+            result.get("command_status"),
+            result.get("rcode"),
+            result.get("time_ms"),
+            answer_hash(result.get("answers")),
+        )
+        for target, result in results.items()
+        if not result.get("cached") and result.get("command_status") not in ("skipped", "unanswered")
+    ]
+    if rows:
+        get_writer().add(rows)
+
+
+def _filters(target, protocol, qtype) -> tuple[str, list]:
+    clauses, params = [], []
+    for column, value in (("target", target), ("protocol", protocol), ("qtype", qtype)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def _has_table(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def query_results(start: float, end: float, target=None, protocol=None, qtype=None, limit: int = 1000) -> list[dict]:
+    """
+    Raw results between start and end, oldest first. Days already
+    downsampled only have hourly aggregates.
+    """
+    where, params = _filters(target, protocol, qtype)
+    rows = []
+    for path in existing_partitions(start, end):
+        conn = connect(path)
+        if _has_table(conn, "results"):
+            rows.extend(conn.execute(
+                f"SELECT {', '.join(RESULT_COLUMNS)} FROM results WHERE ts >= ? AND ts < ?{where} ORDER BY ts LIMIT ?",
+                [start, end, *params, limit - len(rows)],
+            ))
+        conn.close()
+        if len(rows) >= limit:
+            break
+    return [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+
+
+class _Bucket:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+        self.sketch = LatencySketch()
+
+    def add(self, status: str, time_ms: float | None):
+        self.count += 1
+        if status != "ok" or time_ms is None:
+            self.errors += 1
+        else:
+            self.sum_ms += time_ms
+            self.sketch.add(time_ms)
+
+
+def aggregate(start: float, end: float, interval: int, target=None, protocol=None, qtype=None) -> list[dict]:
+    """
+    Count, errors, average and percentiles of the latency per interval and
+    per (target, protocol, qtype). Downsampled days have a resolution of one hour.
+    """
+    where, params = _filters(target, protocol, qtype)
+    buckets = defaultdict(_Bucket)
+    for path in existing_partitions(start, end):
+        conn = connect(path)
+        if _has_table(conn, "results"):
+            for ts, row_target, row_protocol, row_qtype, status, time_ms in conn.execute(
+                f"SELECT ts, target, protocol, qtype, status, time_ms FROM results WHERE ts >= ? AND ts < ?{where}",
+                [start, end, *params],
+            ):
+                buckets[(int(ts // interval * interval), row_target, row_protocol, row_qtype)].add(status, time_ms)
+        hourly = conn.execute(
+            f"SELECT ts, target, protocol, qtype, count, errors, sum_ms, sketch FROM hourly WHERE ts >= ? AND ts < ?{where}",
+            [start // 3600 * 3600, end, *params],
+        ) if _has_table(conn, "hourly") else []
+        for ts, row_target, row_protocol, row_qtype, count, errors, sum_ms, sketch in hourly:
+            bucket = buckets[(int(ts // interval * interval), row_target, row_protocol, row_qtype)]
+            bucket.count += count
+            bucket.errors += errors
+            bucket.sum_ms += sum_ms
+            bucket.sketch.merge(LatencySketch({int(k): v for k, v in json.loads(sketch).items()}))
+        conn.close()
+
+    series = []
+    for (ts, row_target, row_protocol, row_qtype), bucket in sorted(buckets.items(), key=lambda item: (item[0][0], *(part or "" for part in item[0][1:]))):
+        answered = bucket.count - bucket.errors
+        series.append({
+            "ts": ts,
+            "target": row_target,
+            "protocol": row_protocol,
+            "qtype": row_qtype,
+            "count": bucket.count,
+            "errors": bucket.errors,
+            "avg_ms": round(bucket.sum_ms / answered, 3) if answered else None,
+            **{
+                name: round(value, 3) if (value := bucket.sketch.quantile(q)) is not None else None
+                for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+            },
+        })
+    return series
+
+
+def rollup_partition(path: str):
+    """
+    Replace the raw rows of a partition with hourly aggregates.
+    """
+    conn = connect(path)
+    if not _has_table(conn, "results"):
+        conn.close()
+        return
+    conn.executescript(HOURLY_SCHEMA)
+
+    buckets = defaultdict(_Bucket)
+    for ts, target, protocol, qtype, status, time_ms in conn.execute(
+        "SELECT ts, target, protocol, qtype, status, time_ms FROM results"
+    ):
+        buckets[(int(ts // 3600 * 3600), target, protocol, qtype)].add(status, time_ms)
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (*key, bucket.count, bucket.errors, bucket.sum_ms, json.dumps(bucket.sketch.bins))
+                for key, bucket in buckets.items()
+            ],
+        )
+        conn.execute("DROP TABLE results")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def maintain(now: float = None):
+    """
+    Downsample the partitions older than HISTORY_RAW_DAYS and delete the
+    ones older than HISTORY_RETENTION_DAYS.
+    """
+    today = day_of(time.time() if now is None else now)
+    for path in sorted(glob.glob(os.path.join(celeryconfig.HISTORY_DIR, f"{PARTITION_PREFIX}*.sqlite"))):
+        day = datetime.datetime.strptime(os.path.basename(path)[len(PARTITION_PREFIX):-len(".sqlite")], "%Y%m%d").date()
+        age = (today - day).days
+        if age > celeryconfig.HISTORY_RETENTION_DAYS:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            dnstester_logger.info(f"history partition {path} deleted")
+        elif age > celeryconfig.HISTORY_RAW_DAYS:
+            rollup_partition(path)
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import redis
+
+from worker import celeryconfig, engine
+from worker.config import get_dns_servers_from_yaml, load_yaml_config
+from worker.q import get_dns_protocol_from_target
+from worker.redis_client import get_async_redis
+
+# The server list expanded from the YAML inventory is computed once per
+# configuration and stored in Redis under its content hash. Lookups on the
+# inventory carry that version id instead of the full list, and workers
+# resolve it from a small local cache.
+INVENTORY_PREFIX = "dnstester:inventory:"
+
+# Versions kept by each worker process
+LOCAL_VERSIONS = 8
+
+# Seconds after which the API checks again that its published version is
+# still in Redis (restart, eviction, flush)
+PUBLISH_CHECK_INTERVAL = 30
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def server_protocol(server: dict) -> str:
+    """
+    Protocol family of a server as named in the configuration (do53, dot, doh, doq).
+    """
+    return get_dns_protocol_from_target(server["target"]).lower()
+
+
+def filter_servers(servers: list, include_tags=None, exclude_tags=None, protocols=None) -> list:
+    """
+    Servers having one of include_tags, none of exclude_tags and one of protocols
+    (each filter is ignored when None).
+    """
+    include, exclude = set(include_tags or ()), set(exclude_tags or ())
+    return [
+        server for server in servers
+        if (include_tags is None or include.intersection(server.get("tags") or ()))
+        and not exclude.intersection(server.get("tags") or ())
+        and (protocols is None or server_protocol(server) in protocols)
+    ]
+
+
+class Inventory:
+    """
+    Expanded server list of a configuration, with its version: a hash of the
+    content, so that identical configurations share the same version.
+
+    Servers are indexed by tag and by protocol, so that selecting a slice of
+    the inventory costs O(selected) rather than O(inventory).
+    """
+
+    def __init__(self, servers: list):
+        self.servers = servers
+        self.payload = json.dumps(servers, sort_keys=True, separators=(",", ":"))
+        self.version = hashlib.sha256(self.payload.encode()).hexdigest()[:16]
+        self.published = False
+        self.checked_at = 0.0
+
+        self.by_tag, self.by_protocol = {}, {}
+        self.protocols = [server_protocol(server) for server in servers]
+        for position, server in enumerate(servers):
+            for tag in server.get("tags") or ():
+                self.by_tag.setdefault(tag, []).append(position)
+            self.by_protocol.setdefault(self.protocols[position], []).append(position)
+
+    def _positions(self, index: dict, keys) -> set:
+        return {position for key in keys for position in index.get(key, ())}
+
+    def select(self, include_tags=None, exclude_tags=None, protocols=None) -> list:
+        """
+        Servers matching the filters of filter_servers, in inventory order.
+        """
+        if include_tags is None and protocols is None:
+            positions = set(range(len(self.servers)))
+        elif include_tags is None:
+            positions = self._positions(self.by_protocol, protocols)
+        else:
+            positions = self._positions(self.by_tag, include_tags)
+            if protocols is not None:
+                positions = {position for position in positions if self.protocols[position] in protocols}
+        if exclude_tags:
+            positions -= self._positions(self.by_tag, exclude_tags)
+        return [self.servers[position] for position in sorted(positions)]
+
+    async def publish(self) -> bool:
+        """
+        Store the server list in Redis, and again when the key went missing.
+        Returns whether workers can resolve the version.
+        """
+        key = f"{INVENTORY_PREFIX}{self.version}"
+        try:
+            now = time.monotonic()
+            if self.published and now - self.checked_at >= PUBLISH_CHECK_INTERVAL:
+                self.checked_at = now
+                if not await get_async_redis().exists(key):
+                    dnstester_logger.warning(f"inventory {self.version} missing from Redis, publishing it again")
+                    self.published = False
+            if not self.published:
+                await get_async_redis().set(key, self.payload)
+                self.published = True
+                self.checked_at = now
+        except redis.RedisError as e:
+            dnstester_logger.warning(f"unable to publish inventory {self.version}: {e}")
+        return self.published
+
+
+def local_inventory() -> Inventory:
+    """
+    Inventory expanded from the configuration file of this process.
+    """
+    return Inventory(get_dns_servers_from_yaml(load_yaml_config(celeryconfig.CONFIG_PATH)))
+
+
+_versions = OrderedDict()
+
+
+async def fetch(version: str) -> list:
+    servers = _versions.get(version)
+    if servers is None:
+        payload = await get_async_redis().get(f"{INVENTORY_PREFIX}{version}")
+        if payload is None:
+            # lost from Redis: the configuration file of the worker may be the same one
+            try:
+                inventory = await asyncio.to_thread(local_inventory)
+            except Exception as e:
+                raise LookupError(f"Unknown inventory version {version}") from e
+            if inventory.version != version:
+                raise LookupError(f"Unknown inventory version {version}")
+            await inventory.publish()
+            payload = inventory.payload
+        servers = _versions[version] = json.loads(payload)
+        if len(_versions) > LOCAL_VERSIONS:
+            _versions.popitem(last=False)
+    else:
+        _versions.move_to_end(version)
+    return servers
+
+
+def resolve_servers(dns_servers) -> list:
+    """
+    Server list of a task: either the list itself or an inventory version.
+    """
+    if isinstance(dns_servers, str):
+        return engine.run(fetch(dns_servers))
+    return dns_servers
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import redis
+
+from worker import celeryconfig, engine
+from worker.redis_client import get_async_redis
+from worker.sketch import LatencySketch
+
+# Latency sketches per (server, dns_protocol, qtype) are kept in memory and
+# added every LATENCY_FLUSH_INTERVAL seconds to one Redis hash per time slot,
+# where the counts of all workers are merged. Slots expire after
+# LATENCY_RETENTION, so memory stays bounded.
+LATENCY_PREFIX = "dnstester:latency:"
+
+dnstester_logger = logging.getLogger('dnstester')
+
+_lock = threading.Lock()
+_pending = defaultdict(LatencySketch)
+_flusher_pid = None
+
+
+def slot_of(timestamp: float) -> int:
+    return int(timestamp // celeryconfig.LATENCY_SLOT_SECONDS) * celeryconfig.LATENCY_SLOT_SECONDS
+
+
+def series_field(server: str, dns_protocol: str, qtype: str, key: int) -> str:
+    return f"{server}|{dns_protocol}|{qtype}|{key}"
+
+
+def record(server: str, dns_protocol: str, qtype: str, response_time_ms: float):
+    """
+    Count one response time. Called from the task threads, flushed by the engine loop.
+    """
+    with _lock:
+        _pending[(slot_of(time.time()), server, dns_protocol, qtype)].add(response_time_ms)
+
+
+async def flush():
+    global _pending
+    with _lock:
+        pending, _pending = _pending, defaultdict(LatencySketch)
+    if not pending:
+        return
+
+    try:
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            slots = set()
+            for (slot, server, dns_protocol, qtype), sketch in pending.items():
+                for key, count in sketch.bins.items():
+                    pipe.hincrby(f"{LATENCY_PREFIX}{slot}", series_field(server, dns_protocol, qtype, key), count)
+                slots.add(slot)
+            for slot in slots:
+                pipe.expire(f"{LATENCY_PREFIX}{slot}", celeryconfig.LATENCY_RETENTION + celeryconfig.LATENCY_SLOT_SECONDS)
+            await pipe.execute()
+    except redis.RedisError as e:
+        dnstester_logger.warning(f"unable to flush latency sketches: {e}")
+
+
+async def _flush_forever():
+    while True:
+        await asyncio.sleep(celeryconfig.LATENCY_FLUSH_INTERVAL)
+        await flush()
+
+
+def ensure_flusher():
+    """
+    Start the periodic flush on the engine loop, once per process.
+    """
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    asyncio.run_coroutine_threadsafe(_flush_forever(), engine.get_loop())
+
+
+async def read_window(window: int, now: float = None) -> dict:
+    """
+    Merge the sketches of the slots of the last window seconds, across all
+    workers. Returns {(server, dns_protocol, qtype): LatencySketch}.
+    """
+    now = time.time() if now is None else now
+    slots = range(slot_of(now - window), slot_of(now) + 1, celeryconfig.LATENCY_SLOT_SECONDS)
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for slot in slots:
+            pipe.hgetall(f"{LATENCY_PREFIX}{slot}")
+        hashes = await pipe.execute()
+
+    sketches = defaultdict(LatencySketch)
+    for fields in hashes:
+        for field, count in fields.items():
+            server, dns_protocol, qtype, key = field.decode().rsplit("|", 3)
+            sketches[(server, dns_protocol, qtype)].bins[int(key)] += int(count)
+    return dict(sketches)
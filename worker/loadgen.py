@@ -0,0 +1,140 @@
+import asyncio
+import errno
+import logging
+import math
+from collections import Counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from worker import celeryconfig, native
+from worker.dnswire import rcode_name
+from worker.q import get_dns_protocol_from_target
+
+dnstester_logger = logging.getLogger('dnstester')
+
+PERCENTILES = {"p50": 50, "p90": 90, "p99": 99, "p999": 99.9}
+
+# Failures of the worker itself (out of file descriptors, buffers or ports), not of the server
+LOCAL_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL}
+# File descriptors left to the rest of the process when sizing the queries in flight
+RESERVED_FDS = 256
+
+
+def percentile(sorted_values: list, pct: float) -> float | None:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(round(pct / 100 * len(sorted_values), 6)))
+    return sorted_values[rank - 1]
+
+
+def fd_budget() -> int | None:
+    """
+    Queries that may be in flight at once in this process: each native query
+    holds a socket, so stay below the soft RLIMIT_NOFILE. None when unlimited.
+    """
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(1, soft - RESERVED_FDS)
+
+
+def summarize(sent: int, latencies: list, timeouts: int, errors: int, local_errors: int, rcodes: Counter, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    latency_ms = {name: percentile(latencies, pct) for name, pct in PERCENTILES.items()}
+    latency_ms["max"] = latencies[-1] if latencies else None
+    return {
+        "sent": sent,
+        "completed": len(latencies),
+        "timeouts": timeouts,
+        "errors": errors,
+        "local_errors": local_errors,
+        "achieved_qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "timeout_rate": round(timeouts / sent, 4) if sent else 0.0,
+        "error_rate": round(errors / sent, 4) if sent else 0.0,
+        "rcodes": dict(rcodes),
+        "latency_ms": {name: round(value, 3) if value is not None else None for name, value in latency_ms.items()},
+    }
+
+
+async def load_target(target: str, queries: list, qps: float, duration: float, tls_insecure_skip_verify: bool,
+                      max_in_flight: int | None = None) -> dict:
+    """
+    Send qps queries per second to one target for duration seconds, cycling
+    through queries. Pacing is open-loop: each query is sent at its
+    scheduled time whether or not the previous ones were answered, and its
+    latency is measured from that scheduled time. At most max_in_flight
+    queries are outstanding, the next ones wait for a slot.
+    """
+    loop = asyncio.get_running_loop()
+    latencies, rcodes = [], Counter()
+    timeouts = errors = local_errors = 0
+
+    async def _send(domain, qtype, scheduled_at):
+        nonlocal timeouts, errors, local_errors
+        try:
+            response, _ = await native.query(domain, qtype, target, celeryconfig.DNS_QUERY_TIMEOUT, tls_insecure_skip_verify)
+        except asyncio.TimeoutError:
+            timeouts += 1
+            return
+        except OSError as e:
+            if e.errno not in LOCAL_ERRNOS:
+                dnstester_logger.debug(f"load test query to {target} failed: {e}")
+                errors += 1
+                return
+            dnstester_logger.warning(f"load test query to {target} failed locally: {e}")
+            local_errors += 1
+            return
+        except Exception as e:
+            dnstester_logger.debug(f"load test query to {target} failed: {e}")
+            errors += 1
+            return
+        latencies.append((loop.time() - scheduled_at) * 1000)
+        rcodes[rcode_name(response["rcode"])] += 1
+
+    total = int(qps * duration)
+    # answered or timed out within DNS_QUERY_TIMEOUT, so only a generator
+    # falling behind keeps more in flight: then wait for some to complete
+    max_in_flight = min(math.ceil(qps * celeryconfig.DNS_QUERY_TIMEOUT) + 1, max_in_flight or math.inf)
+    in_flight = set()
+    start = loop.time()
+    for i in range(total):
+        scheduled_at = start + i / qps
+        # sleep even when behind schedule, so that the answers are still read
+        await asyncio.sleep(max(0.0, scheduled_at - loop.time()))
+        if len(in_flight) >= max_in_flight:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        domain, qtype = queries[i % len(queries)]
+        task = asyncio.create_task(_send(domain, qtype, scheduled_at))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.wait(in_flight)
+    result = summarize(total, latencies, timeouts, errors, local_errors, rcodes, loop.time() - start)
+    result["dns_protocol"] = get_dns_protocol_from_target(target)
+    return result
+
+
+async def run_load_test(targets: list, queries: list, qps: float, duration: float, tls_insecure_skip_verify: bool) -> dict:
+    """
+    Load all targets concurrently, each at the full qps. Returns the stats keyed by target.
+    """
+    unsupported = [target for target in targets if not native.supports(target)]
+    if unsupported:
+        raise ValueError(f"load tests need the native backend, unsupported targets: {', '.join(unsupported)}")
+
+    # the targets share the file descriptors of the process
+    budget = fd_budget()
+    max_in_flight = max(1, budget // len(targets)) if budget and targets else None
+    results = await asyncio.gather(*(
+        load_target(target, queries, qps, duration, tls_insecure_skip_verify, max_in_flight) for target in targets
+    ))
+    return dict(zip(targets, results))
@@ -1,13 +1,19 @@
 import os
 import logging
+import random
 import logging.config
 import time
 
-from celery import Celery
-from prometheus_client import generate_latest
+from celery import Celery, chord
+from celery.result import GroupResult
+from celery.signals import before_task_publish, task_prerun, worker_process_shutdown
+from prometheus_client import generate_latest, multiprocess
 
-from worker.q import run_q
-from worker import celeryconfig
+from worker.q import run_q, run_q_batch, server_results, split_by_qtype
+from worker.consistency import check as check_consistency, server_providers
+from worker import celeryconfig, engine, history, inventory, latency, loadgen, metrics, probes, queues, serialization, streams, sweep
+
+dnstester_logger = logging.getLogger('dnstester')
 
 wrk = Celery('dns_tester', broker=celeryconfig.CELERY_BROKER_URL, backend=celeryconfig.CELERY_RESULT_BACKEND)
 wrk.conf.update(
@@ -17,17 +23,226 @@ wrk.conf.update(
 
 wrk.conf.broker_connection_retry_on_startup = True
 
+# Results in both encodings stay readable when RESULT_ENCODING changes
+wrk.conf.result_accept_content = ["json", serialization.SERIALIZER_NAME]
+if celeryconfig.RESULT_ENCODING == "compact":
+    wrk.conf.result_serializer = serialization.SERIALIZER_NAME
+
+# Interactive and bulk tasks go to separate queues
+wrk.conf.task_queues = queues.TASK_QUEUES
+wrk.conf.task_default_queue = queues.INTERACTIVE
+wrk.conf.task_routes = queues.task_routes()
+
 @wrk.on_after_configure.connect
 def setup_logging(**kwargs):
     logging.config.fileConfig('/app/logging.conf')
 
-@wrk.task()
-def lookup_dns(domain, qtype, dns_servers, tls_insecure_skip_verify):
+@before_task_publish.connect
+def stamp_sent_at(headers=None, **kwargs):
+    if headers is not None:
+        queues.stamp_sent_at(headers)
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    queues.observe_wait(task.request)
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(**kwargs):
+    if celeryconfig.PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(metrics.process_identifier())
+
+@worker_process_shutdown.connect
+def flush_latency_sketches(**kwargs):
+    if celeryconfig.LATENCY_SKETCHES:
+        engine.run(latency.flush())
+
+@worker_process_shutdown.connect
+def flush_history(**kwargs):
+    if celeryconfig.HISTORY_DIR:
+        history.get_writer().flush()
+
+def stream_publisher(task_id):
+    """
+    Coroutine function publishing each server result to the stream of the
+    task, or None when result streaming is disabled.
+    """
+    if not (celeryconfig.RESULT_STREAMING and task_id):
+        return None
+
+    async def on_result(server, result):
+        await streams.publish(task_id, "result", {"server": server, "result": result})
+    return on_result
+
+def publish_summary(task_id, results, runtime):
+    summary = {
+        "duration": runtime,
+        "nb_servers": len(results),
+        "nb_ok": sum(1 for _, result in server_results(results) if result.get("command_status") == "ok"),
+    }
+    engine.run(streams.publish(task_id, "summary", summary))
+
+def consistency_report(qtype, results, providers=None):
+    """
+    Consistency report of a lookup, one per qtype for multi-qtype lookups.
+    """
+    if qtype is None or isinstance(qtype, str):
+        return check_consistency(results, providers)
+    return {name: check_consistency(qtype_results, providers) for name, qtype_results in split_by_qtype(results).items()}
+
+@wrk.task(bind=True)
+def lookup_dns(self, domain, qtype, dns_servers, tls_insecure_skip_verify, bypass_cache=False, max_staleness=0,
+               first_answers=None, deadline=None, hedge=False, consistency=False):
     start_time = time.time()
-    results = run_q(domain, qtype, dns_servers, tls_insecure_skip_verify)
+    task_id = self.request.id
+    dns_servers = inventory.resolve_servers(dns_servers)
+
+    # Early-return lookups need all their servers in the same event loop
+    if celeryconfig.PROTOCOL_SHARDING and task_id and not (first_answers or hedge):
+        shards = queues.split_by_protocol(dns_servers)
+        if len(shards) > 1:
+            queue = (self.request.delivery_info or {}).get("routing_key") or queues.INTERACTIVE
+            options = {"bypass_cache": bypass_cache, "max_staleness": max_staleness, "deadline": deadline}
+            header = [
+                lookup_dns_shard.s(domain, qtype, servers, tls_insecure_skip_verify, task_id, **options)
+                .set(queue=queues.protocol_queue(queue, family))
+                for family, servers in shards.items()
+            ]
+            targets = [server["target"] for server in dns_servers]
+            # the merged result is stored under the id of this task
+            providers = server_providers(dns_servers) if consistency else None
+            merge = merge_shards.s(targets, start_time, task_id, consistency, qtype, providers).set(queue=queue)
+            raise self.replace(chord(header, merge))
+
+    on_result = stream_publisher(task_id)
+    results = run_q(
+        domain, qtype, dns_servers, tls_insecure_skip_verify, on_result=on_result,
+        bypass_cache=bypass_cache, max_staleness=max_staleness,
+        first_answers=first_answers, deadline=deadline, hedge=hedge,
+    )
+    runtime = time.time() - start_time
+
+    if on_result is not None:
+        publish_summary(task_id, results, runtime)
+    task_result = {"details": results, "duration": runtime}
+    if consistency:
+        task_result["consistency"] = consistency_report(qtype, results, server_providers(dns_servers))
+    return task_result
+
+@wrk.task()
+def lookup_dns_shard(domain, qtype, dns_servers, tls_insecure_skip_verify, stream_id=None, **options):
+    """
+    Servers of one protocol family of a sharded lookup.
+    """
+    return run_q(domain, qtype, dns_servers, tls_insecure_skip_verify, on_result=stream_publisher(stream_id), **options)
+
+@wrk.task()
+def merge_shards(shard_results, targets, start_time, stream_id=None, consistency=False, qtype=None, providers=None):
+    """
+    Chord callback of a sharded lookup: merge the results of the shards in the order of the servers.
+    """
+    merged = {}
+    for results in shard_results:
+        merged.update(results)
+    results = {target: merged[target] for target in targets if target in merged}
     runtime = time.time() - start_time
-    return {"details": results, "duration": runtime}
+
+    if celeryconfig.RESULT_STREAMING and stream_id:
+        publish_summary(stream_id, results, runtime)
+    task_result = {"details": results, "duration": runtime}
+    if consistency:
+        task_result["consistency"] = consistency_report(qtype, results, providers)
+    return task_result
+
+@wrk.task()
+def lookup_dns_batch(queries, dns_servers, tls_insecure_skip_verify, bypass_cache=False, max_staleness=0):
+    dns_servers = inventory.resolve_servers(dns_servers)
+    return run_q_batch(queries, dns_servers, tls_insecure_skip_verify, bypass_cache=bypass_cache, max_staleness=max_staleness)
+
+@wrk.task()
+def reverse_sweep(first, count, dns_servers, tls_insecure_skip_verify, qps=None, bypass_cache=False, max_staleness=0):
+    """
+    One chunk of a reverse sweep: PTR lookups of count addresses from first,
+    started at qps per server when set.
+    """
+    dns_servers = inventory.resolve_servers(dns_servers)
+    queries = ((ip, "PTR") for ip in sweep.addresses(first, count))
+    results = run_q_batch(
+        queries, dns_servers, tls_insecure_skip_verify,
+        bypass_cache=bypass_cache, max_staleness=max_staleness, qps=qps,
+    )
+    return [sweep.ptr_row(item["domain"], item["details"]) for item in results]
+
+@wrk.task(ignore_result=True)
+def fail_sweep_chunks(request, exc, traceback, sweep_id):
+    """
+    Error callback of a chunk of a rate-limited sweep: the chunks chained after
+    it never run, mark them failed so that the sweep still completes.
+    """
+    batch = GroupResult.restore(sweep_id, app=wrk)
+    if batch is None:
+        return
+    for chunk in batch.results:
+        if not chunk.ready():
+            wrk.backend.mark_as_failure(chunk.id, exc)
+
+@wrk.task()
+def load_test(dns_servers, queries, qps, duration, tls_insecure_skip_verify):
+    start_time = time.time()
+    targets = [server["target"] for server in inventory.resolve_servers(dns_servers)]
+    results = engine.run(loadgen.run_load_test(targets, queries, qps, duration, tls_insecure_skip_verify))
+    return {"details": results, "qps": qps, "duration": time.time() - start_time}
 
 @wrk.task()
 def get_metrics():
-    return  generate_latest().decode('utf-8')
\ No newline at end of file
+    return generate_latest().decode('utf-8')
+
+
+@wrk.task(ignore_result=True)
+def probe_server(server, queries, tls_insecure_skip_verify):
+    """
+    Probe one server with the configured queries. Only the metrics are
+    updated, nothing is written to the result backend.
+    """
+    for domain, qtype in queries:
+        run_q(domain, qtype, [server], tls_insecure_skip_verify, bypass_cache=True)
+
+@wrk.task(ignore_result=True)
+def dispatch_probes():
+    """
+    Run by Celery beat every PROBE_TICK seconds: enqueue the probes due
+    before the next tick, delayed to their due time plus some jitter.
+    """
+    try:
+        config, targets = probes.load_probes()
+    except Exception as e:
+        dnstester_logger.warning(f"unable to load probes configuration: {e}")
+        return
+    if config is None:
+        return
+
+    queries = [(query.domain, query.qtype) for query in config.queries]
+    now = time.time()
+    window_start = now - now % celeryconfig.PROBE_TICK
+    for target, due_at in probes.due_probes(targets, window_start, window_start + celeryconfig.PROBE_TICK):
+        interval = target["interval"]
+        server = {"target": target["target"], "tags": target["tags"]}
+        delay = max(0, due_at - now)
+        probe_server.apply_async(
+            args=(server, queries, config.tls_insecure_skip_verify),
+            countdown=delay + random.uniform(0, config.jitter * interval),
+            # a probe still queued when the next one is due is dropped (seconds from now)
+            expires=delay + interval,
+        )
+
+@wrk.task(ignore_result=True)
+def maintain_history():
+    """
+    Run by Celery beat every hour: downsample and expire history partitions.
+    """
+    if celeryconfig.HISTORY_DIR:
+        history.maintain()
+
+wrk.conf.beat_schedule = {
+    "dispatch-probes": {"task": dispatch_probes.name, "schedule": celeryconfig.PROBE_TICK},
+    "maintain-history": {"task": maintain_history.name, "schedule": 3600},
+}
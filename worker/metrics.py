@@ -1,11 +1,47 @@
+import os
+import socket
 
-from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, values
+
+from worker import celeryconfig
+
+
+def process_identifier() -> str:
+    """
+    Name of the metrics files of this process. Pids alone are not unique
+    across the containers sharing PROMETHEUS_MULTIPROC_DIR.
+    """
+    return f"{socket.gethostname().replace('_', '-')}-{os.getpid()}"
+
+
+# Multiprocess mode: every process (API, worker children, beat) writes its
+# metrics to the shared directory, and the API aggregates them on scrape.
+# It must be enabled before the metrics below are created.
+if celeryconfig.PROMETHEUS_MULTIPROC_DIR:
+    values.ValueClass = values.MultiProcessValue(process_identifier)
+
+
+def generate_multiprocess_latest(path: str = None) -> bytes:
+    """
+    Render the metrics of all the processes writing to the multiprocess directory.
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path or celeryconfig.PROMETHEUS_MULTIPROC_DIR)
+    return generate_latest(registry)
+
+
+# Most DNS answers take 1 to 50 ms, the default buckets start at 5 ms and grow too fast
+DNS_RESPONSE_TIME_BUCKETS = (
+    0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.04, 0.05,
+    0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
 
 # Prometheus Metrics
 dns_response_time = Histogram(
     "dns_response_time_seconds",
     "Time taken for DNS resolution",
-    ["server"]
+    ["server"],
+    buckets=DNS_RESPONSE_TIME_BUCKETS
 )
 
 dns_total_queries = Counter(
@@ -29,7 +65,8 @@ dns_failure_count = Counter(
 dns_avg_response_time = Gauge(
     "dns_avg_response_time_seconds",
     "Average DNS response time",
-    ["server"]
+    ["server"],
+    multiprocess_mode="mostrecent"
 )
 
 dns_query_types_count = Counter(
@@ -37,3 +74,47 @@ dns_query_types_count = Counter(
     "Total number of DNS queries per query type",
     ["qtype"]
 )
+
+dns_cache_hits = Counter(
+    "dns_cache_hits",
+    "Number of DNS results served from the answer cache",
+    ["server", "tier"]
+)
+
+dns_cache_misses = Counter(
+    "dns_cache_misses",
+    "Number of DNS lookups not found in the answer cache",
+    ["server"]
+)
+
+dns_hedged_queries = Counter(
+    "dns_hedged_queries",
+    "Number of servers queried because another one was slower than its estimated 95th percentile"
+)
+
+dns_unanswered_queries = Counter(
+    "dns_unanswered_queries",
+    "Number of in-flight queries cancelled when an early-returning lookup completed"
+)
+
+# Queue wait ranges from milliseconds (idle interactive pool) to minutes (bulk backlog)
+QUEUE_WAIT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+dns_queue_wait_time = Histogram(
+    "dns_queue_wait_time_seconds",
+    "Time tasks waited in their Celery queue before a worker started them",
+    ["queue"],
+    buckets=QUEUE_WAIT_TIME_BUCKETS
+)
+
+dns_consistency_checks = Counter(
+    "dns_consistency_checks",
+    "Number of lookups whose answers were compared across servers, per result (consistent or divergent)",
+    ["result"]
+)
+
+dns_consistency_outliers = Counter(
+    "dns_consistency_outliers",
+    "Number of times a server disagreed with the other servers of a lookup, per reason",
+    ["server", "reason"]
+)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import struct
+import time
+
+from worker import pool
+from worker.dnswire import FLAG_TC, DNSWireError, build_query, parse_response, reverse_name
+
+# Schemes handled in-process, the others are delegated to the q backend
+NATIVE_SCHEMES = ("udp://", "tcp://") + pool.POOLED_SCHEMES
+
+DEFAULT_PORTS = {
+    "udp": 53,
+    "tcp": 53,
+    "tls": 853,
+    "https": 443,
+    "quic": 853,
+}
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def supports(target: str) -> bool:
+    return target.startswith(NATIVE_SCHEMES)
+
+
+def split_target(target: str) -> tuple[str, str, int]:
+    """
+    Split a target like udp://8.8.8.8:53 or tcp://[2001:db8::1] into (scheme, host, port).
+    """
+    scheme, _, rest = target.partition("://")
+    rest = rest.split("/", 1)[0]
+    if rest.startswith("["):
+        host, _, tail = rest[1:].partition("]")
+        port = tail.lstrip(":")
+    elif rest.count(":") == 1:
+        host, port = rest.split(":")
+    else:
+        host, port = rest, ""
+    return scheme, host, int(port) if port else DEFAULT_PORTS.get(scheme, 53)
+
+
+class _UDPExchange(asyncio.DatagramProtocol):
+    def __init__(self, msg_id: int):
+        self.msg_id = msg_id
+        self.future = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        # ignore stray datagrams that do not match our query id
+        if len(data) >= 2 and struct.unpack_from("!H", data)[0] == self.msg_id and not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+    def connection_lost(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc or ConnectionError("connection closed"))
+
+
+async def _exchange_udp(host: str, port: int, payload: bytes, msg_id: int) -> bytes:
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _UDPExchange(msg_id), remote_addr=(host, port)
+    )
+    try:
+        transport.sendto(payload)
+        return await protocol.future
+    finally:
+        transport.close()
+
+
+async def _exchange_tcp(host: str, port: int, payload: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(struct.pack("!H", len(payload)) + payload)
+        await writer.drain()
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+        return await reader.readexactly(length)
+    finally:
+        writer.close()
+
+
+async def exchange(target: str, payload: bytes, msg_id: int, timeout: float) -> tuple[bytes, float]:
+    """
+    Send a wire-format query to a Do53 target and return (response, rtt in ms).
+    UDP answers with the TC bit set are retried over TCP.
+    """
+    scheme, host, port = split_target(target)
+
+    start = time.perf_counter()
+    if scheme == "udp":
+        data = await asyncio.wait_for(_exchange_udp(host, port, payload, msg_id), timeout)
+        if len(data) >= 4 and struct.unpack_from("!H", data, 2)[0] & FLAG_TC:
+            dnstester_logger.debug(f"truncated answer from {target}, retrying over TCP")
+            data = await asyncio.wait_for(_exchange_tcp(host, port, payload), timeout)
+    else:
+        data = await asyncio.wait_for(_exchange_tcp(host, port, payload), timeout)
+    return data, (time.perf_counter() - start) * 1000
+
+
+async def query(domain: str, qtype: str, target: str, timeout: float, tls_insecure_skip_verify: bool = False) -> tuple[dict, dict]:
+    """
+    Resolve domain/qtype against a target without leaving the process.
+    Returns the parsed response and a dict with the round-trip time in
+    milliseconds (time_ms) and, for DoT/DoH/DoQ, the connection pool info.
+    """
+    name = reverse_name(domain) if qtype == "PTR" else domain
+    msg_id, payload = build_query(name, qtype)
+    start = time.perf_counter()
+    if target.startswith(pool.POOLED_SCHEMES):
+        data, meta = await asyncio.wait_for(
+            pool.get_pool().exchange(target, payload, tls_insecure_skip_verify), timeout
+        )
+        meta["time_ms"] = (time.perf_counter() - start) * 1000
+    else:
+        data, time_ms = await exchange(target, payload, msg_id, timeout)
+        meta = {"time_ms": time_ms}
+    response = parse_response(data)
+    if response["id"] != msg_id:
+        raise DNSWireError("response id does not match query id")
+    return response, meta
@@ -0,0 +1,406 @@
+import asyncio
+import contextlib
+import logging
+import ssl
+import struct
+import time
+
+from worker import celeryconfig
+
+try:
+    import httpx
+    import h2  # noqa: F401 - required by httpx for HTTP/2
+    HTTP2_AVAILABLE = True
+    _CONNECTION_ERRORS = (OSError, EOFError, httpx.TransportError)
+except ImportError:
+    HTTP2_AVAILABLE = False
+    _CONNECTION_ERRORS = (OSError, EOFError)
+
+try:
+    from aioquic.asyncio.client import connect as quic_connect
+    from aioquic.asyncio.protocol import QuicConnectionProtocol
+    from aioquic.quic.configuration import QuicConfiguration
+    from aioquic.quic.events import ConnectionTerminated, HandshakeCompleted, StreamDataReceived
+    QUIC_AVAILABLE = True
+except ImportError:
+    QuicConnectionProtocol = object
+    QUIC_AVAILABLE = False
+
+# Schemes that can be served by a pooled connection in this process
+POOLED_SCHEMES = ("tls://",) + (("https://",) if HTTP2_AVAILABLE else ()) + (("quic://",) if QUIC_AVAILABLE else ())
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    Client context that offers the last TLS session seen for its target,
+    so that reconnections use an abbreviated handshake.
+    """
+    session = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session or self.session)
+
+    def remember(self, ssl_object):
+        if ssl_object is not None and ssl_object.session is not None:
+            self.session = ssl_object.session
+
+
+def make_ssl_context(tls_insecure_skip_verify: bool, alpn: list[str] | None = None) -> ResumingSSLContext:
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if tls_insecure_skip_verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if alpn:
+        context.set_alpn_protocols(alpn)
+    return context
+
+
+def _with_id(payload: bytes, msg_id: int) -> bytes:
+    return struct.pack("!H", msg_id) + payload[2:]
+
+
+class PooledConnection:
+    """
+    Base class of long-lived connections. Subclasses implement _connect,
+    _exchange and _close; connection setup is serialised by a lock so that
+    concurrent queries to the same target share a single handshake.
+    """
+
+    def __init__(self, target: str, host: str, port: int, tls_insecure_skip_verify: bool):
+        self.target = target
+        self.host = host
+        self.port = port
+        self.tls_insecure_skip_verify = tls_insecure_skip_verify
+        self.last_used = time.monotonic()
+        self.connected = False
+        self._lock = asyncio.Lock()
+
+    async def exchange(self, payload: bytes) -> tuple[bytes, dict]:
+        """
+        Send one query and return (response, meta) where meta tells whether
+        the connection was reused and how long the handshake took.
+        """
+        meta = {"connection_reused": True, "handshake_ms": 0.0}
+        async with self._lock:
+            if self.connected and not self.alive():
+                await self.close()
+            if not self.connected:
+                start = time.perf_counter()
+                meta["session_resumed"] = await self._connect()
+                meta["handshake_ms"] = (time.perf_counter() - start) * 1000
+                meta["connection_reused"] = False
+                self.connected = True
+        self.last_used = time.monotonic()
+        data = await self._exchange(payload, meta)
+        self.last_used = time.monotonic()
+        return data, meta
+
+    async def close(self):
+        self.connected = False
+        with contextlib.suppress(Exception):
+            await self._close()
+
+    def alive(self) -> bool:
+        return True
+
+    async def _connect(self) -> bool:
+        raise NotImplementedError
+
+    async def _exchange(self, payload: bytes, meta: dict) -> bytes:
+        raise NotImplementedError
+
+    async def _close(self):
+        raise NotImplementedError
+
+
+class DoTConnection(PooledConnection):
+    """
+    DNS over TLS (RFC 7858). Queries are pipelined on one TCP+TLS stream and
+    answers are matched back by message id.
+    """
+
+    def __init__(self, *args, context: ResumingSSLContext):
+        super().__init__(*args)
+        self.context = context
+        self.pending = {}
+        self.next_id = 0
+        self.reader = self.writer = self.reader_task = None
+
+    async def _connect(self) -> bool:
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.context, server_hostname=self.host
+        )
+        self.reader_task = asyncio.create_task(self._read_loop())
+        return self.writer.get_extra_info("ssl_object").session_reused
+
+    def alive(self) -> bool:
+        return self.reader_task is not None and not self.reader_task.done()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+                data = await self.reader.readexactly(length)
+                future = self.pending.pop(struct.unpack_from("!H", data)[0], None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except (OSError, EOFError, asyncio.IncompleteReadError) as e:
+            error = e
+        except asyncio.CancelledError:
+            error = ConnectionError("connection closed")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"connection to {self.target} lost: {error}"))
+        self.pending.clear()
+
+    async def _exchange(self, payload: bytes, meta: dict) -> bytes:
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        while self.next_id in self.pending:
+            self.next_id = (self.next_id + 1) & 0xFFFF
+        msg_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[msg_id] = future
+        try:
+            self.writer.write(struct.pack("!H", len(payload)) + _with_id(payload, msg_id))
+            await self.writer.drain()
+            data = await future
+        finally:
+            self.pending.pop(msg_id, None)
+        self.context.remember(self.writer.get_extra_info("ssl_object"))
+        return _with_id(data, struct.unpack_from("!H", payload)[0])
+
+    async def _close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+class DoHConnection(PooledConnection):
+    """
+    DNS over HTTPS (RFC 8484) with HTTP/2, concurrent queries are multiplexed
+    as streams of one connection.
+    """
+
+    def __init__(self, *args, url: str, context: ResumingSSLContext):
+        super().__init__(*args)
+        self.url = url
+        self.context = context
+        self.client = None
+
+    async def _connect(self):
+        self.client = httpx.AsyncClient(
+            http2=True,
+            verify=self.context,
+            limits=httpx.Limits(keepalive_expiry=celeryconfig.DNS_POOL_IDLE_TIMEOUT),
+        )
+        # the TLS handshake happens with the first request, see _exchange
+        return None
+
+    async def _exchange(self, payload: bytes, meta: dict) -> bytes:
+        events = {}
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                events["connect"] = time.perf_counter()
+            elif event_name == "connection.start_tls.complete":
+                events["tls"] = time.perf_counter()
+                ssl_object = info["return_value"].get_extra_info("ssl_object")
+                events["session_resumed"] = ssl_object.session_reused
+                self.context.remember(ssl_object)
+
+        response = await self.client.post(
+            self.url,
+            content=_with_id(payload, 0),
+            headers={"content-type": "application/dns-message", "accept": "application/dns-message"},
+            extensions={"trace": trace},
+        )
+        response.raise_for_status()
+
+        # httpx reconnects on its own when the server closed the connection
+        if "connect" in events:
+            meta["connection_reused"] = False
+            meta["handshake_ms"] = meta["handshake_ms"] + (events.get("tls", events["connect"]) - events["connect"]) * 1000
+            meta["session_resumed"] = events.get("session_resumed")
+        else:
+            meta["connection_reused"] = True
+            meta["handshake_ms"] = 0.0
+            meta.pop("session_resumed", None)
+        return _with_id(response.content, struct.unpack_from("!H", payload)[0])
+
+    async def _close(self):
+        if self.client:
+            await self.client.aclose()
+
+
+class _DoQProtocol(QuicConnectionProtocol):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streams = {}
+        self.session_resumed = None
+        self.terminated = False
+
+    def quic_event_received(self, event):
+        if isinstance(event, StreamDataReceived):
+            future, buf = self.streams.get(event.stream_id, (None, None))
+            if future is None:
+                return
+            buf += event.data
+            if event.end_stream and not future.done():
+                future.set_result(bytes(buf))
+        elif isinstance(event, HandshakeCompleted):
+            self.session_resumed = event.session_resumed
+        elif isinstance(event, ConnectionTerminated):
+            self.terminated = True
+            for future, _ in self.streams.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"QUIC connection terminated: {event.reason_phrase}"))
+
+    async def query(self, payload: bytes) -> bytes:
+        stream_id = self._quic.get_next_available_stream_id()
+        future = asyncio.get_running_loop().create_future()
+        self.streams[stream_id] = (future, bytearray())
+        try:
+            self._quic.send_stream_data(stream_id, struct.pack("!H", len(payload)) + payload, end_stream=True)
+            self.transmit()
+            data = await future
+        finally:
+            self.streams.pop(stream_id, None)
+        (length,) = struct.unpack_from("!H", data)
+        return data[2:2 + length]
+
+
+class DoQConnection(PooledConnection):
+    """
+    DNS over QUIC (RFC 9250), one bidirectional stream per query. Session
+    tickets are kept per target to resume with 0-RTT when the server allows it.
+    """
+
+    def __init__(self, *args, tickets: dict):
+        super().__init__(*args)
+        self.tickets = tickets
+        self.protocol = None
+        self._stack = None
+
+    async def _connect(self):
+        configuration = QuicConfiguration(
+            is_client=True,
+            alpn_protocols=["doq"],
+            server_name=self.host,
+            verify_mode=ssl.CERT_NONE if self.tls_insecure_skip_verify else ssl.CERT_REQUIRED,
+            session_ticket=self.tickets.get(self.target),
+        )
+        self._stack = contextlib.AsyncExitStack()
+        self.protocol = await self._stack.enter_async_context(quic_connect(
+            self.host,
+            self.port,
+            configuration=configuration,
+            create_protocol=_DoQProtocol,
+            session_ticket_handler=lambda ticket: self.tickets.__setitem__(self.target, ticket),
+            # with a session ticket, queries leave as 0-RTT data before the handshake ends
+            wait_connected=configuration.session_ticket is None,
+        ))
+        return self.protocol.session_resumed
+
+    def alive(self) -> bool:
+        return self.protocol is not None and not self.protocol.terminated
+
+    async def _exchange(self, payload: bytes, meta: dict) -> bytes:
+        data = await self.protocol.query(_with_id(payload, 0))
+        if meta.get("session_resumed") is None and not meta["connection_reused"]:
+            meta["session_resumed"] = self.protocol.session_resumed
+        return _with_id(data, struct.unpack_from("!H", payload)[0])
+
+    async def _close(self):
+        if self._stack:
+            await self._stack.aclose()
+
+
+class ConnectionPool:
+    """
+    Long-lived DoT/DoH/DoQ connections of one worker process, keyed by target.
+    Connections idle for more than DNS_POOL_IDLE_TIMEOUT seconds are closed.
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.contexts = {}
+        self.quic_tickets = {}
+        self.last_sweep = time.monotonic()
+        self._closing = set()
+
+    def _create(self, target: str, tls_insecure_skip_verify: bool) -> PooledConnection:
+        from worker.native import split_target
+
+        scheme, host, port = split_target(target)
+        args = (target, host, port, tls_insecure_skip_verify)
+        context_key = (target, tls_insecure_skip_verify)
+        if scheme == "tls":
+            context = self.contexts.setdefault(context_key, make_ssl_context(tls_insecure_skip_verify))
+            return DoTConnection(*args, context=context)
+        if scheme == "https":
+            context = self.contexts.setdefault(context_key, make_ssl_context(tls_insecure_skip_verify))
+            path = target.split("://", 1)[1].partition("/")[2]
+            url = f"https://{target.split('://', 1)[1].split('/', 1)[0]}/{path or 'dns-query'}"
+            return DoHConnection(*args, url=url, context=context)
+        if scheme == "quic":
+            return DoQConnection(*args, tickets=self.quic_tickets)
+        raise ValueError(f"no pooled transport for {target}")
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for key, conn in list(self.connections.items()):
+            if now - conn.last_used > celeryconfig.DNS_POOL_IDLE_TIMEOUT:
+                dnstester_logger.debug(f"closing idle connection to {conn.target}")
+                del self.connections[key]
+                # close in the background, queries must not wait for it
+                task = asyncio.create_task(conn.close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+        self.last_sweep = now
+
+    async def exchange(self, target: str, payload: bytes, tls_insecure_skip_verify: bool) -> tuple[bytes, dict]:
+        if time.monotonic() - self.last_sweep > celeryconfig.DNS_POOL_IDLE_TIMEOUT / 2:
+            self.evict_idle()
+
+        key = (target, tls_insecure_skip_verify)
+        conn = self.connections.get(key)
+        if conn is None:
+            conn = self.connections[key] = self._create(target, tls_insecure_skip_verify)
+
+        was_connected = conn.connected
+        try:
+            return await conn.exchange(payload)
+        except _CONNECTION_ERRORS:
+            await conn.close()
+            if self.connections.get(key) is conn:
+                del self.connections[key]
+            if not was_connected:
+                raise
+        # the server closed a connection we kept open, reconnect once
+        dnstester_logger.debug(f"pooled connection to {target} was closed, reconnecting")
+        conn = self.connections[key] = self._create(target, tls_insecure_skip_verify)
+        return await conn.exchange(payload)
+
+    async def close(self):
+        for conn in self.connections.values():
+            await conn.close()
+        self.connections.clear()
+
+
+_pool = None
+_pool_loop = None
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Pool bound to the running event loop (the worker engine loop).
+    """
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool, _pool_loop = ConnectionPool(), loop
+    return _pool
@@ -0,0 +1,58 @@
+import logging
+import os
+import zlib
+
+from worker import celeryconfig
+from worker.config import get_probe_targets, load_yaml_config
+
+dnstester_logger = logging.getLogger('dnstester')
+
+_config = None
+_config_mtime = None
+
+
+def load_probes():
+    """
+    Return (probes settings, probe targets) of CONFIG_PATH, loaded again when
+    the file changes. An invalid new version is ignored once a valid one was
+    loaded. The settings are None when the configuration has no probes section.
+    """
+    global _config, _config_mtime
+    try:
+        mtime = os.stat(celeryconfig.CONFIG_PATH).st_mtime_ns
+    except OSError:
+        if _config is None:
+            raise
+        # being replaced
+        mtime = _config_mtime
+    if _config is None or mtime != _config_mtime:
+        _config_mtime = mtime
+        try:
+            _config = load_yaml_config(celeryconfig.CONFIG_PATH)
+        except Exception as e:
+            if _config is None:
+                raise
+            dnstester_logger.error(f"configuration {celeryconfig.CONFIG_PATH} not reloaded, keeping the current probes: {e}")
+    return _config.probes, get_probe_targets(_config)
+
+
+def probe_phase(target: str, interval: int) -> float:
+    """
+    Stable offset of a target within its interval, so that the probes of all
+    servers are spread over the interval instead of firing at the same second.
+    """
+    return zlib.crc32(target.encode()) % (interval * 1000) / 1000
+
+
+def due_probes(targets: list, window_start: float, window_end: float) -> list[tuple[dict, float]]:
+    """
+    Return the (target, due time) of the probes falling in [window_start, window_end).
+    """
+    due = []
+    for target in targets:
+        interval = target["interval"]
+        due_at = window_start + (probe_phase(target["target"], interval) - window_start) % interval
+        while due_at < window_end:
+            due.append((target, due_at))
+            due_at += interval
+    return due
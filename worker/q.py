@@ -1,28 +1,12 @@
-import subprocess
+import asyncio
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 
 import worker.metrics
-
-# Mapping des rcode et types DNS
-RCODE_MAPPING = {
-    0: "NOERROR",
-    2: "SERVFAIL",
-    3: "NXDOMAIN",
-    5: "REFUSED",
-}
-
-TYPE_MAPPING = {
-    1: "A",
-    2: "NS",
-    5: "CNAME",
-    6: "SOA",
-    12: "PTR",
-    15: "MX",
-    16: "TXT",
-    28: "AAAA"
-}
+from worker import celeryconfig, engine, health, history, latency, native
+from worker.cache import get_cache
+from worker.dnswire import rcode_name, type_name
 
 PROTOCOL_MAPPING = {
     "udp://": "Do53",
@@ -34,6 +18,44 @@ PROTOCOL_MAPPING = {
 
 dnstester_logger = logging.getLogger('dnstester')
 
+def _q_fields(*keys):
+    """
+    Extractor joining the given fields of a q answer, in presentation order.
+    """
+    return lambda ans: " ".join(str(ans.get(key, "")) for key in keys)
+
+
+def _q_txt(ans):
+    txt = ans.get("txt") or []
+    return "".join(txt) if isinstance(txt, list) else str(txt)
+
+
+def _q_caa(ans):
+    return f'{ans.get("flag", 0)} {ans.get("tag", "")} "{ans.get("value", "")}"'
+
+
+def _q_generic(ans):
+    # every rdata field, in the order q prints them
+    return " ".join(str(value) for key, value in ans.items() if key != "hdr") or "Unknown"
+
+
+# Value of a q answer (miekg/dns JSON), per type code; same format as the native decoders
+Q_VALUE_EXTRACTORS = {
+    1: _q_fields("a"),
+    2: _q_fields("ns"),
+    5: _q_fields("target"),
+    6: _q_fields("ns", "mbox", "serial", "refresh", "retry", "expire", "minttl"),
+    12: _q_fields("ptr"),
+    15: _q_fields("preference", "mx"),
+    16: _q_txt,
+    28: _q_fields("aaaa"),
+    33: _q_fields("priority", "weight", "port", "target"),
+    39: _q_fields("target"),
+    99: _q_txt,
+    257: _q_caa,
+}
+
+
 def get_dns_protocol_from_target(target: str) -> str:
     try:
         scheme = target.split("://")[0] + "://"
@@ -41,14 +63,53 @@ def get_dns_protocol_from_target(target: str) -> str:
     except Exception:
         return "Unknown"
     
-def _query_server(domain, qtype, server, tls_insecure_skip_verify, retries=3):
+async def _query_server_native(domain, qtype, server, tls_insecure_skip_verify, retries=3, timeout=None):
+    result = {}
+    timeout = timeout or celeryconfig.DNS_QUERY_TIMEOUT
+    for attempt in range(retries):
+        try:
+            # back off like a retransmission timer when the adaptive timeout was too short
+            attempt_timeout = min(timeout * 2 ** attempt, celeryconfig.DNS_QUERY_TIMEOUT)
+            response, meta = await native.query(domain, qtype, server["target"], attempt_timeout, tls_insecure_skip_verify)
+            question = response["question"][0] if response["question"] else {}
+            result = {
+                "command_status": "ok",
+                **meta,
+                "dns_protocol": get_dns_protocol_from_target(server["target"]),
+                "tags": server.get("tags", ""),
+                "rcode": rcode_name(response["rcode"]),
+                "name": question.get("name", "Unknown"),
+                "qtype": type_name(question.get("qtype")),
+                "answers": [
+                    {
+                        "name": ans["name"],
+                        "type": type_name(ans["rrtype"]),
+                        "ttl": ans["ttl"],
+                        "value": ans["value"]
+                    }
+                    for ans in response["answer"]
+                ]
+            }
+            break
+        except Exception as e:
+            result = {
+                "command_status": "error",
+                "error": str(e) or e.__class__.__name__
+            }
+            dnstester_logger.info(f"Attempt {attempt + 1} retry resolution for {domain} on {server['target']}")
+
+    return server["target"], result
+
+
+async def _query_server_q(domain, qtype, server, tls_insecure_skip_verify, retries=3, timeout=None):
     result = {}
+    timeout = timeout or celeryconfig.DNS_QUERY_TIMEOUT
     try:
         server_addr = server["target"]
         if server_addr.startswith("udp://"):
             server_addr = server_addr.replace("udp://", "")
 
-        cmd = ["q", "--format=json", "--timeout=3s", "@" + server_addr, domain, qtype]
+        cmd = ["q", "--format=json", f"--timeout={timeout:g}s", "@" + server_addr, domain, qtype]
 
         if qtype == "PTR":
             cmd.append("-x")
@@ -59,8 +120,13 @@ def _query_server(domain, qtype, server, tls_insecure_skip_verify, retries=3):
                         
         dnstester_logger.debug(f"Executing command: {' '.join(cmd)}")
         for attempt in range(retries):
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = process.communicate()
+            process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            try:
+                stdout, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                # per-server deadline reached, do not leave q running
+                process.kill()
+                raise
 
             if stdout:
                 dnstester_logger.debug(f"output from q command: {stdout.decode('utf-8')}")
@@ -79,10 +145,10 @@ def _query_server(domain, qtype, server, tls_insecure_skip_verify, retries=3):
                     replies = first_output.get("replies", [])
 
                     rcode_num = replies[0]["rcode"] if replies and "rcode" in replies[0] else "Unknown"
-                    rcode_text = RCODE_MAPPING.get(rcode_num, "Unknown")
+                    rcode_text = rcode_name(rcode_num)
 
                     qtype_num = first_output["queries"][0]["question"][0]["qtype"] if first_output.get("queries") else "Unknown"
-                    qtype_text = TYPE_MAPPING.get(qtype_num, "Unknown")
+                    qtype_text = type_name(qtype_num)
 
                     formatted_output = {
                         "dns_protocol": get_dns_protocol_from_target(server["target"]),
@@ -96,12 +162,12 @@ def _query_server(domain, qtype, server, tls_insecure_skip_verify, retries=3):
                     for reply in replies:
                         if "answer" in reply and reply["answer"]:
                             for ans in reply["answer"]:
-                                value = next((ans.get(k) for k in ["a", "aaaa", "ptr", "ns", "target", "txt", "mx", "soa"] if ans.get(k)), "Unknown")
+                                rrtype = ans["hdr"]["rrtype"]
                                 formatted_output["answers"].append({
                                     "name": ans["hdr"]["name"],
-                                    "type": TYPE_MAPPING.get(ans["hdr"]["rrtype"], "Unknown"),
+                                    "type": type_name(rrtype),
                                     "ttl": ans["hdr"]["ttl"],
-                                    "value": value
+                                    "value": Q_VALUE_EXTRACTORS.get(rrtype, _q_generic)(ans)
                                 })
 
                     result = {
@@ -125,34 +191,333 @@ def _query_server(domain, qtype, server, tls_insecure_skip_verify, retries=3):
     return server["target"], result
 
 
-def run_q(domain, qtype, dns_servers, tls_insecure_skip_verify):
-    dnstester_logger.debug(f"run_q called with: {domain} {qtype} {dns_servers} {tls_insecure_skip_verify}")
+async def _query_server(domain, qtype, server, tls_insecure_skip_verify, backend=None):
+    """
+    Query one server with the configured backend. The native backend speaks
+    Do53 and, with pooled connections, DoT/DoH/DoQ when their libraries are
+    installed; anything else goes through q.
+
+    Queries wait for a slot of the process-wide concurrency limit and must
+    complete within DNS_SERVER_DEADLINE seconds, retries included.
+
+    The per-attempt timeout adapts to the RTT observed on the target, and
+    targets whose circuit breaker is open are skipped without being queried
+    (command_status "skipped").
+    """
+    target = server["target"]
+    tracker = health.get_tracker()
+    if not tracker.allow(target):
+        return target, {
+            **tracker.skipped_result(target),
+            "dns_protocol": get_dns_protocol_from_target(target),
+            "tags": server.get("tags", ""),
+        }
+
+    backend = backend or celeryconfig.DNS_BACKEND
+    timeout = tracker.timeout(target)
+    if backend == "native" and native.supports(target):
+        query = _query_server_native(domain, qtype, server, tls_insecure_skip_verify, timeout=timeout)
+    else:
+        query = _query_server_q(domain, qtype, server, tls_insecure_skip_verify, timeout=timeout)
+
+    try:
+        async with engine.limiter():
+            try:
+                server_target, result = await asyncio.wait_for(query, celeryconfig.DNS_SERVER_DEADLINE)
+            except asyncio.TimeoutError:
+                server_target, result = target, {
+                    "command_status": "error",
+                    "error": f"Deadline of {celeryconfig.DNS_SERVER_DEADLINE:g}s exceeded"
+                }
+    except asyncio.CancelledError:
+        # also when cancelled while waiting for a slot: the query never ran
+        query.close()
+        tracker.get(target).release()
+        raise
+
+    tracker.record(target, result)
+    return server_target, result
+
+
+async def _resolve(domain, qtype, server, tls_insecure_skip_verify, backend=None, on_result=None,
+                   cache=None, bypass_cache=False, max_staleness=0):
+    """
+    Resolve on one server, from the answer cache when possible.
+    """
+    result = None
+    if cache is not None and not bypass_cache:
+        result = await cache.get(server["target"], domain, qtype, max_staleness)
+    if result is not None:
+        server_target = server["target"]
+        result["tags"] = server.get("tags", "")
+    else:
+        server_target, result = await _query_server(domain, qtype, server, tls_insecure_skip_verify, backend)
+        if cache is not None:
+            await cache.set(server_target, domain, qtype, result)
+    if on_result is not None:
+        await on_result(server_target, result)
+    return server_target, result
+
+
+async def _fan_out(domain, qtype, dns_servers, tls_insecure_skip_verify, backend=None, on_result=None,
+                   bypass_cache=False, max_staleness=0):
+    cache = get_cache() if celeryconfig.DNS_CACHE_ENABLED else None
+    return await asyncio.gather(*(
+        _resolve(domain, qtype, server, tls_insecure_skip_verify, backend, on_result, cache, bypass_cache, max_staleness)
+        for server in dns_servers
+    ))
+
 
-    results = {}
+def _unanswered_result(server, queried: bool) -> dict:
+    return {
+        "command_status": "unanswered",
+        "dns_protocol": get_dns_protocol_from_target(server["target"]),
+        "tags": server.get("tags", ""),
+        "error": "Cancelled, the lookup completed before this server answered" if queried
+        else "Not queried, the lookup completed before this server was needed",
+    }
 
-    with ThreadPoolExecutor(max_workers=len(dns_servers)) as executor:
-        futures = [
-            executor.submit(_query_server, domain, qtype, server, tls_insecure_skip_verify)
-            for server in dns_servers
-        ]
 
-        for future in as_completed(futures):
-            server_target, result = future.result()
+async def _first_answers(domain, qtype, dns_servers, tls_insecure_skip_verify, backend=None, on_result=None,
+                         first_answers=None, deadline=None, hedge=False, bypass_cache=False, max_staleness=0):
+    """
+    Resolve until first_answers servers answered NOERROR (all the servers
+    when None) or deadline seconds have passed, then cancel the outstanding
+    queries.
+
+    Without hedge, all the servers are queried at once. With hedge, only the
+    first first_answers servers are, and the next server of the list is
+    queried when one of them fails, or has not answered after the estimated
+    95th percentile of its RTT.
+    """
+    loop = asyncio.get_running_loop()
+    cache = get_cache() if celeryconfig.DNS_CACHE_ENABLED else None
+    tracker = health.get_tracker()
+    needed = first_answers or len(dns_servers)
+    spare = list(dns_servers)
+    running, hedge_at, results = {}, {}, {}
+    answered = 0
+
+    def launch():
+        server = spare.pop(0)
+        task = asyncio.create_task(_resolve(
+            domain, qtype, server, tls_insecure_skip_verify, backend, on_result, cache, bypass_cache, max_staleness,
+        ))
+        running[task] = server
+        if hedge:
+            hedge_at[task] = loop.time() + tracker.hedge_delay(server["target"])
+
+    for _ in range(min(needed, len(spare)) if hedge else len(spare)):
+        launch()
+    stop_at = loop.time() + deadline if deadline else None
+
+    while running and answered < needed:
+        wake_at = [at for at in (min(hedge_at.values(), default=None), stop_at) if at is not None]
+        timeout = max(0.0, min(wake_at) - loop.time()) if wake_at else None
+        done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            running.pop(task)
+            hedge_at.pop(task, None)
+            server_target, result = task.result()
             results[server_target] = result
+            if result.get("command_status") == "ok" and result.get("rcode") == "NOERROR":
+                answered += 1
+            elif hedge and spare:
+                launch()
 
-    # Update Prometheus metrics
+        now = loop.time()
+        if stop_at is not None and now >= stop_at:
+            break
+        for task, at in list(hedge_at.items()):
+            if at > now:
+                continue
+            del hedge_at[task]
+            if spare:
+                worker.metrics.dns_hedged_queries.inc()
+                launch()
+
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+
+    for server in dns_servers:
+        if server["target"] not in results:
+            results[server["target"]] = _unanswered_result(server, queried=server not in spare)
+    worker.metrics.dns_unanswered_queries.inc(len(running))
+    return [(server["target"], results[server["target"]]) for server in dns_servers]
+
+
+def _update_metrics(results):
     for server, result in results.items():
-        if result.get("command_status") == "ok":
+        # answers served from the cache are counted by the cache metrics only
+        if result.get("command_status") == "ok" and not result.get("cached"):
             response_time_sec = result["time_ms"] / 1000
 
             worker.metrics.dns_total_queries.labels(server=server).inc()
             worker.metrics.dns_response_time.labels(server=server).observe(response_time_sec)
             worker.metrics.dns_avg_response_time.labels(server=server).set(response_time_sec)
             worker.metrics.dns_query_types_count.labels(qtype=result["qtype"]).inc()
+            if celeryconfig.LATENCY_SKETCHES:
+                latency.record(server, result.get("dns_protocol"), result["qtype"], result["time_ms"])
 
             if result["rcode"] == "NOERROR":
                 worker.metrics.dns_noerror_count.labels(server=server).inc()
             else:
                 worker.metrics.dns_failure_count.labels(server=server, rcode=result["rcode"]).inc()
 
-    return results
\ No newline at end of file
+
+async def _fan_out_qtypes(domain, qtypes, dns_servers, tls_insecure_skip_verify, backend=None, on_result=None,
+                          deadline=None, bypass_cache=False, max_staleness=0):
+    """
+    Resolve every qtype on every server in a single fan-out, the queries of a
+    server sharing its pooled connection and health state. Results are
+    grouped by server, then by qtype; those missing after deadline seconds
+    have command_status "unanswered".
+    """
+    cache = get_cache() if celeryconfig.DNS_CACHE_ENABLED else None
+
+    def tagged(qtype):
+        # streamed results must say which query they answer
+        async def on_qtype_result(server_target, result):
+            result.setdefault("qtype", qtype)
+            if on_result is not None:
+                await on_result(server_target, result)
+        return on_qtype_result
+
+    tasks = {
+        asyncio.create_task(_resolve(
+            domain, qtype, server, tls_insecure_skip_verify, backend, tagged(qtype), cache, bypass_cache, max_staleness,
+        )): (server["target"], qtype)
+        for server in dns_servers for qtype in qtypes
+    }
+    if not tasks:
+        return {}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    worker.metrics.dns_unanswered_queries.inc(len(pending))
+
+    answered = {tasks[task]: task.result()[1] for task in done}
+    return {
+        server["target"]: {
+            qtype: answered.get((server["target"], qtype)) or {**_unanswered_result(server, queried=True), "qtype": qtype}
+            for qtype in qtypes
+        }
+        for server in dns_servers
+    }
+
+
+def split_by_qtype(results: dict) -> dict:
+    """
+    Results of a multi-qtype lookup ({target: {qtype: result}}) as {qtype: {target: result}}.
+    """
+    by_qtype = {}
+    for target, qtype_results in results.items():
+        for qtype, result in qtype_results.items():
+            by_qtype.setdefault(qtype, {})[target] = result
+    return by_qtype
+
+
+def server_results(results: dict):
+    """
+    Yield the (target, result) of a lookup, one per qtype for multi-qtype lookups.
+    """
+    for target, result in results.items():
+        if "command_status" in result:
+            yield target, result
+        else:
+            for qtype_result in result.values():
+                yield target, qtype_result
+
+
+def run_q(domain, qtype, dns_servers, tls_insecure_skip_verify, backend=None, on_result=None,
+          bypass_cache=False, max_staleness=0, first_answers=None, deadline=None, hedge=False):
+    """
+    Query all servers and return their results keyed by target. on_result is
+    an optional coroutine function awaited with (target, result) as soon as
+    each server answers.
+
+    When DNS_CACHE_ENABLED is set, answers whose TTL has not expired (or
+    expired less than max_staleness seconds ago) are served from the answer
+    cache, unless bypass_cache is set.
+
+    With first_answers, deadline or hedge, the lookup returns early (see
+    _first_answers) and the servers that did not answer in time have
+    command_status "unanswered".
+
+    qtype may also be a list of query types, all resolved in the same
+    fan-out: the results are then keyed by target, then by qtype. Only
+    deadline applies to such lookups.
+    """
+    dnstester_logger.debug(f"run_q called with: {domain} {qtype} {dns_servers} {tls_insecure_skip_verify}")
+
+    cache_options = {"bypass_cache": bypass_cache, "max_staleness": max_staleness}
+    if not isinstance(qtype, str):
+        if first_answers or hedge:
+            raise ValueError("first_answers and hedge only apply to single-qtype lookups")
+        results = engine.run(_fan_out_qtypes(
+            domain, qtype, dns_servers, tls_insecure_skip_verify, backend, on_result, deadline=deadline, **cache_options,
+        ))
+        by_qtype = split_by_qtype(results)
+    else:
+        if first_answers or deadline or hedge:
+            lookup = _first_answers(
+                domain, qtype, dns_servers, tls_insecure_skip_verify, backend, on_result,
+                first_answers=first_answers or (1 if hedge else None), deadline=deadline, hedge=hedge, **cache_options,
+            )
+        else:
+            lookup = _fan_out(domain, qtype, dns_servers, tls_insecure_skip_verify, backend, on_result, **cache_options)
+        results = dict(engine.run(lookup))
+        by_qtype = {qtype: results}
+
+    # Update Prometheus metrics
+    for qtype_name, qtype_results in by_qtype.items():
+        _update_metrics(qtype_results)
+        if celeryconfig.HISTORY_DIR:
+            history.record(domain, qtype_name, qtype_results)
+    if celeryconfig.LATENCY_SKETCHES:
+        latency.ensure_flusher()
+
+    return results
+
+
+async def _timed_fan_out(domain, qtype, dns_servers, tls_insecure_skip_verify, backend=None, **cache_options):
+    start_time = time.time()
+    results = dict(await _fan_out(domain, qtype, dns_servers, tls_insecure_skip_verify, backend, **cache_options))
+    return {"domain": domain, "qtype": qtype, "details": results, "duration": time.time() - start_time}
+
+
+def run_q_batch(queries, dns_servers, tls_insecure_skip_verify, backend=None, bypass_cache=False, max_staleness=0,
+                qps=None):
+    """
+    Resolve a list of (domain, qtype) against the same servers. All queries
+    share the process-wide concurrency limit instead of running one by one.
+
+    queries may be any iterable, consumed as the queries are started. With
+    qps, the queries are started at that rate, which is then the rate each
+    server receives.
+    """
+    dnstester_logger.debug(f"run_q_batch called on {len(dns_servers)} servers")
+
+    async def _gather():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for position, (domain, qtype) in enumerate(queries):
+            if qps:
+                # sleep even when behind schedule, so that the answers are still read
+                await asyncio.sleep(max(0.0, start + position / qps - loop.time()))
+            tasks.append(asyncio.create_task(_timed_fan_out(
+                domain, qtype, dns_servers, tls_insecure_skip_verify, backend,
+                bypass_cache=bypass_cache, max_staleness=max_staleness,
+            )))
+        return await asyncio.gather(*tasks)
+
+    batch_results = engine.run(_gather())
+    for item in batch_results:
+        _update_metrics(item["details"])
+        if celeryconfig.HISTORY_DIR:
+            history.record(item["domain"], item["qtype"], item["details"])
+
+    return batch_results
@@ -0,0 +1,105 @@
+import datetime
+import time
+
+from kombu import Queue
+
+import worker.metrics
+from worker import celeryconfig
+from worker.q import get_dns_protocol_from_target
+
+# Priority classes. Interactive lookups from the API get their own queue so
+# that they never wait behind the thousands of tasks of a bulk run, and each
+# queue can be consumed by a dedicated worker pool (celery worker -Q ...).
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+# With PROTOCOL_SHARDING, the servers of a lookup are split per protocol
+# family into sub-tasks sent to "<queue>-<family>" (e.g. interactive-doq),
+# so that TLS-heavy protocols can run on their own pools.
+PROTOCOL_FAMILIES = ("Do53", "DoT", "DoH", "DoQ")
+
+
+def protocol_queue(queue: str, family: str) -> str:
+    return f"{queue}-{family.lower()}"
+
+
+QUEUE_NAMES = PRIORITIES + (
+    tuple(protocol_queue(queue, family) for queue in PRIORITIES for family in PROTOCOL_FAMILIES)
+    if celeryconfig.PROTOCOL_SHARDING else ()
+)
+
+# Workers started without -Q consume from every queue
+TASK_QUEUES = tuple(Queue(name, routing_key=name) for name in QUEUE_NAMES)
+
+# Header set when a task is published, to measure the time it waited in its queue
+SENT_AT_HEADER = "dnstester_sent_at"
+
+
+def task_routes() -> dict:
+    """
+    Default queue of each task. Single lookups can be sent to another queue
+    with apply_async(queue=...).
+    """
+    return {
+        "worker.lookup.lookup_dns": {"queue": INTERACTIVE},
+        "worker.lookup.get_metrics": {"queue": INTERACTIVE},
+        "worker.lookup.lookup_dns_batch": {"queue": BULK},
+        "worker.lookup.reverse_sweep": {"queue": BULK},
+        "worker.lookup.load_test": {"queue": BULK},
+        "worker.lookup.probe_server": {"queue": BULK},
+        "worker.lookup.dispatch_probes": {"queue": BULK},
+        "worker.lookup.maintain_history": {"queue": BULK},
+    }
+
+
+def stamp_sent_at(headers: dict):
+    headers.setdefault(SENT_AT_HEADER, time.time())
+
+
+def observe_wait(request):
+    """
+    Record how long a task waited in its queue, from its publication (or its
+    ETA for delayed tasks) to its start on a worker.
+    """
+    sent_at = getattr(request, SENT_AT_HEADER, None)
+    if sent_at is None:
+        return
+    queue = (request.delivery_info or {}).get("routing_key") or "unknown"
+    eta = request.eta
+    if eta:
+        # delayed tasks (probes) only start waiting at their ETA
+        if isinstance(eta, str):
+            eta = datetime.datetime.fromisoformat(eta)
+        sent_at = max(sent_at, eta.timestamp())
+    worker.metrics.dns_queue_wait_time.labels(queue=queue).observe(max(0.0, time.time() - sent_at))
+
+
+def queue_depths(app) -> dict:
+    """
+    Number of messages waiting in each queue of the broker.
+    """
+    depths = {}
+    with app.connection_for_read() as conn:
+        # fail fast: this runs on every scrape
+        conn.ensure_connection(max_retries=1)
+        channel = conn.default_channel
+        for queue in TASK_QUEUES:
+            try:
+                depths[queue.name] = channel.queue_declare(queue=queue.name, passive=True).message_count
+            except conn.channel_errors:
+                # not declared yet: nothing was ever sent to it
+                depths[queue.name] = 0
+    return depths
+
+
+def split_by_protocol(dns_servers: list) -> dict:
+    """
+    Group servers by protocol family, in the order of the list. Targets of
+    an unknown scheme go with Do53.
+    """
+    shards = {}
+    for server in dns_servers:
+        family = get_dns_protocol_from_target(server["target"])
+        shards.setdefault(family if family in PROTOCOL_FAMILIES else "Do53", []).append(server)
+    return shards
@@ -0,0 +1,18 @@
+import asyncio
+
+import redis.asyncio
+
+from worker import celeryconfig
+
+_clients = {}
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    """
+    Redis client bound to the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = redis.asyncio.Redis.from_url(celeryconfig.DNSTESTER_REDIS_URL)
+    return client
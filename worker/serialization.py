@@ -0,0 +1,106 @@
+import datetime
+import uuid
+from collections import Counter
+
+import msgpack
+from kombu.serialization import register
+
+try:
+    from compression import zstd  # Python 3.14+
+    ZSTD_AVAILABLE = True
+except ImportError:
+    try:
+        import zstandard as zstd
+        ZSTD_AVAILABLE = True
+    except ImportError:
+        ZSTD_AVAILABLE = False
+
+from worker import celeryconfig
+
+# Compact result encoding: msgpack, with the strings repeated in a result
+# (server targets, tags, field names, rcodes...) stored once in a table and
+# referenced by index, and zstd compression above a size threshold.
+SERIALIZER_NAME = "dnstester-compact"
+CONTENT_TYPE = "application/x-dnstester-compact"
+
+# First byte of an encoded payload
+FORMAT_RAW = b"\x01"
+FORMAT_ZSTD = b"\x02"
+
+# msgpack extension type of a reference to the string table
+EXT_INTERNED = 1
+
+# Strings shorter than this cost less inline than as a reference
+MIN_INTERNED_LENGTH = 3
+
+
+def _count_strings(obj, counter: Counter):
+    if isinstance(obj, str):
+        counter[obj] += 1
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            _count_strings(key, counter)
+            _count_strings(value, counter)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _count_strings(value, counter)
+
+
+def _intern(obj, index: dict):
+    if isinstance(obj, str):
+        position = index.get(obj)
+        if position is None:
+            return obj
+        return msgpack.ExtType(EXT_INTERNED, position.to_bytes((position.bit_length() + 7) // 8 or 1, "little"))
+    if isinstance(obj, dict):
+        return {_intern(key, index): _intern(value, index) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_intern(value, index) for value in obj]
+    return obj
+
+
+def _default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not serializable")
+
+
+def dumps(obj) -> bytes:
+    counter = Counter()
+    _count_strings(obj, counter)
+    # Most repeated strings first, so that they get the shortest references
+    table = [s for s, count in counter.most_common() if count > 1 and len(s) >= MIN_INTERNED_LENGTH]
+    index = {s: position for position, s in enumerate(table)}
+
+    data = msgpack.packb(table, use_bin_type=True) + msgpack.packb(_intern(obj, index), use_bin_type=True, default=_default)
+    if ZSTD_AVAILABLE and len(data) >= celeryconfig.RESULT_COMPRESSION_THRESHOLD:
+        return FORMAT_ZSTD + zstd.compress(data)
+    return FORMAT_RAW + data
+
+
+def loads(data: bytes):
+    if data[:1] == FORMAT_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstd compressed result but no zstd module is available")
+        data = zstd.decompress(data[1:])
+    elif data[:1] == FORMAT_RAW:
+        data = data[1:]
+    else:
+        raise ValueError("unknown compact result format")
+
+    table = []
+
+    def ext_hook(code, payload):
+        if code == EXT_INTERNED:
+            return table[int.from_bytes(payload, "little")]
+        return msgpack.ExtType(code, payload)
+
+    unpacker = msgpack.Unpacker(ext_hook=ext_hook, raw=False, strict_map_key=False)
+    unpacker.feed(data)
+    table.extend(next(unpacker))
+    return next(unpacker)
+
+
+register(SERIALIZER_NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
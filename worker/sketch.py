@@ -0,0 +1,47 @@
+import math
+from collections import Counter
+
+# Quantiles estimated from the sketches are within 1% of the true value
+RELATIVE_ACCURACY = 0.01
+# Smaller values (in ms) are counted in the lowest bucket
+MIN_VALUE = 0.001
+
+
+class LatencySketch:
+    """
+    DDSketch-style quantile sketch. Values are counted in logarithmic
+    buckets whose width is proportional to their value, so memory depends
+    on the range of values (a few hundred buckets for 1 µs to 1 min) and
+    not on their number. Sketches with the same accuracy merge by adding
+    their bucket counts.
+    """
+
+    def __init__(self, bins: dict = None, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = Counter(bins or {})
+
+    def key(self, value: float) -> int:
+        return math.ceil(math.log(max(value, MIN_VALUE)) / self.log_gamma)
+
+    def add(self, value: float, count: int = 1):
+        self.bins[self.key(value)] += count
+
+    def merge(self, other: "LatencySketch"):
+        self.bins.update(other.bins)
+
+    @property
+    def count(self) -> int:
+        return sum(self.bins.values())
+
+    def quantile(self, q: float) -> float | None:
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        cumulative = 0
+        for key in sorted(self.bins):
+            cumulative += self.bins[key]
+            if cumulative > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
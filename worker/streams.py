@@ -0,0 +1,49 @@
+import json
+import logging
+
+import redis
+
+from worker import celeryconfig
+from worker.redis_client import get_async_redis
+
+# Partial results of a task are appended to a Redis stream as soon as each
+# server answers, so that late readers can still replay them from the start.
+STREAM_PREFIX = "dnstester:stream:"
+
+dnstester_logger = logging.getLogger('dnstester')
+
+
+def stream_key(task_id: str) -> str:
+    return f"{STREAM_PREFIX}{task_id}"
+
+
+async def publish(task_id: str, event: str, data: dict):
+    """
+    Append an event to the stream of a task. Errors are logged, a lookup
+    never fails because its partial results could not be published.
+    """
+    key = stream_key(task_id)
+    try:
+        client = get_async_redis()
+        await client.xadd(key, {"event": event, "data": json.dumps(data)}, maxlen=celeryconfig.RESULT_STREAM_MAXLEN, approximate=True)
+        await client.expire(key, celeryconfig.RESULT_STREAM_TTL)
+    except redis.RedisError as e:
+        dnstester_logger.warning(f"unable to publish {event} event for task {task_id}: {e}")
+
+
+async def read(task_id: str, last_id: str = "0", block_ms: int = 1000) -> list[tuple[str, str, dict]]:
+    """
+    Read the events published after last_id, waiting up to block_ms for new ones.
+    Returns a list of (entry id, event, data).
+    """
+    client = get_async_redis()
+    entries = await client.xread({stream_key(task_id): last_id}, block=block_ms, count=100)
+    events = []
+    for _, messages in entries:
+        for entry_id, fields in messages:
+            events.append((entry_id.decode(), fields[b"event"].decode(), json.loads(fields[b"data"])))
+    return events
+
+
+async def exists(task_id: str) -> bool:
+    return bool(await get_async_redis().exists(stream_key(task_id)))
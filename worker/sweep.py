@@ -0,0 +1,38 @@
+import ipaddress
+
+# A sweep over a prefix is split in chunks described by their first address
+# and size: neither the API nor the broker ever holds the address list, and
+# each worker expands its own chunk as it sends the queries.
+
+
+def chunk_bounds(network, chunk_size: int):
+    """
+    Yield the (first address, number of addresses) of the chunks of network.
+    """
+    first = network.network_address
+    total = network.num_addresses
+    for offset in range(0, total, chunk_size):
+        yield str(first + offset), min(chunk_size, total - offset)
+
+
+def addresses(first: str, count: int):
+    start = ipaddress.ip_address(first)
+    for offset in range(count):
+        yield str(start + offset)
+
+
+def ptr_row(ip: str, details: dict) -> dict:
+    """
+    Compact result of one address: the PTR names and the rcode (or the
+    command_status when the query failed) returned by each server.
+    """
+    row = {"ip": ip, "ptr": {}, "rcode": {}}
+    for target, result in details.items():
+        if result.get("command_status") != "ok":
+            row["rcode"][target] = result.get("command_status")
+            continue
+        row["rcode"][target] = result.get("rcode")
+        names = [answer["value"] for answer in result.get("answers") or () if answer["type"] == "PTR"]
+        if names:
+            row["ptr"][target] = names
+    return row